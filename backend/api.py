@@ -1,19 +1,34 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Header, HTTPException, UploadFile, File, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 import uvicorn
 import os
 import asyncio
+import datetime
+import json
+import logging
+import random
+import secrets
+from email.utils import format_datetime, parsedate_to_datetime
 from session import session_manager
 from gatekeeper import gatekeeper_service
 from upload import save_upload_file, cleanup_uploads
-from upload import save_upload_file, cleanup_uploads
 from bot import bot_instance
 from scraper import scraper_instance
+from browser import browser_pool
+import metrics
+import pipeline
+from database import AsyncSessionLocal
+from order_index import open_orders_index
+from services.asaas import asaas_service
+from services.webhooks import webhook_worker
 
 from routers import orders, proposals, payments, chat, documents, reviews
 
 app = FastAPI(title="Despachante Digital API")
+logger = logging.getLogger("api")
 
 app.include_router(orders.router)
 app.include_router(proposals.router)
@@ -25,22 +40,72 @@ app.include_router(reviews.router)
 
 @app.on_event("startup")
 async def startup_event():
-    # Create tables
-    import models
-    from database import engine
-    models.Base.metadata.create_all(bind=engine)
+    # Create/upgrade tables through the alembic migrations
+    from database import run_migrations
+    await asyncio.to_thread(run_migrations)
+    
+    # Serve the last persisted pipeline snapshot until the next refresh
+    await pipeline.load_cache()
+
+    # Dispatcher feed answers from memory
+    async with AsyncSessionLocal() as db:
+        await open_orders_index.load(db)
+
+    # One pooled (keep-alive) HTTP client for every Asaas call
+    await asaas_service.start()
+
+    # Applies recorded Asaas webhooks in batches, starting with any left from the last run
+    webhook_worker.start()
+    
+    # Pre-create the shared browser and a few warm contexts for bot/scraper leases
+    try:
+        await browser_pool.start()
+    except Exception as e:
+        # API still serves the marketplace routes without a browser, pool retries on first lease
+        logger.warning(f"Browser pool warm-up failed: {e}")
     
     # Start background task for cleanup
     asyncio.create_task(cleanup_loop())
+    
+    # Keep the pipeline snapshot warm (disabled unless PIPELINE_REFRESH_INTERVAL is set)
+    if PIPELINE_REFRESH_INTERVAL > 0:
+        asyncio.create_task(pipeline_refresh_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await bot_instance.close()
+    await scraper_instance.close()
+    await browser_pool.close()
+    await webhook_worker.stop()
+    await asaas_service.close()
 
 async def cleanup_loop():
     while True:
-        session_manager.cleanup_old_sessions()
-        # Also clean uploads for expired sessions? 
-        # Ideally session manager would return ID of expired sessions to clean their uploads.
-        # For now, simplistic approach.
+        # Free the browser context and uploads held by expired sessions
+        for session_id in session_manager.cleanup_old_sessions():
+            await bot_instance.release(session_id)
+            cleanup_uploads(session_id)
         await asyncio.sleep(60) # Check every minute
 
+# Background pipeline refresh, in seconds. Jitter spreads the scrapes so several
+# workers don't hit the portal at the same moment.
+PIPELINE_REFRESH_INTERVAL = int(os.getenv("PIPELINE_REFRESH_INTERVAL", "0"))
+PIPELINE_REFRESH_MIN_INTERVAL = int(os.getenv("PIPELINE_REFRESH_MIN_INTERVAL", "120"))
+PIPELINE_REFRESH_JITTER = float(os.getenv("PIPELINE_REFRESH_JITTER", "0.1"))
+
+async def pipeline_refresh_loop():
+    interval = max(PIPELINE_REFRESH_INTERVAL, PIPELINE_REFRESH_MIN_INTERVAL)
+    while True:
+        await asyncio.sleep(interval * (1 + random.uniform(-PIPELINE_REFRESH_JITTER, PIPELINE_REFRESH_JITTER)))
+        # An operator refreshed recently, the snapshot is still fresh enough
+        age = pipeline.cache_age()
+        if age is not None and age < PIPELINE_REFRESH_MIN_INTERVAL:
+            continue
+        try:
+            await pipeline.refresh(scraper_instance)
+        except Exception as e:
+            logger.warning(f"Scheduled pipeline refresh failed: {e}")
+
 # Allow CORS for Electron frontend
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +113,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the pipeline dashboard, see get_pipeline_data
+    expose_headers=["X-Pipeline-Refreshed-At", "Age"],
 )
 
 class SessionStartResponse(BaseModel):
@@ -71,53 +138,85 @@ async def upload_document(session_id: str, file: UploadFile = File(...)):
     if not session_manager.get_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
-    file_path = await save_upload_file(file, session_id)
-    return {"status": "uploaded", "path": file_path}
+    stored = await save_upload_file(file, session_id)
+    return {"status": "uploaded", "path": stored.path, "size": stored.size, "sha256": stored.sha256}
 
 @app.post("/login/govbr/start")
-async def start_govbr_login():
-    # Trigger bot to go to login page
-    success = await bot_instance.navigate_to_gov_br()
+async def start_govbr_login(
+    session_id: str = Query(..., description="Id returned by /session/start"),
+    resume_token: Optional[str] = Header(None, alias="X-Resume-Token"),
+):
+    """
+    Opens the Gov.br login for a session: restores a saved login when X-Resume-Token
+    is still valid, otherwise navigates to the QR code (see /login/govbr/qr/{session_id}).
+    session_id is required (422 without it, 404 if unknown or expired).
+    """
+    # Each session leases a browser context until it ends, only sessions we issued get one
+    if not session_manager.get_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    # Returning user: reuse the saved Gov.br login when it is still valid. The state is
+    # filed under the secret token handed to the user who logged in (see /process/start),
+    # never under something others can know or guess such as a CPF
+    if resume_token and await bot_instance.resume_login(resume_token, session_id):
+        session_manager.update_session(session_id, "resume_token", resume_token)
+        return {"status": "resumed", "message": "Saved Gov.br session restored"}
+    
+    # Trigger bot to go to login page, on the session's own browser context
+    success = await bot_instance.navigate_to_gov_br(session_id)
     if success:
-        return {"status": "navigated", "message": "Please scan QR Code"}
+        # The browser runs headless, the frontend shows the QR code from qr_url
+        return {"status": "navigated", "message": "Please scan QR Code", "qr_url": f"/login/govbr/qr/{session_id}"}
     else:
         raise HTTPException(status_code=500, detail="Failed to navigate to Gov.br")
 
+@app.get("/login/govbr/qr/{session_id}")
+async def govbr_qr_code(session_id: str):
+    if not session_manager.get_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    png = await bot_instance.qr_screenshot(session_id)
+    if png is None:
+        raise HTTPException(status_code=404, detail="Gov.br login not started")
+    # Gov.br rotates the code, poll this instead of caching it
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "no-store"})
+
 @app.post("/process/start/{session_id}")
 async def start_process(session_id: str):
     if not session_manager.get_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Simulate partial flow
-    # 1. Check login (Bot should be logged in by now if user scanned QR)
-    # is_logged_in = await bot_instance.check_login_success()
+    # 1. Check login (Bot should be logged in by now if user scanned QR, or resumed a saved login)
+    resumed_with = session_manager.get_session(session_id)["data"].get("resume_token")
+    is_logged_in = bool(resumed_with) or await bot_instance.check_login_success(session_id)
     # if not is_logged_in:
     #     return {"status": "error", "message": "Login Gov.br não detectado"}
     
     # 2. Scrape Data
-    user_data = await bot_instance.scrape_user_data()
+    user_data = await bot_instance.scrape_user_data(session_id)
+    # Keep the Gov.br login for the next visit, only once there really is one.
+    # The user gets the token back and sends it as X-Resume-Token to /login/govbr/start
+    resume_token = None
+    if is_logged_in:
+        resume_token = resumed_with or secrets.token_urlsafe(32)
+        await bot_instance.save_login_state(resume_token, session_id)
     
     # 3. Fill Municipal Form
-    result = await bot_instance.fill_vila_velha_form(user_data)
+    result = await bot_instance.fill_vila_velha_form(user_data, session_id)
     
     # 4. Cleanup
     session_manager.clear_session(session_id)
-    # await bot_instance.close() # Maybe keep open for next? Or close context.
+    await bot_instance.release(session_id)
     
-    return {"status": "success", "protocol": "DET-2025-X"}
+    return {"status": "success", "protocol": "DET-2025-X", "resume_token": resume_token}
 
 @app.post("/cleanup/{session_id}")
 async def cleanup_session(session_id: str):
     session_manager.clear_session(session_id)
+    await bot_instance.release(session_id)
     return {"status": "cleaned"}
 
 
-# In-memory storage for pipeline data (replace with DB for production)
-pipeline_cache = {
-    "data": [],
-    "last_updated": None
-}
-
 @app.post("/pipeline/refresh")
 async def refresh_pipeline():
     # In a real scenario, credentials should come from a secure store or the request
@@ -129,17 +228,100 @@ async def refresh_pipeline():
     # Future enhancement: Accept credentials in body.
     
     try:
-        data = await scraper_instance.fetch_pipeline_data()
-        pipeline_cache["data"] = data
-        import datetime
-        pipeline_cache["last_updated"] = datetime.datetime.now().isoformat()
-        return {"status": "success", "count": len(data)}
+        # Only new/changed rows (or stale ones still missing photos) visit the detail page
+        # Joins the in-flight refresh if another operator (or the scheduler) started one
+        result = await pipeline.refresh(scraper_instance)
+        # "partial": pagination stopped early, nothing was removed from the snapshot
+        return {"status": "success" if result["complete"] else "partial", **result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/pipeline/refresh/stream")
+async def refresh_pipeline_stream():
+    """
+    Same as /pipeline/refresh but streams NDJSON progress events:
+    {"event": "row"}, {"event": "checking"}, {"event": "photo"}, then "done" or "error".
+    """
+    queue = asyncio.Queue()
+    
+    async def produce():
+        try:
+            result = await pipeline.refresh(scraper_instance, emit=queue.put)
+            await queue.put({"event": "done", "status": "success" if result["complete"] else "partial", **result})
+        except Exception as e:
+            await queue.put({"event": "error", "detail": str(e)})
+        finally:
+            await queue.put(None)
+    
+    # The refresh runs to completion (and is persisted) even if the client disconnects
+    task = asyncio.create_task(produce())
+    
+    async def events():
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield json.dumps(event) + "\n"
+        await task
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/browser/pool")
+async def get_browser_pool_stats():
+    return browser_pool.stats()
+
+metrics.register("browser_pool", browser_pool.stats)
+
+@app.get("/metrics")
+async def get_metrics():
+    # DB pool checkout wait/saturation, browser pool usage
+    return metrics.snapshot()
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since (RFC 9110)
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(tzinfo=datetime.timezone.utc, microsecond=0) <= since
+    return False
+
 @app.get("/pipeline/data")
-async def get_pipeline_data():
-    return pipeline_cache
+async def get_pipeline_data(
+    request: Request,
+    situacao: Optional[str] = None,
+    flag_pago: Optional[bool] = None,
+    flag_foto: Optional[bool] = None,
+    placa: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=pipeline.MAX_PAGE_SIZE),
+):
+    # Dashboards poll this constantly: answer 304 while the snapshot is unchanged
+    etag = pipeline.snapshot_etag(str(sorted(request.query_params.multi_items())))
+    last_modified = pipeline.last_modified()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=datetime.timezone.utc), usegmt=True)
+    # When the portal was last scraped, changed or not. A header, so that 304s carry it too
+    refreshed_at = pipeline.refreshed_at()
+    if refreshed_at:
+        headers["X-Pipeline-Refreshed-At"] = pipeline.isoformat_utc(refreshed_at)
+        # Seconds since that scrape, how stale the cached data may be
+        headers["Age"] = str(int(pipeline.cache_age()))
+    
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    
+    page = pipeline.query_cache(situacao, flag_pago, flag_foto, placa, cursor, limit)
+    # Nothing time dependent in the body that the ETag doesn't cover, or 304s would
+    # keep showing a stale value: the refresh time is only in the headers
+    body = {**page, "refreshing": pipeline.is_refreshing()}
+    return JSONResponse(body, headers=headers)
 
 if __name__ == "__main__":
     uvicorn.run("api:app", host="127.0.0.1", port=8000, reload=True)
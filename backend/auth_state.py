@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, Optional
+
+# Saved Playwright storage states (cookies + localStorage) per portal account.
+# Files hold live session tokens: keep the directory out of git and backups.
+AUTH_STATE_DIR = os.getenv("AUTH_STATE_DIR", "auth_state")
+
+
+class StorageStateStore:
+    def __init__(self, directory: str = AUTH_STATE_DIR):
+        self.directory = directory
+
+    def _path(self, portal: str, account: str) -> str:
+        # Account ids may be CPFs/CNPJs, don't put them in file names as-is
+        digest = hashlib.sha256(account.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, re.sub(r"[^a-z0-9_-]", "", portal.lower()), f"{digest}.json")
+
+    def load(self, portal: str, account: str) -> Optional[Dict]:
+        try:
+            with open(self._path(portal, account), "r", encoding="utf-8") as f:
+                return json.load(f)["state"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, portal: str, account: str, state: Dict):
+        path = self._path(portal, account)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        # Owner-only permissions, written atomically so a crash never leaves half a file
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": time.time(), "state": state}, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, portal: str, account: str):
+        try:
+            os.remove(self._path(portal, account))
+        except FileNotFoundError:
+            pass
+
+
+auth_state_store = StorageStateStore()
@@ -0,0 +1,89 @@
+"""
+N create_payment calls against the local Asaas stub (real TCP socket, uvicorn in a
+thread): a new httpx.AsyncClient per call, as AsaasService used to do, versus the
+shared pooled client. Plain HTTP, so the per-call cost measured here is the TCP
+connect only; against the real API every new client also pays a TLS handshake.
+
+    python benchmarks/bench_asaas_client.py --calls 500 --concurrency 10 --latency-ms 5
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+
+from services.asaas import AsaasService
+from services.asaas_stub import create_stub_app
+
+PAYMENT = {"customer": "cus_000000000001", "billingType": "PIX", "value": 150.0,
+           "dueDate": "2026-01-10", "description": "Emplacamento"}
+
+
+def serve_stub(latency_ms):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_stub_app(latency_ms), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def per_call_client(base_url):
+    # What every AsaasService method did before: open, call, close
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{base_url}/payments", json=PAYMENT, headers={"access_token": "bench"})
+        response.raise_for_status()
+        return response.json()
+
+
+async def run(name, call, calls, concurrency, results):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with slots:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    latencies.sort()
+    results[name] = (time.perf_counter() - start, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)])
+
+
+async def bench(base_url, calls, concurrency):
+    results = {}
+    await run("client per call", lambda: per_call_client(base_url), calls, concurrency, results)
+
+    service = AsaasService(base_url=base_url, api_key="bench")
+    await service.start()
+    await run("pooled client", lambda: service.request("POST", "/payments", json=PAYMENT), calls, concurrency, results)
+    await service.close()
+
+    baseline = results["client per call"][0]
+    for name, (elapsed, p50, p95) in results.items():
+        print(f"{name:<18} {elapsed * 1000:9.1f} ms  {calls / elapsed:7.0f} calls/s  "
+              f"p50 {p50 * 1000:6.2f} ms  p95 {p95 * 1000:6.2f} ms  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    server, base_url = serve_stub(args.latency_ms)
+    try:
+        asyncio.run(bench(base_url, args.calls, args.concurrency))
+    finally:
+        server.should_exit = True
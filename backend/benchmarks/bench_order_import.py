@@ -0,0 +1,90 @@
+"""
+Onboarding N plates: N calls to POST /orders/ versus one POST /orders/import
+(JSON array and CSV upload), against a migrated SQLite database.
+
+    python benchmarks/bench_order_import.py --rows 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models
+from database import engine_options, get_db, run_migrations, tune_engine
+from metrics import LatencyStats
+from routers import orders
+
+
+def order(i, owner_id):
+    return {"vehicle_plate": f"PLK{i:05d}", "service_type": "emplacamento", "city": "Vitória", "state": "ES", "owner_id": owner_id}
+
+
+async def bench(db_path, rows, concurrency):
+    run_migrations(create_engine(f"sqlite:///{db_path}"))
+    url = f"sqlite+aiosqlite:///{db_path}"
+    engine = create_async_engine(url, **engine_options(url, LatencyStats(), is_async=True))
+    tune_engine(engine.sync_engine)
+    sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async with sessions() as db:
+        owner = models.User(full_name="Despachante", email="d@x.com", user_type="CLIENT")
+        db.add(owner)
+        await db.commit()
+
+    app = FastAPI()
+    app.include_router(orders.router)
+
+    async def override_get_db():
+        async with sessions() as db:
+            yield db
+    app.dependency_overrides[get_db] = override_get_db
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def single(i):
+            async with slots:
+                response = await http.post("/orders/", json=order(i, owner.id))
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(single(i) for i in range(rows)))
+        results[f"{rows} x POST /orders/"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report = (await http.post("/orders/import", json=[order(rows + i, owner.id) for i in range(rows)])).json()
+        results["POST /orders/import (JSON)"] = time.perf_counter() - start
+        assert report["created"] == rows, report
+
+        csv_body = "vehicle_plate,service_type,city,state\n" + "".join(
+            f"CSV{i:05d},emplacamento,Vitória,ES\n" for i in range(rows))
+        start = time.perf_counter()
+        report = (await http.post("/orders/import", params={"owner_id": owner.id},
+                                  files={"file": ("plates.csv", csv_body.encode(), "text/csv")})).json()
+        results["POST /orders/import (CSV)"] = time.perf_counter() - start
+        assert report["created"] == rows, report
+
+    await engine.dispose()
+    baseline = results[f"{rows} x POST /orders/"]
+    for name, elapsed in results.items():
+        print(f"{name:<30} {elapsed * 1000:9.1f} ms  {rows / elapsed:9.0f} rows/s  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(bench(os.path.join(tmp, "bench.db"), args.rows, args.concurrency))
@@ -0,0 +1,67 @@
+"""
+Page-load timings per target site with and without the resource blocking
+profiles from browser.py. Needs network access and a Chromium install.
+
+    python benchmarks/bench_resource_blocking.py --repeat 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.async_api import async_playwright
+from browser import launch_browser, new_context
+
+SITES = {
+    "placas": "https://placaswebmercosul.com.br/Login",
+    "govbr": "https://sso.acesso.gov.br/",
+    "vilavelha": "https://fibromialgia.vilavelha.es.gov.br/",
+}
+
+
+async def load_once(browser, url, block_resources):
+    context = await new_context(browser, block_resources=block_resources)
+    page = await context.new_page()
+    counts = {"requests": 0, "failed": 0}
+    page.on("request", lambda r: counts.__setitem__("requests", counts["requests"] + 1))
+    page.on("requestfailed", lambda r: counts.__setitem__("failed", counts["failed"] + 1))
+
+    start = time.perf_counter()
+    await page.goto(url, wait_until="load", timeout=60000)
+    elapsed = time.perf_counter() - start
+
+    await context.close()
+    return elapsed, counts
+
+
+async def run(repeat, headless):
+    async with async_playwright() as p:
+        browser = await launch_browser(p, headless=headless)
+        print(f"{'site':<10} {'mode':<8} {'median ms':>10} {'requests':>9} {'blocked':>8}")
+        for site, url in SITES.items():
+            baseline = None
+            for block in (False, True):
+                timings = []
+                for _ in range(repeat):
+                    elapsed, counts = await load_once(browser, url, block)
+                    timings.append(elapsed)
+                median = statistics.median(timings)
+                mode = "blocked" if block else "full"
+                print(f"{site:<10} {mode:<8} {median * 1000:>10.0f} {counts['requests']:>9} {counts['failed']:>8}")
+                if block:
+                    print(f"{site:<10} {'saving':<8} {(1 - median / baseline) * 100:>9.0f}%")
+                else:
+                    baseline = median
+        await browser.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--headed", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.repeat, headless=not args.headed))
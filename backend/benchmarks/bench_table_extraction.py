@@ -0,0 +1,79 @@
+"""
+Compares the bulk (single page.evaluate) table extraction against the original
+per-cell path on a generated orders table.
+
+    python benchmarks/bench_table_extraction.py --rows 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.async_api import async_playwright
+from scraper import PlacasScraper, parse_pipeline_row
+
+SITUACOES = ["Aguardando Pagamento", "Em Análise", "Fabricada", "Finalizada"]
+
+
+def build_table_fixture(n_rows):
+    rows = []
+    for i in range(n_rows):
+        pago = '<i class="fa fa-check"></i>' if i % 3 else ''
+        cells = [
+            '<button class="dropdown">...</button>',
+            str(7000 + i),
+            f"ABC{i % 10}D{i % 100:02d}",
+            "Carro", "Mercosul", "Par", "Vila Velha",
+            f"Proprietário {i}",
+            "01/01/2026", "ES",
+            SITUACOES[i % len(SITUACOES)],
+            pago,
+        ]
+        rows.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+    return (
+        '<html><body><div class="table-scrollable"><table><tbody>'
+        + "".join(rows)
+        + "</tbody></table></div></body></html>"
+    )
+
+
+async def run(n_rows, repeat):
+    scraper = PlacasScraper()
+    html = build_table_fixture(n_rows)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--no-sandbox"])
+        page = await browser.new_page()
+        await page.set_content(html)
+
+        results = {}
+        for name, reader in (("per-cell", scraper.read_table_per_cell), ("bulk", scraper.read_table_bulk)):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = await reader(page)
+                timings.append(time.perf_counter() - start)
+            items = [parse_pipeline_row(r) for r in rows]
+            results[name] = (min(timings), items)
+
+        await browser.close()
+
+    per_cell_time, per_cell_items = results["per-cell"]
+    bulk_time, bulk_items = results["bulk"]
+    assert per_cell_items == bulk_items, "bulk extraction differs from per-cell extraction"
+
+    print(f"rows: {n_rows}")
+    print(f"per-cell: {per_cell_time * 1000:9.1f} ms")
+    print(f"bulk:     {bulk_time * 1000:9.1f} ms")
+    print(f"speedup:  {per_cell_time / bulk_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
@@ -0,0 +1,93 @@
+"""
+Concurrent document uploads: the old synchronous shutil.copyfileobj save versus the
+streaming pipeline (upload.stream_upload), while a light endpoint is polled to show
+how long other requests wait behind the uploads.
+
+    python benchmarks/bench_uploads.py --uploads 16 --size-mb 8
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI, File, UploadFile
+
+from metrics import LatencyStats
+from upload import stream_upload
+
+
+def build_app(upload_dir):
+    app = FastAPI()
+
+    @app.post("/copyfileobj")
+    async def copyfileobj(file: UploadFile = File(...)):
+        # What upload.py and services/documents.py did before
+        path = os.path.join(upload_dir, f"{uuid.uuid4()}.pdf")
+        with open(path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        return {"path": path}
+
+    @app.post("/streaming")
+    async def streaming(file: UploadFile = File(...)):
+        stored = await stream_upload(file, os.path.join(upload_dir, f"{uuid.uuid4()}.pdf"), max_size=1 << 34)
+        return {"path": stored.path, "sha256": stored.sha256}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+async def run(http, route, body, uploads):
+    pings = LatencyStats()
+    # How late a 5 ms timer fires: time the event loop spent unable to run anything else
+    lag = LatencyStats()
+    done = asyncio.Event()
+
+    async def poll():
+        while not done.is_set():
+            with pings.time():
+                (await http.get("/ping")).raise_for_status()
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag.observe(time.perf_counter() - start - 0.005)
+
+    async def send():
+        response = await http.post(route, files={"file": ("crlv.pdf", body, "application/pdf")})
+        response.raise_for_status()
+
+    poller = asyncio.ensure_future(poll())
+    start = time.perf_counter()
+    await asyncio.gather(*(send() for _ in range(uploads)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await poller
+    return elapsed, pings.as_dict(), lag.as_dict()
+
+
+async def bench(uploads, size_mb):
+    body = b"%PDF-1.4\n" + os.urandom(size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as upload_dir:
+        transport = httpx.ASGITransport(app=build_app(upload_dir))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for route in ("/copyfileobj", "/streaming"):
+                elapsed, pings, lag = await run(http, route, body, uploads)
+                print(f"{route:<13} {uploads} x {size_mb} MB in {elapsed * 1000:8.1f} ms   "
+                      f"{pings['count']:4d} pings, /ping p99 {pings['p99_ms']:7.2f} ms   "
+                      f"loop lag p99 {lag['p99_ms']:7.2f} ms  max {lag['max_ms']:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--size-mb", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(bench(args.uploads, args.size_mb))
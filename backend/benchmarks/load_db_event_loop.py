@@ -0,0 +1,112 @@
+"""
+Event loop responsiveness under concurrent order writes: the old blocking
+Session handler versus the async session used by the routers.
+
+    python benchmarks/load_db_event_loop.py --writes 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+from database import get_db
+from routers import orders
+
+
+def build_apps(db_path):
+    sync_engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=sync_engine)
+    SyncSession = sessionmaker(bind=sync_engine)
+
+    # What every router did before: sync commit inside an async def
+    blocking = FastAPI()
+
+    @blocking.post("/orders/")
+    async def create_order_blocking(order: orders.OrderCreate):
+        db = SyncSession()
+        try:
+            db.add(models.Order(**order.model_dump(), status="OPEN"))
+            db.commit()
+        finally:
+            db.close()
+        return {"status": "ok"}
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    non_blocking = FastAPI()
+    non_blocking.include_router(orders.router)
+
+    async def override_get_db():
+        async with AsyncSession() as db:
+            yield db
+
+    non_blocking.dependency_overrides[get_db] = override_get_db
+    return {"blocking": blocking, "async": non_blocking}, async_engine
+
+
+async def measure(app, writes, concurrency):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    slots = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+
+        async def write(i):
+            async with slots:
+                await http.post("/orders/", json={
+                    "vehicle_plate": f"PLK{i:05d}", "service_type": "emplacamento",
+                    "city": "Vitória", "state": "ES", "owner_id": 1,
+                })
+
+        tick = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*(write(i) for i in range(writes)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await tick
+
+    lags.sort()
+    return {
+        "writes/s": writes / elapsed,
+        "lag p50 ms": statistics.median(lags) * 1000,
+        "lag p99 ms": lags[int(len(lags) * 0.99) - 1] * 1000 if len(lags) > 1 else lags[0] * 1000,
+        "lag max ms": lags[-1] * 1000,
+        "ticks": len(lags),
+    }
+
+
+async def main(writes, concurrency):
+    with tempfile.TemporaryDirectory() as tmp:
+        apps, async_engine = build_apps(os.path.join(tmp, "bench.db"))
+        for name, app in apps.items():
+            result = await measure(app, writes, concurrency)
+            print(f"{name:<9} " + "  ".join(f"{k}: {v:8.1f}" for k, v in result.items()))
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.writes, args.concurrency))
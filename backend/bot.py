@@ -1,71 +1,139 @@
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from playwright.async_api import BrowserContext, Page
 import asyncio
 import logging
+import os
+from typing import Dict, Optional, Tuple
+from browser import browser_pool
+from auth_state import auth_state_store
+
+GOVBR_PORTAL = "govbr"
+# Page that only answers 200 to a logged in Gov.br session (redirects to the SSO otherwise)
+GOVBR_ACCOUNT_URL = os.getenv("GOVBR_ACCOUNT_URL", "https://contas.acesso.gov.br/")
+# QR code element on the Gov.br login page, the whole page is captured if it isn't found
+GOVBR_QR_SELECTOR = os.getenv("GOVBR_QR_SELECTOR", "#qrcode, .qrcode, img[alt*='QR']")
 
 class DespachanteBot:
-    def __init__(self):
-        self.playwright = None
-        self.browser: Browser = None
-        self.context: BrowserContext = None
-        self.page: Page = None
+    def __init__(self, pool=None, state_store=None):
+        # Each API session gets its own leased context (its own Gov.br login),
+        # so concurrent users never share a page. None is the default session.
+        self.pool = pool or browser_pool
+        self.state_store = state_store or auth_state_store
+        self.sessions: Dict[Optional[str], Tuple[BrowserContext, Page]] = {}
+        self._locks: Dict[Optional[str], asyncio.Lock] = {}
         self.logger = logging.getLogger("DespachanteBot")
         logging.basicConfig(level=logging.INFO)
 
     async def start(self):
-        self.playwright = await async_playwright().start()
-        # Launch browser (headless=False to see the QR code if we mirror it, or Capture screenshot)
-        # For Gov.br via QR code, we might need to show the page or capture the QR element
-        self.browser = await self.playwright.chromium.launch(headless=False, args=["--no-sandbox"]) 
-        self.context = await self.browser.new_context()
-        self.page = await self.context.new_page()
+        # Warm up the shared browser
+        await self.pool.start()
         self.logger.info("Browser helper started")
 
-    async def navigate_to_gov_br(self):
-        if not self.page:
-            await self.start()
+    async def get_page(self, session_id: Optional[str] = None) -> Page:
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            if session_id not in self.sessions:
+                # Headless unless BROWSER_HEADLESS=0, the QR code is served as a screenshot (qr_screenshot)
+                # Gov.br keeps images/CSS so the QR element still renders (see browser.SITE_PROFILES)
+                context = await self.pool.acquire(session=True)
+                page = await context.new_page()
+                self.sessions[session_id] = (context, page)
+            return self.sessions[session_id][1]
+
+    async def resume_login(self, account: str, session_id: Optional[str] = None) -> bool:
+        """
+        Restores a saved Gov.br login instead of asking for a new QR scan. account is the
+        secret resume token the login was saved under, it authenticates the caller.
+        Returns False (and forgets the state) when there is none or it has expired.
+        """
+        state = self.state_store.load(GOVBR_PORTAL, account)
+        if not state:
+            return False
+
+        await self.release(session_id)
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            context = await self.pool.acquire(storage_state=state, session=True)
+            try:
+                # Lightweight probe through the context's own cookie jar, no page render
+                response = await context.request.get(GOVBR_ACCOUNT_URL, max_redirects=0, timeout=15000)
+                valid = response.ok
+            except Exception as e:
+                self.logger.warning(f"Gov.br session probe failed: {e}")
+                valid = False
+
+            if not valid:
+                await self.pool.release(context)
+                self.state_store.clear(GOVBR_PORTAL, account)
+                self.logger.info("Saved Gov.br session expired, QR scan needed")
+                return False
+
+            self.sessions[session_id] = (context, await context.new_page())
+            self.logger.info("Saved Gov.br session restored")
+            return True
+
+    async def save_login_state(self, account: str, session_id: Optional[str] = None):
+        # Called after each successful flow so the saved tokens stay fresh
+        entry = self.sessions.get(session_id)
+        if entry:
+            self.state_store.save(GOVBR_PORTAL, account, await entry[0].storage_state())
+
+    async def navigate_to_gov_br(self, session_id: Optional[str] = None):
         try:
+            page = await self.get_page(session_id)
             # Real URL for Gov.br login
-            await self.page.goto("https://sso.acesso.gov.br/", timeout=60000)
+            await page.goto("https://sso.acesso.gov.br/", timeout=60000)
             self.logger.info("Navigated to Gov.br")
-            # Logic to find QR code element would be:
-            # qr_element = await self.page.query_selector('.qr-code-class')
-            # return await qr_element.screenshot(path="qrcode.png")
+            # The browser is headless, the user scans the QR through qr_screenshot()
             return True
         except Exception as e:
             self.logger.error(f"Error navigating: {e}")
             return False
 
-    async def check_login_success(self):
+    async def qr_screenshot(self, session_id: Optional[str] = None) -> Optional[bytes]:
+        """PNG of the session's Gov.br QR code, taken on each call since Gov.br rotates it. None without a page."""
+        entry = self.sessions.get(session_id)
+        if not entry:
+            return None
+        page = entry[1]
+        element = await page.query_selector(GOVBR_QR_SELECTOR)
+        return await (element or page).screenshot(type="png")
+
+    async def check_login_success(self, session_id: Optional[str] = None):
         # Stub: Toggle this based on time or manual trigger in dev
         # In prod: Check if URL changed to "minhaconta" or similar
         try:
-            if "minhaconta" in self.page.url:
+            if "minhaconta" in self.sessions[session_id][1].url:
                 return True
         except:
             pass
         return False
 
-    async def scrape_user_data(self):
+    async def scrape_user_data(self, session_id: Optional[str] = None):
         # navigate to data page
         # scrape Name, CPF
         return {"name": "João da Silva", "cpf": "123.456.789-00"}
 
-    async def fill_vila_velha_form(self, data):
+    async def fill_vila_velha_form(self, data, session_id: Optional[str] = None):
+        page = await self.get_page(session_id)
         # Go to Vila Velha portal
-        await self.page.goto("https://fibromialgia.vilavelha.es.gov.br/")
+        await page.goto("https://fibromialgia.vilavelha.es.gov.br/")
         # Fill inputs
-        # await self.page.fill('input[name="cpf"]', data['cpf'])
-        # await self.page.fill('input[name="nome"]', data['name'])
+        # await page.fill('input[name="cpf"]', data['cpf'])
+        # await page.fill('input[name="nome"]', data['name'])
         # Submit
         return True
 
+    async def release(self, session_id: Optional[str] = None):
+        """Gives the session's context back to the pool."""
+        self._locks.pop(session_id, None)
+        entry = self.sessions.pop(session_id, None)
+        if entry:
+            # Closed by the pool, its Gov.br login never reaches another user
+            await self.pool.release(entry[0])
+
     async def close(self):
-        if self.context:
-            await self.context.close()
-        if self.browser:
-            await self.browser.close()
-        if self.playwright:
-            await self.playwright.stop()
+        for session_id in list(self.sessions):
+            await self.release(session_id)
         self.logger.info("Browser closed")
 
 bot_instance = DespachanteBot()
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import Browser, BrowserContext, Playwright, Route, async_playwright
+
+logger = logging.getLogger("Browser")
+
+# BROWSER_HEADLESS=0 opens a visible window (useful to watch the bot while developing)
+HEADLESS = os.getenv("BROWSER_HEADLESS", "1") != "0"
+LAUNCH_ARGS = ["--no-sandbox", "--disable-dev-shm-usage"]
+
+# Trackers seen on the portals, never needed for scraping or form filling
+ANALYTICS_PATTERNS = [
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"doubleclick\.net",
+    r"facebook\.(net|com)/.*(tr|fbevents)",
+    r"hotjar\.com",
+    r"clarity\.ms",
+    r"/collect\?",
+]
+
+
+@dataclass
+class SiteProfile:
+    name: str
+    hosts: List[str]
+    blocked_types: FrozenSet[str] = frozenset()
+    blocked_patterns: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._pattern = re.compile("|".join(self.blocked_patterns)) if self.blocked_patterns else None
+
+    def matches_host(self, host: str) -> bool:
+        return any(host == h or host.endswith("." + h) for h in self.hosts)
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.blocked_types:
+            return True
+        return bool(self._pattern and self._pattern.search(url))
+
+
+SITE_PROFILES = [
+    # Scraper only reads table text and detail page HTML
+    SiteProfile(
+        name="placas",
+        hosts=["placaswebmercosul.com.br"],
+        blocked_types=frozenset({"image", "font", "media", "stylesheet"}),
+        blocked_patterns=ANALYTICS_PATTERNS,
+    ),
+    # The QR code step needs images and CSS to render, only drop fonts/media/trackers
+    SiteProfile(
+        name="govbr",
+        hosts=["acesso.gov.br", "gov.br"],
+        blocked_types=frozenset({"font", "media"}),
+        blocked_patterns=ANALYTICS_PATTERNS,
+    ),
+    SiteProfile(
+        name="vilavelha",
+        hosts=["vilavelha.es.gov.br"],
+        blocked_types=frozenset({"image", "font", "media", "stylesheet"}),
+        blocked_patterns=ANALYTICS_PATTERNS,
+    ),
+]
+
+# Third party hosts (CDNs, trackers) loaded from any of the sites above
+DEFAULT_PROFILE = SiteProfile(
+    name="default",
+    hosts=[],
+    blocked_types=frozenset({"font", "media"}),
+    blocked_patterns=ANALYTICS_PATTERNS,
+)
+
+
+# Most specific host first, so vilavelha.es.gov.br doesn't fall under gov.br
+_PROFILES_BY_SPECIFICITY = sorted(SITE_PROFILES, key=lambda p: -max(len(h) for h in p.hosts))
+
+
+def profile_for_url(url: str) -> SiteProfile:
+    host = urlparse(url).hostname or ""
+    for profile in _PROFILES_BY_SPECIFICITY:
+        if profile.matches_host(host):
+            return profile
+    return DEFAULT_PROFILE
+
+
+async def _route_handler(route: Route):
+    request = route.request
+    # Blocking is decided by the page being visited, so an image on a CDN
+    # is kept for Gov.br but dropped while scraping the Placas portal
+    try:
+        page_url = request.url if request.is_navigation_request() else request.frame.url
+    except Exception:
+        # Service worker requests have no frame
+        page_url = request.url
+    profile = profile_for_url(page_url)
+    if profile.should_block(request.resource_type, request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def launch_browser(playwright: Playwright, headless: Optional[bool] = None) -> Browser:
+    headless = HEADLESS if headless is None else headless
+    return await playwright.chromium.launch(headless=headless, args=LAUNCH_ARGS)
+
+
+async def new_context(browser: Browser, block_resources: bool = True, **kwargs) -> BrowserContext:
+    context = await browser.new_context(**kwargs)
+    if block_resources:
+        await context.route("**/*", _route_handler)
+    return context
+
+
+def local_storage_script(origins: List[Dict]) -> str:
+    """Init script that seeds localStorage per origin, the pooled equivalent of new_context(storage_state=...)."""
+    items = {o["origin"]: {i["name"]: i["value"] for i in o.get("localStorage", [])} for o in origins}
+    return (
+        "(() => { const items = " + json.dumps(items) + "[window.location.origin];"
+        " if (!items) return;"
+        " for (const [k, v] of Object.entries(items)) {"
+        " if (window.localStorage.getItem(k) === null) window.localStorage.setItem(k, v); } })();"
+    )
+
+
+class BrowserPool:
+    """
+    One shared Chromium with a bounded set of BrowserContexts leased to callers.
+    Each lease gets its own context (cookies, pages), so concurrent requests never
+    drive the same page. Contexts are single use: clear_cookies() leaves localStorage,
+    IndexedDB and service workers behind, so a released context is closed and a fresh
+    one is pre-created in its place.
+    Gov.br logins (session=True) hold their context for minutes, so they may take at
+    most max_sessions contexts; the rest stays available to the scraper's short leases.
+    """
+
+    def __init__(self, max_size: int = None, warm_size: int = None, acquire_timeout: float = None, max_sessions: int = None):
+        self.max_size = max_size or int(os.getenv("BROWSER_POOL_SIZE", "4"))
+        self.max_sessions = min(self.max_size, max_sessions or int(os.getenv("BROWSER_POOL_SESSIONS", str(max(1, self.max_size - 1)))))
+        self.warm_size = min(self.max_size, warm_size if warm_size is not None else int(os.getenv("BROWSER_POOL_WARM", "1")))
+        # A full pool fails the lease after this long instead of queueing forever
+        self.acquire_timeout = acquire_timeout or float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "30"))
+        self.playwright = None
+        self.browser: Optional[Browser] = None
+        self._idle: List[BrowserContext] = []
+        self._open = set()
+        self._slots = asyncio.Semaphore(self.max_size)
+        self._session_slots = asyncio.Semaphore(self.max_sessions)
+        self._sessions = set()
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            if not self.playwright:
+                self.playwright = await async_playwright().start()
+            if not self.browser or not self.browser.is_connected():
+                self.browser = await launch_browser(self.playwright)
+                self._idle.clear()
+                self._open.clear()
+            await self._warm_up()
+
+    async def _warm_up(self):
+        # Keep a few contexts pre-created so a lease doesn't pay for new_context()
+        while len(self._idle) < self.warm_size and len(self._open) < self.max_size:
+            self._idle.append(await self._create())
+
+    async def _create(self) -> BrowserContext:
+        context = await new_context(self.browser)
+        self._open.add(context)
+        return context
+
+    async def _discard(self, context: BrowserContext):
+        self._open.discard(context)
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+    async def acquire(self, cookies: List[Dict] = None, storage_state: Dict = None, timeout: float = None,
+                      session: bool = False) -> BrowserContext:
+        """
+        Leases a context, waiting up to timeout seconds (acquire_timeout by default) when
+        the pool is full. storage_state (as saved by context.storage_state()) restores a
+        previous login. session=True marks a long lived lease, counted against max_sessions.
+        """
+        timeout = timeout or self.acquire_timeout
+        if session:
+            await asyncio.wait_for(self._session_slots.acquire(), timeout)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except BaseException:
+            if session:
+                self._session_slots.release()
+            raise
+        try:
+            await self.start()
+            context = self._idle.pop() if self._idle else await self._create()
+            if storage_state:
+                cookies = (cookies or []) + storage_state.get("cookies", [])
+                if storage_state.get("origins"):
+                    await context.add_init_script(local_storage_script(storage_state["origins"]))
+            if cookies:
+                await context.add_cookies(cookies)
+            if session:
+                self._sessions.add(context)
+            return context
+        except Exception:
+            self._slots.release()
+            if session:
+                self._session_slots.release()
+            raise
+
+    async def release(self, context: BrowserContext):
+        try:
+            await self._discard(context)
+            if self.browser and self.browser.is_connected():
+                async with self._lock:
+                    await self._warm_up()
+        except Exception as e:
+            logger.warning(f"Could not pre-create a context: {e!r}")
+        finally:
+            self._slots.release()
+            if context in self._sessions:
+                self._sessions.discard(context)
+                self._session_slots.release()
+
+    @asynccontextmanager
+    async def lease(self, cookies: List[Dict] = None, storage_state: Dict = None, timeout: float = None):
+        context = await self.acquire(cookies=cookies, storage_state=storage_state, timeout=timeout)
+        try:
+            yield context
+        finally:
+            await self.release(context)
+
+    def stats(self) -> Dict:
+        return {
+            "max_size": self.max_size,
+            "open": len(self._open),
+            "idle": len(self._idle),
+            "in_use": len(self._open) - len(self._idle),
+            "sessions": len(self._sessions),
+        }
+
+    async def close(self):
+        for context in list(self._open):
+            await self._discard(context)
+        self._idle.clear()
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+
+browser_pool = BrowserPool()
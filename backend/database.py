@@ -1,8 +1,11 @@
-
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import metrics
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,16 +13,144 @@ load_dotenv()
 # Use SQLite for local development by default, or Postgres if DATABASE_URL is set
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./descomplaca.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
-)
+def to_async_url(url: str) -> str:
+    """Same database through an asyncio driver: aiosqlite locally, asyncpg for Postgres."""
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# SQLite profile: WAL lets readers run next to the single writer, and writers wait
+# (busy_timeout) instead of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+# Postgres profile: a pool sized for the app, recycled before the server/proxy
+# drops idle connections, pre-ping so a dead connection is replaced, not raised
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# QueuePool sizing for file SQLite databases (SQLAlchemy's defaults, spelled out so
+# pool_stats can report them without reading pool internals)
+SQLITE_POOL_SIZE = 5
+SQLITE_MAX_OVERFLOW = 10
+
+def timed_pool(pool_class, stats: metrics.LatencyStats):
+    """Pool class that records how long each checkout waited for a connection
+    (including opening a new one when the pool is not full yet). Pool events only
+    fire once a connection is handed out, so the public connect() is timed instead."""
+    class TimedPool(pool_class):
+        def connect(self):
+            with stats.time():
+                return super().connect()
+    TimedPool.__name__ = "Timed" + pool_class.__name__
+    return TimedPool
+
+def pool_stats(engine, checkout: metrics.LatencyStats, max_overflow: int = 0) -> dict:
+    """max_overflow as passed to the engine (see engine_options)."""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "checkout_wait": checkout.as_dict()}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(max_overflow, 0)
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": max_overflow,
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            # 1.0 means the next checkout has to wait (or time out)
+            "saturation": round(pool.checkedout() / capacity, 3) if capacity > 0 else None,
+        })
+    return stats
+
+def engine_options(url: str, checkout: metrics.LatencyStats, is_async: bool = False) -> dict:
+    """create_engine kwargs for the profile of this database url."""
+    url = make_url(url)
+    queue_pool = AsyncAdaptedQueuePool if is_async else QueuePool
+    if url.get_backend_name() == "sqlite":
+        options = {}
+        if not is_async:
+            options["connect_args"] = {"check_same_thread": False}
+        if url.database and url.database != ":memory:":
+            # In-memory databases keep SQLAlchemy's single connection pool
+            options.update({
+                "poolclass": timed_pool(queue_pool, checkout),
+                "pool_size": SQLITE_POOL_SIZE,
+                "max_overflow": SQLITE_MAX_OVERFLOW,
+            })
+        return options
+    return {
+        "poolclass": timed_pool(queue_pool, checkout),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def tune_engine(engine):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+# Sync engine is only for startup work (migrations) and scripts, request handlers
+# use the async engine so a commit never blocks the event loop shared with the bot/scraper
+engine_checkout = metrics.LatencyStats()
+engine_settings = engine_options(SQLALCHEMY_DATABASE_URL, engine_checkout)
+engine = tune_engine(create_engine(SQLALCHEMY_DATABASE_URL, **engine_settings))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+async_engine_checkout = metrics.LatencyStats()
+async_engine_settings = engine_options(ASYNC_DATABASE_URL, async_engine_checkout, is_async=True)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_settings)
+# Connect events are sync-level, they go on the engine the async one wraps
+tune_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# AsyncAttrs: relationships can be loaded with `await obj.awaitable_attrs.<name>`
+Base = declarative_base(cls=AsyncAttrs)
+
+metrics.register("db", lambda: {
+    "async": pool_stats(async_engine, async_engine_checkout, async_engine_settings.get("max_overflow", 0)),
+    "sync": pool_stats(engine, engine_checkout, engine_settings.get("max_overflow", 0)),
+})
+
+MIGRATIONS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+def run_migrations(bind=None):
+    """Bring the schema up to the latest alembic revision (blocking, run it off the loop)."""
+    from alembic import command
+    from alembic.config import Config
+
+    bind = bind or engine
+    config = Config(MIGRATIONS_CONFIG)
+    config.attributes["configure_logger"] = False
+    with bind.begin() as connection:
+        config.attributes["connection"] = connection
+        tables = inspect(connection).get_table_names()
+        # Databases created by the old create_all startup already have the
+        # initial schema, mark it as applied instead of creating it again
+        if "alembic_version" not in tables and "orders" in tables:
+            command.stamp(config, "0001")
+        command.upgrade(config, "head")
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+# Sources shown by GET /metrics: name -> callable returning a JSON-able dict
+_sources: Dict[str, Callable[[], Dict]] = {}
+
+
+def register(name: str, source: Callable[[], Dict]):
+    _sources[name] = source
+
+
+def snapshot() -> Dict:
+    return {name: source() for name, source in _sources.items()}
+
+
+class LatencyStats:
+    """
+    Count, total, max and percentiles over the last `window` samples (seconds).
+    Thread-safe: pool checkouts of the sync engine happen in worker threads.
+    """
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._recent.append(seconds)
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * q))]
+
+    def as_dict(self) -> Dict:
+        to_ms = lambda s: round(s * 1000, 3) if s is not None else None
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": to_ms(self.total / self.count) if self.count else None,
+            "p50_ms": to_ms(self.percentile(0.5)),
+            "p95_ms": to_ms(self.percentile(0.95)),
+            "p99_ms": to_ms(self.percentile(0.99)),
+            "max_ms": to_ms(self.max),
+        }
+
+
+class _Timer:
+    def __init__(self, stats: LatencyStats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.stats.observe(time.perf_counter() - self.start)
+        else:
+            self.stats.error()
+        return False
@@ -0,0 +1,41 @@
+"""pipeline snapshot table
+
+Revision ID: 0001a
+Revises: 0001
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001a'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all databases made after the snapshot was introduced already have it
+    if 'pipeline_items' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('pipeline_items',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('placa', sa.String(), nullable=True),
+    sa.Column('proprietario', sa.String(), nullable=True),
+    sa.Column('situacao', sa.String(), nullable=True),
+    sa.Column('flag_pago', sa.Boolean(), nullable=True),
+    sa.Column('flag_foto', sa.Boolean(), nullable=True),
+    sa.Column('fingerprint', sa.String(), nullable=True),
+    sa.Column('photo_checked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('pipeline_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pipeline_items_id'), ['id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pipeline_items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pipeline_items_id'))
+
+    op.drop_table('pipeline_items')
@@ -0,0 +1,25 @@
+"""composite indexes for hot queries
+
+Revision ID: 0002
+Revises: 0001a
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_orders_status_state_city', 'orders', ['status', 'state', 'city'], unique=False)
+    op.create_index('ix_proposals_order_id_is_accepted', 'proposals', ['order_id', 'is_accepted'], unique=False)
+    op.create_index('ix_messages_order_id_timestamp', 'messages', ['order_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_order_id_timestamp', table_name='messages')
+    op.drop_index('ix_proposals_order_id_is_accepted', table_name='proposals')
+    op.drop_index('ix_orders_status_state_city', table_name='orders')
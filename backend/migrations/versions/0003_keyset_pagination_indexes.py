@@ -0,0 +1,29 @@
+"""indexes ending in the keyset pagination keys
+
+Revision ID: 0003
+Revises: 0002
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_orders_status_state_city', table_name='orders')
+    op.create_index('ix_orders_status_state_city_created_at', 'orders', ['status', 'state', 'city', 'created_at', 'id'], unique=False)
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_messages_order_id_timestamp', table_name='messages')
+    op.create_index('ix_messages_order_id_timestamp_id', 'messages', ['order_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_order_id_timestamp_id', table_name='messages')
+    op.create_index('ix_messages_order_id_timestamp', 'messages', ['order_id', 'timestamp'], unique=False)
+    op.drop_index('ix_orders_status_created_at', table_name='orders')
+    op.drop_index('ix_orders_status_state_city_created_at', table_name='orders')
+    op.create_index('ix_orders_status_state_city', 'orders', ['status', 'state', 'city'], unique=False)
@@ -0,0 +1,66 @@
+"""dispatcher rating aggregates
+
+Revision ID: 0004
+Revises: 0003
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL = """
+INSERT INTO dispatcher_ratings (dispatcher_id, state, city, review_count, rating_sum, average,
+                                rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT r.dispatcher_id, {state}, {city}, COUNT(*), SUM(r.rating), SUM(r.rating) * 1.0 / COUNT(*),
+       SUM(CASE WHEN r.rating = 1 THEN 1 ELSE 0 END), SUM(CASE WHEN r.rating = 2 THEN 1 ELSE 0 END),
+       SUM(CASE WHEN r.rating = 3 THEN 1 ELSE 0 END), SUM(CASE WHEN r.rating = 4 THEN 1 ELSE 0 END),
+       SUM(CASE WHEN r.rating = 5 THEN 1 ELSE 0 END)
+FROM reviews r JOIN orders o ON o.id = r.order_id
+WHERE r.dispatcher_id IS NOT NULL AND r.rating BETWEEN 1 AND 5 {where}
+GROUP BY {group_by}
+"""
+
+
+def upgrade():
+    op.create_table('dispatcher_ratings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dispatcher_id', sa.Integer(), nullable=False),
+    sa.Column('state', sa.String(), nullable=False),
+    sa.Column('city', sa.String(), nullable=False),
+    sa.Column('review_count', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), nullable=False),
+    sa.Column('average', sa.Float(), nullable=False),
+    sa.Column('rating_1', sa.Integer(), nullable=False),
+    sa.Column('rating_2', sa.Integer(), nullable=False),
+    sa.Column('rating_3', sa.Integer(), nullable=False),
+    sa.Column('rating_4', sa.Integer(), nullable=False),
+    sa.Column('rating_5', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dispatcher_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dispatcher_id', 'state', 'city', name='uq_dispatcher_ratings_scope')
+    )
+    with op.batch_alter_table('dispatcher_ratings', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_dispatcher_ratings_id'), ['id'], unique=False)
+        batch_op.create_index('ix_dispatcher_ratings_leaderboard', ['state', 'city', 'average', 'review_count', 'dispatcher_id'], unique=False)
+
+    # Backfill from the reviews written so far, one pass per scope
+    for scope_state, scope_city, where, group_by in [
+        ("''", "''", "", "r.dispatcher_id"),
+        ("o.state", "''", "AND o.state IS NOT NULL", "r.dispatcher_id, o.state"),
+        ("o.state", "o.city", "AND o.state IS NOT NULL AND o.city IS NOT NULL", "r.dispatcher_id, o.state, o.city"),
+    ]:
+        op.execute(BACKFILL.format(state=scope_state, city=scope_city, where=where, group_by=group_by))
+
+
+
+def downgrade():
+    with op.batch_alter_table('dispatcher_ratings', schema=None) as batch_op:
+        batch_op.drop_index('ix_dispatcher_ratings_leaderboard')
+        batch_op.drop_index(batch_op.f('ix_dispatcher_ratings_id'))
+
+    op.drop_table('dispatcher_ratings')
@@ -0,0 +1,21 @@
+"""index for chat catch-up after a message id
+
+Revision ID: 0005
+Revises: 0004
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_order_id_id', 'messages', ['order_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_order_id_id', table_name='messages')
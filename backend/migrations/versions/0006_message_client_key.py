@@ -0,0 +1,25 @@
+"""idempotency key on chat messages
+
+Revision ID: 0006
+Revises: 0005
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_key', sa.String(), nullable=True))
+        batch_op.create_index('uq_messages_order_id_client_key', ['order_id', 'client_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('uq_messages_order_id_client_key')
+        batch_op.drop_column('client_key')
@@ -0,0 +1,25 @@
+"""asaas customer id and cpf/cnpj on users
+
+Revision ID: 0007
+Revises: 0006
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('asaas_customer_id', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('cpf_cnpj', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('cpf_cnpj')
+        batch_op.drop_column('asaas_customer_id')
@@ -0,0 +1,39 @@
+"""webhook event queue
+
+Revision ID: 0008
+Revises: 0007
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(), nullable=False),
+    sa.Column('event', sa.String(), nullable=True),
+    sa.Column('asaas_payment_id', sa.String(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.create_index('uq_webhook_events_event_id', ['event_id'], unique=True)
+        batch_op.create_index('ix_webhook_events_pending', ['id'], unique=False,
+                              sqlite_where=sa.text('processed_at IS NULL'), postgresql_where=sa.text('processed_at IS NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_events_pending')
+        batch_op.drop_index('uq_webhook_events_event_id')
+
+    op.drop_table('webhook_events')
@@ -0,0 +1,41 @@
+"""idempotent checkout: invoice data, idempotency key, one pending payment per proposal
+
+Revision ID: 0009
+Revises: 0008
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoice_url', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('bank_slip_url', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(), nullable=True))
+        batch_op.create_index('uq_payments_idempotency_key', ['idempotency_key'], unique=True)
+
+    # Duplicate checkouts made so far: keep the newest pending charge per proposal open
+    op.execute("""
+UPDATE payments SET status = 'SUPERSEDED'
+WHERE status = 'PENDING' AND id NOT IN (
+    SELECT MAX(id) FROM payments WHERE status = 'PENDING' GROUP BY proposal_id
+)
+""")
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('uq_payments_pending_proposal_id', ['proposal_id'], unique=True,
+                              sqlite_where=sa.text("status = 'PENDING'"), postgresql_where=sa.text("status = 'PENDING'"))
+
+
+def downgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('uq_payments_pending_proposal_id')
+        batch_op.drop_index('uq_payments_idempotency_key')
+        batch_op.drop_column('idempotency_key')
+        batch_op.drop_column('bank_slip_url')
+        batch_op.drop_column('invoice_url')
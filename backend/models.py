@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Text, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -16,6 +16,9 @@ class User(Base):
     license_number = Column(String, nullable=True)
     # Asaas Account ID for dispatchers (for split)
     asaas_account_id = Column(String, nullable=True)
+    # Asaas customer created for this client on their first checkout
+    asaas_customer_id = Column(String, nullable=True)
+    cpf_cnpj = Column(String, nullable=True)
     
     orders = relationship("Order", back_populates="owner")
     proposals = relationship("Proposal", back_populates="dispatcher")
@@ -43,6 +46,13 @@ class Order(Base):
     proposals = relationship("Proposal", back_populates="order")
     messages = relationship("Message", back_populates="order")
 
+    # list_orders: status == OPEN, optionally narrowed by state and city,
+    # newest first keyed on (created_at, id)
+    __table_args__ = (
+        Index("ix_orders_status_state_city_created_at", "status", "state", "city", "created_at", "id"),
+        Index("ix_orders_status_created_at", "status", "created_at", "id"),
+    )
+
 class Proposal(Base):
     __tablename__ = "proposals"
 
@@ -64,6 +74,11 @@ class Proposal(Base):
     order_id = Column(Integer, ForeignKey("orders.id"))
     order = relationship("Order", back_populates="proposals")
 
+    # Proposals of an order, and the accepted one when a review is created
+    __table_args__ = (
+        Index("ix_proposals_order_id_is_accepted", "order_id", "is_accepted"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -71,10 +86,20 @@ class Message(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     content = Column(Text)
     is_from_dispatcher = Column(Boolean) # True if from dispatcher, False if from client
+    # Idempotency key sent by the client, unique per order
+    client_key = Column(String, nullable=True)
     
     order_id = Column(Integer, ForeignKey("orders.id"))
     order = relationship("Order", back_populates="messages")
 
+    # Chat history of an order, already in (timestamp, id) order,
+    # and catch-up after a message id (WebSocket resume)
+    __table_args__ = (
+        Index("ix_messages_order_id_timestamp_id", "order_id", "timestamp", "id"),
+        Index("ix_messages_order_id_id", "order_id", "id"),
+        Index("uq_messages_order_id_client_key", "order_id", "client_key", unique=True),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     
@@ -84,11 +109,45 @@ class Payment(Base):
     asaas_payment_id = Column(String, unique=True)
     status = Column(String)
     amount = Column(Float)
+    # Kept so a repeated checkout answers without asking Asaas again
+    invoice_url = Column(String, nullable=True)
+    bank_slip_url = Column(String, nullable=True)
+    # Idempotency-Key header of the checkout request that created it
+    idempotency_key = Column(String, nullable=True)
     
     # Link to selected proposal
     proposal_id = Column(Integer, ForeignKey("proposals.id"))
     proposal = relationship("Proposal")
 
+    __table_args__ = (
+        Index("uq_payments_idempotency_key", "idempotency_key", unique=True),
+        # At most one open charge per proposal
+        Index("uq_payments_pending_proposal_id", "proposal_id", unique=True,
+              sqlite_where=text("status = 'PENDING'"), postgresql_where=text("status = 'PENDING'")),
+    )
+
+class WebhookEvent(Base):
+    """Raw Asaas webhook deliveries, applied later by the webhook worker."""
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True)
+    # Asaas event id (evt_...), redeliveries of an event collapse on it
+    event_id = Column(String, nullable=False)
+    event = Column(String)
+    asaas_payment_id = Column(String, nullable=True)
+    payload = Column(Text)
+    received_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Set once applied (or skipped), pending events have none
+    processed_at = Column(DateTime, nullable=True)
+    error = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("uq_webhook_events_event_id", "event_id", unique=True),
+        # Only the pending tail, the worker reads it oldest first
+        Index("ix_webhook_events_pending", "id", sqlite_where=text("processed_at IS NULL"),
+              postgresql_where=text("processed_at IS NULL")),
+    )
+
 class Review(Base):
     __tablename__ = "reviews"
 
@@ -104,3 +163,53 @@ class Review(Base):
     # Could link to Dispatcher too for easier average calc
     dispatcher_id = Column(Integer, ForeignKey("users.id"))
     dispatcher = relationship("User")
+
+class DispatcherRating(Base):
+    """
+    Running review totals of a dispatcher, kept up to date by create_review.
+    One row per scope: global (state="", city=""), per state (city="")
+    and per state + city, so leaderboards never aggregate reviews at read time.
+    """
+    __tablename__ = "dispatcher_ratings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dispatcher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    dispatcher = relationship("User")
+
+    state = Column(String, nullable=False, default="")
+    city = Column(String, nullable=False, default="")
+
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    average = Column(Float, nullable=False, default=0.0)
+
+    # Histogram: how many reviews gave 1..5 stars
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+    rating_5 = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("dispatcher_id", "state", "city", name="uq_dispatcher_ratings_scope"),
+        # Leaderboard of a scope, best average first
+        Index("ix_dispatcher_ratings_leaderboard", "state", "city", "average", "review_count", "dispatcher_id"),
+    )
+
+class PipelineItem(Base):
+    __tablename__ = "pipeline_items"
+
+    # Order id on the Placas portal (e.g. "7970")
+    id = Column(String, primary_key=True, index=True)
+    placa = Column(String)
+    proprietario = Column(String)
+    situacao = Column(String)
+    flag_pago = Column(Boolean, default=False)
+    flag_foto = Column(Boolean, default=False)
+
+    # Hash of situacao + pago, a changed fingerprint triggers a new photo check
+    fingerprint = Column(String)
+    photo_checked_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    refreshed_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,149 @@
+import bisect
+import datetime
+import heapq
+import itertools
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+import models
+from pagination import decode_cursor, encode_cursor
+from pubsub import Broker, broker
+
+logger = logging.getLogger("OrderIndex")
+
+Region = Tuple[str, str]
+SortKey = Tuple  # (created_at, id)
+
+
+def feed_topics(state: str, city: str) -> List[str]:
+    """Topics an order in this region is published to: all, the state and the city."""
+    return ["orders", f"orders/{state}", f"orders/{state}/{city}"]
+
+
+def feed_topic(state: Optional[str] = None, city: Optional[str] = None) -> str:
+    """Topic a dispatcher watching this region subscribes to. Raises ValueError for a city without its state."""
+    if city and not state:
+        # City topics live under their state (names repeat across states), "orders" would push every region
+        raise ValueError("city requires state")
+    if state and city:
+        return f"orders/{state}/{city}"
+    if state:
+        return f"orders/{state}"
+    return "orders"
+
+
+def order_to_dict(order: models.Order) -> Dict:
+    return {
+        "id": order.id,
+        "status": order.status,
+        "vehicle_plate": order.vehicle_plate,
+        "service_type": order.service_type,
+        "city": order.city,
+        "state": order.state,
+        "created_at": order.created_at or datetime.datetime.min,
+    }
+
+
+def order_json(order: Dict) -> Dict:
+    # WebSocket payload, datetimes as ISO strings
+    return {**order, "created_at": order["created_at"].isoformat()}
+
+
+def order_event(type: str, order: Dict) -> Dict:
+    return {"type": type, "order": order_json(order)}
+
+
+def _descending(keys: List[SortKey], end: int):
+    for i in range(end - 1, -1, -1):
+        yield keys[i]
+
+
+class OpenOrderIndex:
+    """
+    OPEN orders by (state, city), each region kept sorted by (created_at, id) so the
+    dispatcher feed is answered from memory, newest first, with the same cursors as
+    GET /orders/. The database stays the source of truth: load() at startup, then
+    the order/proposal routes call track() after every commit that touches status.
+    """
+
+    def __init__(self, pubsub: Broker = broker):
+        self.pubsub = pubsub
+        self._regions: Dict[Region, List[SortKey]] = {}
+        self._orders: Dict[int, Dict] = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._orders)
+
+    async def load(self, db: AsyncSession):
+        result = await db.execute(select(models.Order).filter(models.Order.status == "OPEN"))
+        self.clear()
+        for order in result.scalars():
+            self._insert(order_to_dict(order))
+        self.loaded = True
+        logger.info(f"Loaded {len(self._orders)} open orders")
+
+    def clear(self):
+        self._regions.clear()
+        self._orders.clear()
+        self.loaded = False
+
+    def track(self, order: models.Order):
+        """Call after committing an order change: indexes it if OPEN, drops it otherwise."""
+        if order.status == "OPEN":
+            if order.id not in self._orders:
+                item = order_to_dict(order)
+                self._insert(item)
+                self._publish("order_opened", item)
+        else:
+            item = self._remove(order.id)
+            if item is not None:
+                self._publish("order_closed", {**item, "status": order.status})
+
+    def _insert(self, item: Dict):
+        self._orders[item["id"]] = item
+        bisect.insort(self._regions.setdefault((item["state"], item["city"]), []), (item["created_at"], item["id"]))
+
+    def _remove(self, order_id: int) -> Optional[Dict]:
+        item = self._orders.pop(order_id, None)
+        if item is None:
+            return None
+        region = (item["state"], item["city"])
+        keys = self._regions[region]
+        keys.pop(bisect.bisect_left(keys, (item["created_at"], item["id"])))
+        if not keys:
+            del self._regions[region]
+        return item
+
+    def _publish(self, type: str, item: Dict):
+        event = order_event(type, item)
+        for topic in feed_topics(item["state"], item["city"]):
+            self.pubsub.publish(topic, event)
+
+    def query(self, state: Optional[str] = None, city: Optional[str] = None, cursor: Optional[str] = None, limit: int = 50) -> Dict:
+        """Newest first, {data, next_cursor} like GET /orders/. Raises ValueError on a bad cursor."""
+        after = decode_cursor(cursor) if cursor else None
+        streams = []
+        for (region_state, region_city), keys in self._regions.items():
+            if (state and region_state != state) or (city and region_city != city):
+                continue
+            end = bisect.bisect_left(keys, after) if after else len(keys)
+            streams.append(_descending(keys, end))
+        # k-way merge of the regions, stops after limit + 1 keys
+        page = list(itertools.islice(heapq.merge(*streams, reverse=True), limit + 1))
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(*page[-1])
+        return {"data": [self._orders[order_id] for _, order_id in page], "next_cursor": next_cursor}
+
+    def stats(self) -> Dict:
+        return {"loaded": self.loaded, "open_orders": len(self._orders), "regions": len(self._regions)}
+
+
+open_orders_index = OpenOrderIndex()
+metrics.register("open_orders_index", open_orders_index.stats)
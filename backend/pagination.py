@@ -0,0 +1,54 @@
+import base64
+import datetime
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+# Page sizes for the list endpoints (orders, chat history)
+DEFAULT_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "200"))
+
+
+def encode_cursor(sort_value: datetime.datetime, id: int) -> str:
+    """Opaque cursor pointing right after the row (sort_value, id)."""
+    raw = f"{sort_value.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Raises ValueError for anything encode_cursor did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sort_value, id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(sort_value), int(id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(query, sort_column, id_column, cursor: Optional[str], limit: int, descending: bool = False):
+    """
+    Orders query by (sort_column, id_column) and continues after cursor.
+    Fetches one extra row so the caller can tell whether there is a next page,
+    the cost of a page does not depend on how deep into the listing it is
+    (unlike OFFSET), as long as an index ends with (sort_column, id_column).
+    """
+    key = tuple_(sort_column, id_column)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    return query.limit(limit + 1)
+
+
+def page_response(rows: List, limit: int, sort_attr: str) -> dict:
+    """Trims the extra row fetched by keyset_page and builds {data, next_cursor}."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_attr), last.id)
+    return {"data": rows, "next_cursor": next_cursor}
@@ -0,0 +1,308 @@
+import datetime
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionLocal
+from scraper import IncompletePagination, needs_photo_check
+from singleflight import SingleFlight
+
+# Unchanged rows still missing photos are re-checked after this many seconds,
+# since uploading photos doesn't change situacao/pago on the portal.
+PHOTO_RECHECK_SECONDS = int(os.getenv("PIPELINE_PHOTO_RECHECK_SECONDS", "900"))
+
+
+def row_fingerprint(item: Dict) -> str:
+    raw = f"{item['situacao']}|{int(bool(item['flag_pago']))}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def isoformat_utc(dt: datetime.datetime) -> str:
+    # DB timestamps are naive UTC, tag them so the dashboard renders local time correctly
+    return dt.replace(tzinfo=datetime.timezone.utc).isoformat()
+
+
+def item_to_dict(item: models.PipelineItem) -> Dict:
+    return {
+        "id": item.id,
+        "placa": item.placa,
+        "proprietario": item.proprietario,
+        "situacao": item.situacao,
+        "flag_pago": item.flag_pago,
+        "flag_foto": item.flag_foto,
+    }
+
+
+@dataclass
+class RefreshPlan:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # Ids that need a detail page visit in this refresh
+    to_check: List[str] = field(default_factory=list)
+
+    def as_diff(self) -> Dict:
+        return {"added": self.added, "changed": self.changed, "removed": self.removed}
+
+
+def plan_refresh(stored: Dict[str, models.PipelineItem], rows: List[Dict], now: datetime.datetime = None, complete: bool = True) -> RefreshPlan:
+    """complete=False (pagination stopped early) updates the rows read but removes nothing."""
+    now = now or datetime.datetime.utcnow()
+    recheck_before = now - datetime.timedelta(seconds=PHOTO_RECHECK_SECONDS)
+    plan = RefreshPlan()
+
+    seen = set()
+    for row in rows:
+        seen.add(row["id"])
+        previous = stored.get(row["id"])
+        if previous is None:
+            plan.added.append(row["id"])
+        elif previous.fingerprint != row_fingerprint(row):
+            plan.changed.append(row["id"])
+        else:
+            # Unchanged: only revisit rows whose photos were still missing
+            stale = previous.photo_checked_at is None or previous.photo_checked_at < recheck_before
+            if needs_photo_check(row) and not previous.flag_foto and stale:
+                plan.to_check.append(row["id"])
+            continue
+
+        if needs_photo_check(row):
+            plan.to_check.append(row["id"])
+
+    # A row missing from a partial walk may just be on a page that wasn't read
+    if complete:
+        plan.removed = [item_id for item_id in stored if item_id not in seen]
+    return plan
+
+
+async def load_snapshot(db: AsyncSession) -> Dict[str, models.PipelineItem]:
+    result = await db.execute(select(models.PipelineItem))
+    return {item.id: item for item in result.scalars().all()}
+
+
+async def save_snapshot(db: AsyncSession, stored: Dict[str, models.PipelineItem], rows: List[Dict], plan: RefreshPlan, photos: Dict[str, bool], now: datetime.datetime = None) -> List[Dict]:
+    """Applies a refresh to the pipeline_items table and returns the resulting rows."""
+    now = now or datetime.datetime.utcnow()
+    data = []
+
+    for row in rows:
+        item = stored.get(row["id"])
+        if item is None:
+            item = models.PipelineItem(id=row["id"], created_at=now)
+            db.add(item)
+
+        item.placa = row["placa"]
+        item.proprietario = row["proprietario"]
+        item.situacao = row["situacao"]
+        item.flag_pago = row["flag_pago"]
+        item.fingerprint = row_fingerprint(row)
+        item.refreshed_at = now
+
+        if row["id"] in photos:
+            item.flag_foto = photos[row["id"]]
+            item.photo_checked_at = now
+        elif item.flag_foto is None or not needs_photo_check(row):
+            # Finished rows count as done, unpaid rows have nothing to check yet
+            item.flag_foto = row["flag_foto"]
+
+        data.append(item_to_dict(item))
+
+    # After a partial walk the rows not read stay as they were
+    seen = {row["id"] for row in rows}
+    kept = [item for item_id, item in stored.items() if item_id not in seen and item_id not in plan.removed]
+    data.extend(item_to_dict(item) for item in kept)
+
+    for item_id in plan.removed:
+        await db.delete(stored[item_id])
+
+    await db.commit()
+    return data
+
+
+# In-memory copy of the pipeline_items snapshot, served by /pipeline/data
+pipeline_cache = {
+    "data": [],
+    "last_changed": None
+}
+
+
+# When the snapshot was last refreshed / last actually changed (naive UTC)
+_refreshed_at: Optional[datetime.datetime] = None
+_modified_at: Optional[datetime.datetime] = None
+# Content hash of pipeline_cache["data"], the base of the /pipeline/data ETag
+_snapshot_hash: Optional[str] = None
+
+MAX_PAGE_SIZE = 500
+
+_refresh_flight = SingleFlight()
+# Streaming callers attached to the in-flight refresh, and the events sent so far
+# so that late joiners still receive every row
+_listeners: List[Callable[[Dict], Awaitable[None]]] = []
+_replay: List[Dict] = []
+
+
+def cache_age() -> Optional[float]:
+    if _refreshed_at is None:
+        return None
+    return (datetime.datetime.utcnow() - _refreshed_at).total_seconds()
+
+
+def is_refreshing() -> bool:
+    return _refresh_flight.in_flight("pipeline")
+
+
+def refreshed_at() -> Optional[datetime.datetime]:
+    return _refreshed_at
+
+
+def last_modified() -> Optional[datetime.datetime]:
+    return _modified_at
+
+
+def _set_snapshot(data: List[Dict], refreshed_at: Optional[datetime.datetime]):
+    global _refreshed_at, _modified_at, _snapshot_hash
+    data = sorted(data, key=lambda item: _sort_key(item["id"]))
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    # A refresh that found nothing new keeps the ETag/Last-Modified, so pollers get 304s
+    if digest != _snapshot_hash:
+        _snapshot_hash = digest
+        _modified_at = refreshed_at
+    pipeline_cache["data"] = data
+    # When the data last changed, like Last-Modified, so a 304 never leaves a stale body behind.
+    # The refresh time changes without the data and goes in a header (see refreshed_at())
+    pipeline_cache["last_changed"] = isoformat_utc(_modified_at) if _modified_at else None
+    _refreshed_at = refreshed_at
+
+
+async def load_cache():
+    async with AsyncSessionLocal() as db:
+        stored = await load_snapshot(db)
+    refreshed_at = max(item.refreshed_at for item in stored.values()) if stored else None
+    _set_snapshot([item_to_dict(item) for item in stored.values()], refreshed_at)
+
+
+def _sort_key(item_id: str):
+    # Portal ids are numeric strings, order them numerically
+    return (0, int(item_id), "") if item_id.isdigit() else (1, 0, item_id)
+
+
+def snapshot_etag(variant: str = "") -> str:
+    """Weak ETag of the current snapshot for one query (filters/cursor/limit) variant."""
+    raw = f"{_snapshot_hash}|{is_refreshing()}|{variant}"
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def query_cache(situacao: str = None, flag_pago: bool = None, flag_foto: bool = None, placa: str = None, cursor: str = None, limit: int = None) -> Dict:
+    """
+    Filters the cached snapshot and pages through it by order id.
+    cursor is the next_cursor of the previous page, limit=None returns everything.
+    """
+    items = pipeline_cache["data"]
+    if situacao:
+        needle = situacao.lower()
+        items = [i for i in items if needle in i["situacao"].lower()]
+    if flag_pago is not None:
+        items = [i for i in items if i["flag_pago"] == flag_pago]
+    if flag_foto is not None:
+        items = [i for i in items if i["flag_foto"] == flag_foto]
+    if placa:
+        prefix = placa.upper()
+        items = [i for i in items if (i["placa"] or "").upper().startswith(prefix)]
+
+    total = len(items)
+    if cursor:
+        after = _sort_key(cursor)
+        items = [i for i in items if _sort_key(i["id"]) > after]
+
+    next_cursor = None
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = items[-1]["id"]
+
+    return {
+        "data": items,
+        "last_changed": pipeline_cache["last_changed"],
+        "total": total,
+        "next_cursor": next_cursor,
+    }
+
+
+async def run_refresh(scraper, emit: Optional[Callable[[Dict], Awaitable[None]]] = None) -> Dict:
+    """
+    Scrapes the portal, re-checks photos only where needed and persists the snapshot.
+    If given, emit() is awaited with a "row" event per parsed row and a "photo"
+    event per finished photo check, so callers can stream progress.
+    Callers should go through refresh(), which coalesces concurrent runs.
+    """
+    now = datetime.datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        stored = await load_snapshot(db)
+
+        rows = []
+        complete = True
+        try:
+            async for row in scraper.iter_pipeline_rows():
+                rows.append(row)
+                if emit:
+                    previous = stored.get(row["id"])
+                    shown = dict(row)
+                    if previous is not None and previous.fingerprint == row_fingerprint(row) and needs_photo_check(row):
+                        # Unchanged row, show the last known photo state until re-checked
+                        shown["flag_foto"] = previous.flag_foto
+                    await emit({"event": "row", "data": shown})
+        except IncompletePagination:
+            # Keep what was read, but rows past the failed page are not gone
+            complete = False
+
+        plan = plan_refresh(stored, rows, now, complete=complete)
+        if emit:
+            await emit({"event": "checking", "count": len(plan.to_check)})
+
+        async def on_photo(item_id, flag_foto):
+            await emit({"event": "photo", "id": item_id, "flag_foto": flag_foto})
+
+        photos = await scraper.check_photos_many(plan.to_check, on_result=on_photo if emit else None)
+        data = await save_snapshot(db, stored, rows, plan, photos, now)
+
+    _set_snapshot(data, now)
+    return {"count": len(data), "photo_checks": len(plan.to_check), "complete": complete, **plan.as_diff()}
+
+
+async def _broadcast(event: Dict):
+    _replay.append(event)
+    for listener in list(_listeners):
+        try:
+            await listener(event)
+        except Exception:
+            # A broken stream must not abort the refresh for everyone else
+            pass
+
+
+async def _run_shared(scraper) -> Dict:
+    _replay.clear()
+    return await run_refresh(scraper, emit=_broadcast)
+
+
+async def refresh(scraper, emit: Optional[Callable[[Dict], Awaitable[None]]] = None) -> Dict:
+    """
+    Single-flight refresh: concurrent callers (operators, the scheduler) share one
+    scrape and all get its result instead of racing on the portal and the cache.
+    """
+    if emit:
+        already_sent = list(_replay) if is_refreshing() else []
+        _listeners.append(emit)
+        for event in already_sent:
+            await emit(event)
+    try:
+        return await _refresh_flight.do("pipeline", _run_shared, scraper)
+    finally:
+        if emit:
+            _listeners.remove(emit)
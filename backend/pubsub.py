@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, Set
+
+import metrics
+
+logger = logging.getLogger("PubSub")
+
+# Messages buffered per subscriber before it counts as too slow and gets dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "256"))
+
+
+class SlowConsumer(Exception):
+    """The subscriber fell SUBSCRIBER_QUEUE_SIZE messages behind and was unsubscribed."""
+
+
+class Subscription:
+    def __init__(self, broker: "Broker", topics: Iterable[str], maxsize: int):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    async def get(self) -> Any:
+        # An overflowed subscription still hands out what it buffered, then gives up:
+        # the consumer should reconnect and catch up from its last seen id
+        if self.overflowed and self.queue.empty():
+            raise SlowConsumer()
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class Broker:
+    """
+    In-process fan-out: publish never blocks or awaits, every subscriber has its own
+    bounded queue. Single process only, with several workers each one has its own
+    broker (move to Redis/Postgres LISTEN if the API is ever scaled out).
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self, *topics: str, maxsize: int = None) -> Subscription:
+        subscription = Subscription(self, topics, maxsize or self.queue_size)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+
+    def publish(self, topic: str, message: Any) -> int:
+        """Queues message for every subscriber of topic, returns how many got it."""
+        self.published += 1
+        delivered = 0
+        for subscription in list(self._topics.get(topic, ())):
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping slow subscriber of {topic}")
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+                self.dropped_subscribers += 1
+        self.delivered += delivered
+        return delivered
+
+    def stats(self) -> Dict:
+        return {
+            "topics": len(self._topics),
+            "subscriptions": len({s for subscribers in self._topics.values() for s in subscribers}),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+async def stream_to_websocket(websocket, subscription: Subscription, skip: Callable[[Any], bool] = None):
+    """
+    Forwards subscription messages (except the ones skip() matches) to an accepted
+    WebSocket until the client leaves.
+    Incoming frames are read and ignored, that is how a disconnect is noticed.
+    A slow consumer is closed with 1013 (try again later) so it reconnects and resumes.
+    """
+    from starlette.websockets import WebSocketDisconnect
+
+    async def forward():
+        while True:
+            message = await subscription.get()
+            if skip is None or not skip(message):
+                await websocket.send_json(message)
+
+    async def receive():
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.ensure_future(forward()), asyncio.ensure_future(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+    error = next(iter(done)).exception()
+    if isinstance(error, SlowConsumer):
+        await websocket.close(code=1013)
+    elif error is not None and not isinstance(error, WebSocketDisconnect):
+        raise error
+
+
+broker = Broker()
+metrics.register("pubsub", broker.stats)
@@ -1,18 +1,37 @@
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
-from pydantic import BaseModel
-from typing import List
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, page_response
+from pubsub import broker, stream_to_websocket
+from pydantic import BaseModel, validator
+from typing import List, Optional, Tuple
 import datetime
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Messages accepted per POST /chat/batch
+MAX_BATCH_SIZE = 500
+
 class MessageCreate(BaseModel):
     order_id: int
     content: str
     is_from_dispatcher: bool
+    # Idempotency key chosen by the client (e.g. a UUID per outbox entry):
+    # resending a message with the same key returns the stored one
+    client_key: Optional[str] = None
+
+class MessageBatch(BaseModel):
+    messages: List[MessageCreate]
+
+    @validator('messages')
+    def validate_size(cls, v):
+        if not 1 <= len(v) <= MAX_BATCH_SIZE:
+            raise ValueError(f'Send between 1 and {MAX_BATCH_SIZE} messages')
+        return v
 
 class MessageResponse(BaseModel):
     id: int
@@ -20,28 +39,170 @@ class MessageResponse(BaseModel):
     content: str
     is_from_dispatcher: bool
     timestamp: datetime.datetime
+    client_key: Optional[str] = None
 
     class Config:
         orm_mode = True
 
-@router.get("/{order_id}", response_model=List[MessageResponse])
-async def get_messages(order_id: int, db: Session = Depends(get_db)):
+class MessagePage(BaseModel):
+    data: List[MessageResponse]
+    next_cursor: Optional[str] = None
+    # since_id mode: ask again with the last id while has_more
+    has_more: bool = False
+
+class BatchResponse(BaseModel):
+    # One entry per sent message, in request order (stored or already existing)
+    data: List[MessageResponse]
+    created: int
+
+def order_messages_query(order_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    # Oldest first, keyed on (timestamp, id).
+    # Served by ix_messages_order_id_timestamp_id, no sort step needed
+    query = select(models.Message).filter(models.Message.order_id == order_id)
+    return keyset_page(query, models.Message.timestamp, models.Message.id, cursor, limit)
+
+def messages_after_query(order_id: int, after_id: int, limit: int = MAX_PAGE_SIZE):
+    # Everything newer than a message the client already has, in id order.
+    # Served by ix_messages_order_id_id
+    return select(models.Message).filter(
+        models.Message.order_id == order_id,
+        models.Message.id > after_id
+    ).order_by(models.Message.id.asc()).limit(limit)
+
+def chat_topic(order_id: int) -> str:
+    return f"chat/{order_id}"
+
+def message_json(message: models.Message) -> dict:
+    return {
+        "id": message.id,
+        "order_id": message.order_id,
+        "content": message.content,
+        "is_from_dispatcher": message.is_from_dispatcher,
+        "timestamp": message.timestamp.isoformat(),
+        "client_key": message.client_key,
+    }
+
+@router.get("/{order_id}", response_model=MessagePage)
+async def get_messages(
+    order_id: int,
+    cursor: Optional[str] = None,
+    since_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
     # Verify order exists/access logic
-    messages = db.query(models.Message).filter(models.Message.order_id == order_id).order_by(models.Message.timestamp.asc()).all()
-    return messages
+    if since_id is not None:
+        if cursor:
+            raise HTTPException(status_code=400, detail="Use either cursor or since_id")
+        # Delta sync: only what is newer than the client's last message
+        result = await db.execute(messages_after_query(order_id, since_id, limit + 1))
+        rows = result.scalars().all()
+        return {"data": rows[:limit], "next_cursor": None, "has_more": len(rows) > limit}
 
-@router.post("/", response_model=MessageResponse)
-async def send_message(message: MessageCreate, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == message.order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-        
-    db_message = models.Message(
-        order_id=message.order_id,
-        content=message.content,
-        is_from_dispatcher=message.is_from_dispatcher
+    try:
+        query = order_messages_query(order_id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    result = await db.execute(query)
+    page = page_response(result.scalars().all(), limit, "timestamp")
+    return {**page, "has_more": page["next_cursor"] is not None}
+
+def messages_by_client_key_query(keys):
+    # Two IN lists rather than a row-value IN, which SQLite answers with a table scan.
+    # Served by uq_messages_order_id_client_key, callers keep only the exact pairs
+    return select(models.Message).filter(
+        models.Message.order_id.in_({order_id for order_id, _ in keys}),
+        models.Message.client_key.in_({client_key for _, client_key in keys})
     )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
+
+async def store_messages(db: AsyncSession, messages: List[MessageCreate]) -> Tuple[List[models.Message], List[models.Message]]:
+    """
+    Inserts messages in one transaction, skipping the ones whose client_key is already
+    stored for that order. Returns (one row per message in request order, new rows).
+    """
+    order_ids = {m.order_id for m in messages}
+    result = await db.execute(select(models.Order.id).filter(models.Order.id.in_(order_ids)))
+    missing = order_ids - set(result.scalars())
+    if missing:
+        raise HTTPException(status_code=404, detail="Order not found" if len(order_ids) == 1 else f"Orders not found: {sorted(missing)}")
+
+    keys = {(m.order_id, m.client_key) for m in messages if m.client_key}
+    stored = {}
+    if keys:
+        result = await db.execute(messages_by_client_key_query(keys))
+        stored = {(m.order_id, m.client_key): m for m in result.scalars() if (m.order_id, m.client_key) in keys}
+
+    rows, new = [], []
+    for message in messages:
+        key = (message.order_id, message.client_key)
+        if message.client_key and key in stored:
+            rows.append(stored[key])
+            continue
+        db_message = models.Message(
+            order_id=message.order_id,
+            content=message.content,
+            is_from_dispatcher=message.is_from_dispatcher,
+            client_key=message.client_key
+        )
+        if message.client_key:
+            # Same key twice in one batch is one message
+            stored[key] = db_message
+        rows.append(db_message)
+        new.append(db_message)
+
+    db.add_all(new)
+    await db.commit()
+    # Only committed messages go out, a failed insert is never delivered
+    for db_message in new:
+        broker.publish(chat_topic(db_message.order_id), {"type": "message", "message": message_json(db_message)})
+    return rows, new
+
+async def store_messages_once(db: AsyncSession, messages: List[MessageCreate]):
+    try:
+        return await store_messages(db, messages)
+    except IntegrityError:
+        # A concurrent retry stored one of the keys first: the second pass finds it
+        await db.rollback()
+        return await store_messages(db, messages)
+
+@router.post("/", response_model=MessageResponse)
+async def send_message(message: MessageCreate, db: AsyncSession = Depends(get_db)):
+    rows, _ = await store_messages_once(db, [message])
+    return rows[0]
+
+@router.post("/batch", response_model=BatchResponse)
+async def send_messages_batch(batch: MessageBatch, db: AsyncSession = Depends(get_db)):
+    # Offline outbox flush: every message in one transaction, safe to retry as a whole
+    rows, new = await store_messages_once(db, batch.messages)
+    return {"data": rows, "created": len(new)}
+
+@router.websocket("/{order_id}/ws")
+async def chat_ws(websocket: WebSocket, order_id: int, last_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    """
+    Live messages of an order for the client and the dispatcher.
+    Reconnecting with last_id=<id of the last message seen> first replays what was
+    missed, then continues live, so a dropped connection never loses a message.
+    """
+    if not await db.get(models.Order, order_id):
+        await db.close()
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    with broker.subscribe(chat_topic(order_id)) as subscription:
+        # Subscribe before replaying: anything committed meanwhile is queued, and
+        # duplicates of the replay are skipped by id below
+        sent_up_to = last_id or 0
+        if last_id is not None:
+            while True:
+                result = await db.execute(messages_after_query(order_id, sent_up_to))
+                missed = result.scalars().all()
+                for message in missed:
+                    await websocket.send_json({"type": "message", "message": message_json(message)})
+                    sent_up_to = message.id
+                if len(missed) < MAX_PAGE_SIZE:
+                    break
+        # Don't hold a pooled connection for the lifetime of the socket
+        await db.close()
+
+        await stream_to_websocket(websocket, subscription, skip=lambda event: event["message"]["id"] <= sent_up_to)
@@ -1,6 +1,6 @@
 
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
 from services.documents import save_order_document
@@ -9,16 +9,17 @@ import os
 router = APIRouter(prefix="/documents", tags=["documents"])
 
 @router.post("/upload/{order_id}")
-async def upload_document_for_order(order_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+async def upload_document_for_order(order_id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    order = await db.get(models.Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
         
     # In production, check if user has permission (is owner or dispatcher)
     
-    file_path = await save_order_document(file, order_id)
+    stored = await save_order_document(file, order_id)
     
     # We could store metadata in DB if needed (e.g. Document table)
     # For now, just returning path
     
-    return {"filename": file.filename, "path": file_path, "status": "uploaded"}
+    return {"filename": file.filename, "path": stored.path, "size": stored.size, "sha256": stored.sha256,
+            "content_type": stored.content_type, "status": "uploaded"}
@@ -1,10 +1,16 @@
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, page_response
+from order_index import feed_topic, open_orders_index, order_json
+from pubsub import broker, stream_to_websocket
+from services.order_import import IMPORT_MAX_ROWS, csv_rows, import_orders, json_rows
 from pydantic import BaseModel
 from typing import Optional, List
+import csv
 import datetime
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -31,8 +37,22 @@ class OrderResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class OrderPage(BaseModel):
+    data: List[OrderResponse]
+    next_cursor: Optional[str] = None
+
+def open_orders_query(city: Optional[str] = None, state: Optional[str] = None, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    # Newest first, keyed on (created_at, id).
+    # Served by ix_orders_status_state_city_created_at / ix_orders_status_created_at
+    query = select(models.Order).filter(models.Order.status == "OPEN")
+    if city:
+        query = query.filter(models.Order.city == city)
+    if state:
+        query = query.filter(models.Order.state == state)
+    return keyset_page(query, models.Order.created_at, models.Order.id, cursor, limit, descending=True)
+
 @router.post("/", response_model=OrderResponse)
-async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
+async def create_order(order: OrderCreate, db: AsyncSession = Depends(get_db)):
     db_order = models.Order(
         vehicle_plate=order.vehicle_plate,
         vehicle_renavam=order.vehicle_renavam,
@@ -44,22 +64,104 @@ async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
         status="OPEN"
     )
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    await db.commit()
+    await db.refresh(db_order)
+    open_orders_index.track(db_order)
     return db_order
 
-@router.get("/", response_model=List[OrderResponse])
-async def list_orders(city: Optional[str] = None, state: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(models.Order).filter(models.Order.status == "OPEN")
-    if city:
-        query = query.filter(models.Order.city == city)
-    if state:
-        query = query.filter(models.Order.state == state)
-    return query.all()
+@router.post("/import")
+async def import_orders_bulk(request: Request, owner_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    """
+    Bulk onboarding for dispatch offices: a JSON array of POST /orders/ bodies, or a
+    multipart upload (field "file") of a CSV with those columns as header.
+    owner_id fills rows that don't set one. Answers a per-row report.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing CSV file field 'file'")
+        try:
+            return await import_orders(db, csv_rows(upload.file), OrderCreate, owner_id)
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable CSV: {e}")
+        finally:
+            await upload.close()
+
+    try:
+        items = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of orders or a CSV upload")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of orders")
+    if len(items) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {IMPORT_MAX_ROWS} orders per import")
+    return await import_orders(db, json_rows(items), OrderCreate, owner_id)
+
+@router.get("/", response_model=OrderPage)
+async def list_orders(
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        query = open_orders_query(city, state, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    result = await db.execute(query)
+    return page_response(result.scalars().all(), limit, "created_at")
+
+async def ensure_index_loaded(db: AsyncSession):
+    # Normally loaded at startup
+    if not open_orders_index.loaded:
+        await open_orders_index.load(db)
+
+@router.get("/feed", response_model=OrderPage)
+async def order_feed(
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    # Same page as GET /orders/ but answered from the in-memory index, for dispatchers polling
+    await ensure_index_loaded(db)
+    try:
+        return open_orders_index.query(state, city, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.websocket("/feed/ws")
+async def order_feed_ws(websocket: WebSocket, city: Optional[str] = None, state: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    try:
+        topic = feed_topic(state, city)
+    except ValueError:
+        await db.close()
+        await websocket.close(code=1008)
+        return
+
+    await ensure_index_loaded(db)
+    # Don't hold a pooled connection for the lifetime of the socket
+    await db.close()
+
+    await websocket.accept()
+    with broker.subscribe(topic) as subscription:
+        # Snapshot after subscribing: an order opened in between is in one or both, never lost
+        page = open_orders_index.query(state, city, limit=DEFAULT_PAGE_SIZE)
+        await websocket.send_json({
+            "type": "snapshot",
+            "data": [order_json(order) for order in page["data"]],
+            "next_cursor": page["next_cursor"],
+        })
+        # Then order_opened / order_closed events as they happen
+        await stream_to_websocket(websocket, subscription)
 
 @router.put("/{order_id}/status", response_model=OrderResponse)
-async def update_order_status(order_id: int, status: str, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+async def update_order_status(order_id: int, status: str, db: AsyncSession = Depends(get_db)):
+    order = await db.get(models.Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
         
@@ -69,13 +171,14 @@ async def update_order_status(order_id: int, status: str, db: Session = Depends(
          raise HTTPException(status_code=400, detail="Invalid status")
          
     order.status = status
-    db.commit()
-    db.refresh(order)
+    await db.commit()
+    await db.refresh(order)
+    open_orders_index.track(order)
     return order
 
 @router.get("/{order_id}", response_model=OrderResponse)
-async def get_order(order_id: int, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+async def get_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    order = await db.get(models.Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
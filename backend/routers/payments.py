@@ -1,34 +1,113 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from typing import Optional
+import re
+import httpx
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import joinedload
+from pydantic import BaseModel, validator
 from database import get_db
 import models
 from services.asaas import asaas_service
+from services.customers import MissingCustomerData, customer_cache
+from services.webhooks import record_event, webhook_worker
+from singleflight import SingleFlight
+import logging
 import os
 
+logger = logging.getLogger("Payments")
+
 router = APIRouter(prefix="/payments", tags=["payments"])
 
 DESCOMPLACA_COMMISSION_PERCENT = 0.10 # 10% commission example
 
+checkout_flight = SingleFlight()
+
+class CheckoutRequest(BaseModel):
+    # Client's CPF/CNPJ, required the first time (Asaas customers need one), stored on the user
+    cpf_cnpj: Optional[str] = None
+
+    @validator('cpf_cnpj')
+    def validate_cpf_cnpj(cls, v):
+        if v is None:
+            return v
+        digits = re.sub(r"\D", "", v)
+        if len(digits) not in (11, 14):
+            raise ValueError('cpf_cnpj must have 11 (CPF) or 14 (CNPJ) digits')
+        return digits
+
+def existing_checkout_query(proposal_id: int, idempotency_key: Optional[str] = None):
+    # The proposal's open charge (partial uq_payments_pending_proposal_id) and the
+    # payment made under this Idempotency-Key, if any, in one SELECT
+    condition = and_(models.Payment.proposal_id == proposal_id, models.Payment.status == "PENDING")
+    if idempotency_key:
+        condition = or_(condition, models.Payment.idempotency_key == idempotency_key)
+    return select(models.Payment).filter(condition)
+
+def checkout_response(payment: models.Payment):
+    return {"payment_url": payment.invoice_url, "qr_code": payment.bank_slip_url} # Verify params
+
+def checkout_query(proposal_id: int):
+    # Proposal + order + client + dispatcher in one SELECT (many-to-one joins),
+    # instead of a lazy load per relationship
+    return select(models.Proposal).options(
+        joinedload(models.Proposal.order).joinedload(models.Order.owner),
+        joinedload(models.Proposal.dispatcher),
+    ).filter(models.Proposal.id == proposal_id)
+
 @router.post("/checkout/{proposal_id}")
-async def create_checkout(proposal_id: int, db: Session = Depends(get_db)):
-    proposal = db.query(models.Proposal).filter(models.Proposal.id == proposal_id).first()
+async def create_checkout(proposal_id: int, body: Optional[CheckoutRequest] = None, db: AsyncSession = Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    # A double click or a client retry gets the charge already made, no Asaas round trip
+    payments = (await db.execute(existing_checkout_query(proposal_id, idempotency_key))).scalars().all()
+    keyed = next((p for p in payments if idempotency_key and p.idempotency_key == idempotency_key), None)
+    if keyed is not None and keyed.proposal_id != proposal_id:
+        raise HTTPException(status_code=422, detail="Idempotency-Key already used for another proposal")
+    existing = keyed or next((p for p in payments if p.status == "PENDING"), None)
+    if existing is not None:
+        return checkout_response(existing)
+
+    # Concurrent checkouts of one proposal share a single charge. The flight opens its own
+    # session on the same engine: the first caller's may be closed while others still wait
+    cpf_cnpj = body.cpf_cnpj if body else None
+    payment = await checkout_flight.do(proposal_id, start_checkout, db.bind, proposal_id, idempotency_key, cpf_cnpj)
+    return checkout_response(payment)
+
+async def start_checkout(engine: AsyncEngine, proposal_id: int, idempotency_key: Optional[str], cpf_cnpj: Optional[str] = None) -> models.Payment:
+    async with AsyncSession(engine, autoflush=False, expire_on_commit=False) as db:
+        return await create_charge(db, proposal_id, idempotency_key, cpf_cnpj)
+
+async def cancel_charge(asaas_payment_id: str):
+    try:
+        await asaas_service.delete_payment(asaas_payment_id)
+    except httpx.HTTPError as e:
+        logger.error(f"Unused Asaas charge {asaas_payment_id} could not be deleted, remove it by hand: {e!r}")
+
+async def create_charge(db: AsyncSession, proposal_id: int, idempotency_key: Optional[str], cpf_cnpj: Optional[str] = None) -> models.Payment:
+    result = await db.execute(checkout_query(proposal_id))
+    proposal = result.scalars().first()
     if not proposal:
         raise HTTPException(status_code=404, detail="Proposal not found")
+    if proposal.is_accepted:
+        raise HTTPException(status_code=409, detail="Proposal already paid")
     
     order = proposal.order
     client = order.owner
     dispatcher = proposal.dispatcher
     
-    # 1. Ensure Client exists in Asaas
-    # In a real app, we'd store the Asaas ID on the User model
-    # if not client.asaas_id:
-    #     customer = await asaas_service.create_customer(client.full_name, client.cpf, client.email, client.phone_number)
-    #     client.asaas_id = customer['id']
-    #     db.commit()
-    
-    # MOCK Client ID for Sandbox
-    client_asaas_id = "cus_000005031717" # Replace with real lookup
+    # Filled in on the first checkout, a document already on file is never replaced
+    if cpf_cnpj and not client.cpf_cnpj:
+        client.cpf_cnpj = cpf_cnpj
+        await db.commit()
+
+    # 1. Ensure Client exists in Asaas (created once, then read from cache / users table)
+    try:
+        client_asaas_id = await customer_cache.customer_id(db, client)
+    except MissingCustomerData as e:
+        raise HTTPException(status_code=400, detail=f"{e}, send cpf_cnpj with the checkout")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Asaas customer creation failed: {e}")
     
     # 2. Prepare Split
     # Split rule: Taxts + Net Fees go to Dispatcher.
@@ -62,40 +141,51 @@ async def create_checkout(proposal_id: int, db: Session = Depends(get_db)):
             description=f"Pedido #{order.id} - {order.service_type}",
             split=split_config
         )
-        
-        # Save Payment Record
-        db_payment = models.Payment(
-            asaas_payment_id=payment_data['id'],
-            status=payment_data['status'],
-            amount=payment_data['value'],
-            proposal_id=proposal.id
-        )
-        db.add(db_payment)
-        db.commit()
-        
-        return {"payment_url": payment_data.get("invoiceUrl"), "qr_code": payment_data.get("bankSlipUrl")} # Verify params
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    # Save Payment Record
+    db_payment = models.Payment(
+        asaas_payment_id=payment_data['id'],
+        status=payment_data['status'],
+        amount=payment_data['value'],
+        invoice_url=payment_data.get("invoiceUrl"),
+        bank_slip_url=payment_data.get("bankSlipUrl"),
+        idempotency_key=idempotency_key,
+        proposal_id=proposal.id
+    )
+    db.add(db_payment)
+    try:
+        await db.commit()
+        return db_payment
+    except IntegrityError:
+        # Another worker process opened a charge for this proposal first, answer with theirs
+        # and delete ours at Asaas so the client can't end up paying twice
+        await db.rollback()
+        logger.warning(f"Duplicate checkout for proposal {proposal_id}, deleting Asaas charge {payment_data['id']}")
+        await cancel_charge(payment_data['id'])
+        result = await db.execute(existing_checkout_query(proposal_id))
+        existing = result.scalars().first()
+        if existing is None:
+            raise HTTPException(status_code=409, detail="Idempotency-Key already used for another proposal")
+        return existing
+    except Exception as e:
+        await db.rollback()
+        await cancel_charge(payment_data['id'])
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/webhook/asaas")
-async def asaas_webhook(request: Request, db: Session = Depends(get_db)):
-    data = await request.json()
-    event = data.get("event")
-    payment_data = data.get("payment")
-    
-    if event in ["PAYMENT_CONFIRMED", "PAYMENT_RECEIVED"]:
-        payment_id = payment_data.get("id")
-        payment = db.query(models.Payment).filter(models.Payment.asaas_payment_id == payment_id).first()
-        if payment:
-            payment.status = "PAID"
-            # Update Proposal and Order
-            proposal = payment.proposal
-            proposal.is_accepted = True
-            
-            order = proposal.order
-            order.status = "PAID" # or IN_PROGRESS
-            
-            db.commit()
-            
+async def asaas_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    # Record and acknowledge, webhook_worker applies it (Asaas retries slow or failed deliveries)
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Expected a JSON object")
+    if not isinstance(data.get("payment") or {}, dict):
+        raise HTTPException(status_code=400, detail="Expected payment to be a JSON object")
+
+    if await record_event(db, data):
+        webhook_worker.notify()
     return {"status": "received"}
@@ -1,8 +1,10 @@
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
+from order_index import open_orders_index
 from pydantic import BaseModel, validator
 from typing import List
 import re
@@ -45,10 +47,14 @@ class ProposalResponse(BaseModel):
     class Config:
         orm_mode = True
 
+def order_proposals_query(order_id: int):
+    # Served by ix_proposals_order_id_is_accepted (order_id prefix)
+    return select(models.Proposal).filter(models.Proposal.order_id == order_id)
+
 @router.post("/", response_model=ProposalResponse)
-async def create_proposal(proposal: ProposalCreate, db: Session = Depends(get_db)):
+async def create_proposal(proposal: ProposalCreate, db: AsyncSession = Depends(get_db)):
     # Check if order exists and is OPEN
-    order = db.query(models.Order).filter(models.Order.id == proposal.order_id).first()
+    order = await db.get(models.Order, proposal.order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     if order.status != "OPEN":
@@ -73,11 +79,13 @@ async def create_proposal(proposal: ProposalCreate, db: Session = Depends(get_db
     # Diagram says "PROPOSAL RECEIVED"
     order.status = "PROPOSAL_RECEIVED"
     
-    db.commit()
-    db.refresh(db_proposal)
+    await db.commit()
+    await db.refresh(db_proposal)
+    # No longer OPEN, leaves the dispatcher feed
+    open_orders_index.track(order)
     return db_proposal
 
 @router.get("/order/{order_id}", response_model=List[ProposalResponse])
-async def list_proposals_for_order(order_id: int, db: Session = Depends(get_db)):
-    proposals = db.query(models.Proposal).filter(models.Proposal.order_id == order_id).all()
-    return proposals
+async def list_proposals_for_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(order_proposals_query(order_id))
+    return result.scalars().all()
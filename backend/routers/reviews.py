@@ -1,10 +1,13 @@
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
-from pydantic import BaseModel
-from typing import List, Optional
+from pagination import MAX_PAGE_SIZE
+from services.ratings import leaderboard_query, record_review
+from pydantic import BaseModel, validator
+from typing import Dict, List, Optional
 import datetime
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
@@ -14,6 +17,12 @@ class ReviewCreate(BaseModel):
     rating: int
     comment: Optional[str] = None
 
+    @validator('rating')
+    def validate_rating(cls, v):
+        if not 1 <= v <= 5:
+            raise ValueError('Rating must be between 1 and 5')
+        return v
+
 class ReviewResponse(BaseModel):
     id: int
     rating: int
@@ -23,9 +32,24 @@ class ReviewResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    dispatcher_id: int
+    full_name: Optional[str]
+    review_count: int
+    average: float
+    histogram: Dict[int, int]
+
+def accepted_proposal_query(order_id: int):
+    # Served by ix_proposals_order_id_is_accepted
+    return select(models.Proposal).filter(
+        models.Proposal.order_id == order_id,
+        models.Proposal.is_accepted == True
+    ).limit(1)
+
 @router.post("/", response_model=ReviewResponse)
-async def create_review(review: ReviewCreate, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == review.order_id).first()
+async def create_review(review: ReviewCreate, db: AsyncSession = Depends(get_db)):
+    order = await db.get(models.Order, review.order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -33,10 +57,8 @@ async def create_review(review: ReviewCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Service must be FINISHED to review")
         
     # Find dispatcher from accepted proposal
-    accepted_proposal = db.query(models.Proposal).filter(
-        models.Proposal.order_id == order.id, 
-        models.Proposal.is_accepted == True
-    ).first()
+    result = await db.execute(accepted_proposal_query(order.id))
+    accepted_proposal = result.scalars().first()
     
     dispatcher_id = accepted_proposal.dispatcher_id if accepted_proposal else None
 
@@ -47,6 +69,33 @@ async def create_review(review: ReviewCreate, db: Session = Depends(get_db)):
         dispatcher_id=dispatcher_id
     )
     db.add(db_review)
-    db.commit()
-    db.refresh(db_review)
+    if dispatcher_id:
+        # Same transaction: the aggregates never disagree with the reviews
+        await record_review(db, dispatcher_id, review.rating, order.state, order.city)
+    await db.commit()
+    await db.refresh(db_review)
     return db_review
+
+@router.get("/leaderboard", response_model=List[LeaderboardEntry])
+async def dispatcher_leaderboard(
+    state: Optional[str] = None,
+    city: Optional[str] = None,
+    min_reviews: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    # Cities are only unique within a state
+    if city and not state:
+        raise HTTPException(status_code=400, detail="city requires state")
+    result = await db.execute(leaderboard_query(state, city, min_reviews, limit))
+    return [
+        {
+            "rank": rank,
+            "dispatcher_id": rating.dispatcher_id,
+            "full_name": full_name,
+            "review_count": rating.review_count,
+            "average": round(rating.average, 2),
+            "histogram": {stars: getattr(rating, f"rating_{stars}") for stars in range(1, 6)},
+        }
+        for rank, (rating, full_name) in enumerate(result.all(), start=1)
+    ]
@@ -1,127 +1,489 @@
 import asyncio
 import logging
-from playwright.async_api import async_playwright, Page, Browser, BrowserContext
+import os
+import time
+import httpx
+from browser import browser_pool
+from auth_state import auth_state_store
+
+PORTAL = "placas"
+
+TABLE_ROWS_SELECTOR = '.table-scrollable tbody tr'
+NEXT_PAGE_SELECTOR = (
+    '.pagination li.next:not(.disabled) a, '
+    '.pagination a[rel="next"], '
+    '.paginate_button.next:not(.disabled)'
+)
+
+# Returns [{cells: [td innerText...], pago: bool}] for every row in one round trip
+EXTRACT_TABLE_JS = """
+(selector) => Array.from(document.querySelectorAll(selector)).map(tr => {
+    const tds = Array.from(tr.querySelectorAll('td'));
+    return {
+        cells: tds.map(td => td.innerText),
+        pago: tds.length > 11 && tds[11].querySelector('.fa-check') !== null,
+    };
+})
+"""
+
+FIRST_ROW_ID_JS = """
+(selector) => {
+    const td = document.querySelector(selector + ' td:nth-child(2)');
+    return td ? td.innerText.trim() : null;
+}
+"""
+
+class IncompletePagination(RuntimeError):
+    """The table walk stopped before the last page, rows not read may still exist on the portal."""
+
+    def __init__(self, message, rows=None):
+        super().__init__(message)
+        # Rows read before the walk stopped, filled in by fetch_pipeline_rows
+        self.rows = rows or []
+
+
+def parse_pipeline_row(row):
+    """Maps a raw {cells, pago} table row to a pipeline item, or None if it is not an order row."""
+    cells = row["cells"]
+    if len(cells) < 12:
+        return None
+    
+    # Based on previous analysis:
+    # 0: Dropdown
+    # 1: ID (7970)
+    # 2: Placa (FJG5E18)
+    # 7: Proprietário 
+    # 10: Situação
+    # 11: Pago (Icon)
+    return {
+        "id": cells[1].strip(),
+        "placa": cells[2].strip(),
+        "proprietario": cells[7].strip(),
+        "situacao": cells[10].strip(),
+        "flag_pago": bool(row["pago"]),
+        "flag_foto": False
+    }
+
+def classify_photos_html(content):
+    """True/False when the detail page clearly shows (or denies) attachments, None if unsure."""
+    if "Nenhum arquivo" in content or "Sem anexos" in content:
+        return False
+    # If we see "Foto Traseira" and "Visualizar" or similar
+    if "Visualizar" in content or "Download" in content:
+        return True
+    return None
+
+def is_finished(item):
+    return "Finalizada" in item["situacao"] or "Fabricada" in item["situacao"]
+
+def needs_photo_check(item):
+    return item["flag_pago"] and not is_finished(item)
 
 class PlacasScraper:
-    def __init__(self):
-        self.playwright = None
-        self.browser = None
-        self.context = None
-        self.page = None
+    def __init__(self, pool=None, state_store=None):
+        # Contexts are leased per operation from the shared pool (see browser.BrowserPool),
+        # the portal session survives between leases (and restarts) through self.storage_state
+        self.pool = pool or browser_pool
+        self.state_store = state_store or auth_state_store
+        self.storage_state = None
+        self.username = os.getenv("PLACAS_USERNAME")
+        self.password = os.getenv("PLACAS_PASSWORD")
+        # A restored session is re-validated with a cheap HTTP probe at most this often
+        self.session_probe_seconds = int(os.getenv("SCRAPER_SESSION_PROBE_SECONDS", "300"))
+        self._session_checked_at = None
         self.logger = logging.getLogger("PlacasScraper")
         logging.basicConfig(level=logging.INFO)
         self.base_url = "https://placaswebmercosul.com.br"
+        # Photo checks run on a small set of worker pages within one leased context
+        self.photo_check_concurrency = int(os.getenv("SCRAPER_PHOTO_CONCURRENCY", "4"))
+        self.photo_check_timeout = float(os.getenv("SCRAPER_PHOTO_TIMEOUT", "45"))
+        self.max_pages = int(os.getenv("SCRAPER_MAX_PAGES", "50"))
+        # "http" fetches detail pages with the exported cookies and only falls back
+        # to the browser when the HTML is ambiguous, "browser" always navigates
+        self.photo_check_mode = os.getenv("SCRAPER_PHOTO_MODE", "http")
+        self.http_concurrency = int(os.getenv("SCRAPER_HTTP_CONCURRENCY", "16"))
+        self._http = None
+        self._http_cookies = None
+
+    @property
+    def cookies(self):
+        return self.storage_state["cookies"] if self.storage_state else None
+
+    @cookies.setter
+    def cookies(self, cookies):
+        self.storage_state = {"cookies": cookies, "origins": []} if cookies is not None else None
 
     async def start(self):
-        if not self.playwright:
-            self.playwright = await async_playwright().start()
-        
-        if not self.browser:
-            # headless=False so we can see what's happening (optional)
-            self.browser = await self.playwright.chromium.launch(headless=False, args=["--no-sandbox"])
-        
-        if not self.context:
-            self.context = await self.browser.new_context()
-        
-        if not self.page:
-            self.page = await self.context.new_page()
+        # Warm up the shared browser
+        await self.pool.start()
 
-    async def login(self, username, password):
-        await self.start()
-        try:
-            await self.page.goto(f"{self.base_url}/Login", timeout=60000)
-            
-            # Check if already logged in
-            if "/Login" not in self.page.url:
-                self.logger.info("Already logged in.")
+    async def ensure_session(self):
+        """
+        Makes sure there is a usable portal session: the saved storage state when the
+        probe accepts it, otherwise a fresh login with PLACAS_USERNAME/PLACAS_PASSWORD.
+        """
+        if self.storage_state is None and self.username:
+            self.storage_state = self.state_store.load(PORTAL, self.username)
+
+        if self.storage_state:
+            recently_checked = (
+                self._session_checked_at is not None
+                and time.monotonic() - self._session_checked_at < self.session_probe_seconds
+            )
+            if recently_checked or await self.probe_session():
+                self._session_checked_at = self._session_checked_at if recently_checked else time.monotonic()
                 return True
 
-            # Use generic selectors based on standard login forms
-            # Adjust these selectors based on actual page inspection if needed
-            # Assuming typically names like 'Usuario', 'Senha' or IDs
-            # Based on common ASP.NET or similar structures
-            
-            # Try to find inputs. 
-            # Note: User didn't give credentials yet, so this might fail or need refinement.
-            # Using broad selectors for robustness
-            await self.page.fill('input[name*="Usuario"], input[id*="Usuario"], input[name*="Cnpj"], input[id*="Cnpj"]', username)
-            await self.page.fill('input[name*="Senha"], input[id*="Senha"], input[type="password"]', password)
-            
-            await self.page.click('button[type="submit"], input[type="submit"], .btn-primary')
-            
-            await self.page.wait_for_url(lambda u: "/Login" not in u, timeout=10000)
-            return True
-        except Exception as e:
-            self.logger.error(f"Login failed: {e}")
+        return await self.relogin()
+
+    async def probe_session(self):
+        # Listing page without redirects: 200 means logged in, 302 means back to /Login
+        try:
+            response = await self._http_client().get("/PedidoAutorizacao/Index")
+        except httpx.HTTPError as e:
+            self.logger.warning(f"Session probe failed: {e!r}")
             return False
+        return response.status_code == 200 and "/Login" not in str(response.url)
 
-    async def fetch_pipeline_data(self):
-        await self.start()
-        data = []
-        
+    async def relogin(self):
+        self._session_checked_at = None
+        if not (self.username and self.password):
+            return False
+        self.logger.info("Portal session missing or expired, logging in again")
+        return await self.login(self.username, self.password)
+
+    async def _remember_state(self, context, account=None):
+        state = await context.storage_state()
+        if state != self.storage_state:
+            self.storage_state = state
+            account = account or self.username
+            if account:
+                self.state_store.save(PORTAL, account, state)
+
+    async def login(self, username=None, password=None):
+        username = username or self.username
+        password = password or self.password
         try:
-            # Navigate to "Pedidos de Placas"
-            # We know from research the URL likely ends in /PedidoAutorizacao/Index or similar
-            # Or we click through the menu
-            await self.page.goto(f"{self.base_url}/PedidoAutorizacao/Index", timeout=60000)
-            
-            # Filter by "Todos" if needed to see all relevant data
-            # Based on previous analysis, we need to click 'btnBuscar'
-            # And maybe set a date range. For now, assuming default view or 'Todos' is accessible.
-            
-            # Let's try to grab rows
-            rows = await self.page.query_selector_all('.table-scrollable tbody tr')
-            
-            for row in rows:
-                # Extract basic fields
-                cols = await row.query_selector_all('td')
-                if len(cols) < 12: 
-                    continue
+            async with self.pool.lease(storage_state=self.storage_state) as context:
+                page = await context.new_page()
+                await page.goto(f"{self.base_url}/Login", timeout=60000)
                 
-                # Based on previous analysis:
-                # 0: Dropdown
-                # 1: ID (7970)
-                # 2: Placa (FJG5E18)
-                # 7: Proprietário 
-                # 10: Situação
-                # 11: Pago (Icon)
+                # Check if already logged in
+                if "/Login" not in page.url:
+                    self.logger.info("Already logged in.")
+                    self._session_checked_at = time.monotonic()
+                    return True
+
+                # Use generic selectors based on standard login forms
+                # Adjust these selectors based on actual page inspection if needed
+                # Assuming typically names like 'Usuario', 'Senha' or IDs
+                # Based on common ASP.NET or similar structures
                 
-                placa = await cols[2].inner_text()
-                proprietario = await cols[7].inner_text()
-                situacao = await cols[10].inner_text()
+                # Try to find inputs. 
+                # Note: User didn't give credentials yet, so this might fail or need refinement.
+                # Using broad selectors for robustness
+                await page.fill('input[name*="Usuario"], input[id*="Usuario"], input[name*="Cnpj"], input[id*="Cnpj"]', username)
+                await page.fill('input[name*="Senha"], input[id*="Senha"], input[type="password"]', password)
                 
-                # Check Pago
-                pago_icon = await cols[11].query_selector('.fa-check')
-                flag_pago = True if pago_icon else False
+                await page.click('button[type="submit"], input[type="submit"], .btn-primary')
                 
-                # ID for details
-                item_id = await cols[1].inner_text()
+                await page.wait_for_url(lambda u: "/Login" not in u, timeout=10000)
+                # Saved so a restart or deploy doesn't need a new login
+                await self._remember_state(context, username)
+                self._session_checked_at = time.monotonic()
+                return True
+        except Exception as e:
+            self.logger.error(f"Login failed: {e}")
+            return False
+
+    async def iter_pipeline_rows(self, bulk=True):
+        """
+        Yields order rows from the table as each portal page is read, without
+        visiting any detail page. Raises on failure so callers don't mistake an
+        error for an empty portal.
+        """
+        await self.ensure_session()
+        
+        for attempt in range(2):
+            async with self.pool.lease(storage_state=self.storage_state) as context:
+                page = await context.new_page()
                 
-                flag_foto = False
+                # Navigate to "Pedidos de Placas"
+                # We know from research the URL likely ends in /PedidoAutorizacao/Index or similar
+                # Or we click through the menu
+                await page.goto(f"{self.base_url}/PedidoAutorizacao/Index", timeout=60000)
+                if "/Login" in page.url:
+                    # Saved session expired since the last probe, log in again once
+                    if attempt == 0 and await self.relogin():
+                        continue
+                    raise RuntimeError("Not logged in to the Placas portal")
+                # Portal may rotate its session cookie, keep the saved state and HTTP fast path in sync
+                await self._remember_state(context)
                 
-                # Rule: Check photos only if Paid and not Finalized/Fabricada
-                # Optimization to avoid checking every single row
-                if flag_pago and "Finalizada" not in situacao and "Fabricada" not in situacao:
-                    flag_foto = await self.check_photos(item_id)
-                elif "Finalizada" in situacao or "Fabricada" in situacao:
-                    # If finished, assume photos are done or irrelevant
-                    flag_foto = True
+                # Filter by "Todos" if needed to see all relevant data
+                # Based on previous analysis, we need to click 'btnBuscar'
+                # And maybe set a date range. For now, assuming default view or 'Todos' is accessible.
                 
-                data.append({
-                    "id": item_id,
-                    "placa": placa.strip(),
-                    "proprietario": proprietario.strip(),
-                    "situacao": situacao.strip(),
-                    "flag_pago": flag_pago,
-                    "flag_foto": flag_foto
-                })
+                async for page_rows in self.iter_table_pages(page, bulk=bulk):
+                    for row in page_rows:
+                        item = parse_pipeline_row(row)
+                        if item is None:
+                            continue
+                        if is_finished(item):
+                            # If finished, assume photos are done or irrelevant
+                            item["flag_foto"] = True
+                        yield item
+                return
+
+    async def fetch_pipeline_rows(self, bulk=True):
+        rows = []
+        try:
+            async for item in self.iter_pipeline_rows(bulk=bulk):
+                rows.append(item)
+        except IncompletePagination as e:
+            e.rows = rows
+            raise
+        return rows
+
+    async def fetch_pipeline_data(self, bulk=True):
+        data = []
+        
+        try:
+            try:
+                data = await self.fetch_pipeline_rows(bulk=bulk)
+            except IncompletePagination as e:
+                # Same as pipeline.run_refresh: keep what was read
+                self.logger.warning(f"Pagination incomplete, using the {len(e.rows)} rows read: {e}")
+                data = e.rows
+            
+            # Rule: Check photos only if Paid and not Finalized/Fabricada
+            # Optimization to avoid checking every single row
+            to_check = [item["id"] for item in data if needs_photo_check(item)]
+            photos = await self.check_photos_many(to_check)
+            for item in data:
+                if item["id"] in photos:
+                    item["flag_foto"] = photos[item["id"]]
                 
         except Exception as e:
             self.logger.error(f"Error fetching data: {e}")
         
         return data
 
-    async def check_photos(self, item_id):
+    async def iter_table_pages(self, page, bulk=True):
+        """
+        Yields the rows of each table page, following the portal pagination up to max_pages.
+        Raises IncompletePagination (after yielding what was read) if a page could not be
+        reached or max_pages ran out before the last one.
+        """
+        seen = set()
+        for _ in range(self.max_pages):
+            if bulk:
+                page_rows = await self.read_table_bulk(page)
+            else:
+                page_rows = await self.read_table_per_cell(page)
+            
+            # Stop if the "next" click did not actually move to a new page
+            new_rows = []
+            for r in page_rows:
+                item_id = r["cells"][1].strip() if len(r["cells"]) > 1 else None
+                if item_id is None or item_id in seen:
+                    continue
+                seen.add(item_id)
+                new_rows.append(r)
+            if not new_rows:
+                return
+            yield new_rows
+            
+            if not await self.goto_next_page(page):
+                return
+        raise IncompletePagination(f"More than SCRAPER_MAX_PAGES={self.max_pages} table pages")
+
+    async def read_all_pages(self, page, bulk=True):
+        return [r async for page_rows in self.iter_table_pages(page, bulk=bulk) for r in page_rows]
+
+    async def read_table_bulk(self, page):
+        # Single in-page evaluation for the whole table instead of ~6 IPC calls per row
+        return await page.evaluate(EXTRACT_TABLE_JS, TABLE_ROWS_SELECTOR)
+
+    async def read_table_per_cell(self, page):
+        # Original row-by-row path, kept for comparison (see benchmarks/bench_table_extraction.py)
+        rows = []
+        for row in await page.query_selector_all(TABLE_ROWS_SELECTOR):
+            cols = await row.query_selector_all('td')
+            if len(cols) < 12:
+                continue
+            cells = [""] * len(cols)
+            for i in (1, 2, 7, 10):
+                cells[i] = await cols[i].inner_text()
+            pago = await cols[11].query_selector('.fa-check') is not None
+            rows.append({"cells": cells, "pago": pago})
+        return rows
+
+    async def goto_next_page(self, page):
+        """False on the last page, raises IncompletePagination when the next one doesn't load."""
+        next_link = await page.query_selector(NEXT_PAGE_SELECTOR)
+        if not next_link:
+            return False
+        
+        first_id = await page.evaluate(FIRST_ROW_ID_JS, TABLE_ROWS_SELECTOR)
+        try:
+            await next_link.click()
+            await page.wait_for_load_state()
+            # Works for both ajax (DataTables) and full page pagination
+            await page.wait_for_function(
+                "([selector, prev]) => {"
+                " const td = document.querySelector(selector + ' td:nth-child(2)');"
+                " return td && td.innerText.trim() !== prev; }",
+                arg=[TABLE_ROWS_SELECTOR, first_id],
+                timeout=15000,
+            )
+            return True
+        except Exception as e:
+            self.logger.warning(f"Pagination stopped: {e}")
+            raise IncompletePagination(f"Next table page did not load: {e}") from e
+
+    async def check_photos_many(self, item_ids, concurrency=None, on_result=None):
+        """
+        Checks photos for several orders at once, over plain HTTP first and then
+        on a bounded pool of worker pages for whatever HTTP couldn't settle.
+        Returns {item_id: flag_foto}. A timeout or error only affects its own item, and
+        items left unchecked (no browser page could be opened) are not in the result.
+        on_result(item_id, flag_foto) is awaited as each check completes.
+        """
+        if not item_ids:
+            return {}
+
+        results = {}
+        pending = list(item_ids)
+        if self.photo_check_mode == "http" and self.cookies:
+            results = await self._check_photos_http_many(pending, on_result)
+            pending = [item_id for item_id in pending if item_id not in results]
+            if pending:
+                self.logger.info(f"{len(pending)} photo checks ambiguous over HTTP, using the browser")
+
+        if pending:
+            async with self.pool.lease(storage_state=self.storage_state) as context:
+                results.update(await self._check_photos_on(context, pending, concurrency, on_result))
+        return results
+
+    def _http_client(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.http_concurrency, max_keepalive_connections=self.http_concurrency),
+                timeout=httpx.Timeout(15.0, connect=5.0),
+                headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36"},
+            )
+        if self._http_cookies is not self.cookies:
+            # Same session as the Playwright context the cookies were exported from
+            jar = httpx.Cookies()
+            for c in self.cookies or []:
+                jar.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"))
+            self._http.cookies = jar
+            self._http_cookies = self.cookies
+        return self._http
+
+    async def check_photos_http(self, item_id):
+        """Fetches the detail page without a browser. Returns None when the answer is unclear."""
+        try:
+            response = await self._http_client().get(f"/PedidoAutorizacao/{item_id}")
+        except httpx.HTTPError as e:
+            self.logger.warning(f"HTTP photo check failed for {item_id}: {e!r}")
+            return None
+        # Redirect to /Login or an error page: let the browser decide
+        if response.status_code != 200:
+            return None
+        return classify_photos_html(response.text)
+
+    async def _check_photos_http_many(self, item_ids, on_result):
+        slots = asyncio.Semaphore(self.http_concurrency)
+        results = {}
+
+        async def worker(item_id):
+            async with slots:
+                flag_foto = await self.check_photos_http(item_id)
+            if flag_foto is None:
+                return
+            results[item_id] = flag_foto
+            if on_result:
+                await on_result(item_id, flag_foto)
+
+        await asyncio.gather(*(worker(item_id) for item_id in item_ids))
+        return results
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _check_photos_on(self, context, item_ids, concurrency, on_result):
+        concurrency = max(1, min(concurrency or self.photo_check_concurrency, len(item_ids)))
+        pages = asyncio.Queue()
+        live = 0
+        for _ in range(concurrency):
+            try:
+                pages.put_nowait(await context.new_page())
+                live += 1
+            except Exception as e:
+                self.logger.warning(f"Could not open a photo check page: {e!r}")
+                break
+        if not live:
+            return {}
+
+        results = {}
+
+        async def worker(item_id):
+            nonlocal live
+            page = await pages.get()
+            if page is None:
+                # Every page is gone, the row stays unchecked (left out of the results)
+                pages.put_nowait(None)
+                return
+            try:
+                results[item_id] = await asyncio.wait_for(
+                    self.check_photos(item_id, page=page), timeout=self.photo_check_timeout
+                )
+            except Exception as e:
+                # Page may be stuck mid-navigation, swap it for a fresh one
+                self.logger.warning(f"Photo check failed for {item_id}: {e!r}")
+                results[item_id] = False
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                try:
+                    page = await context.new_page()
+                except Exception as e:
+                    # Carry on with the pages left, the batch keeps what it has
+                    self.logger.warning(f"Could not replace photo check page: {e!r}")
+                    page = None
+                    live -= 1
+            finally:
+                if page is not None:
+                    pages.put_nowait(page)
+                elif live == 0:
+                    # Wakes the waiting workers so they give up instead of waiting forever
+                    pages.put_nowait(None)
+            if on_result:
+                await on_result(item_id, results[item_id])
+
+        try:
+            await asyncio.gather(*(worker(item_id) for item_id in item_ids))
+        finally:
+            while not pages.empty():
+                page = pages.get_nowait()
+                try:
+                    if page is not None:
+                        await page.close()
+                except Exception:
+                    pass
+
+        return results
+
+    async def check_photos(self, item_id, page=None):
+        if page is None:
+            async with self.pool.lease(storage_state=self.storage_state) as context:
+                return await self.check_photos(item_id, page=await context.new_page())
         try:
             # Navigate to detail/anexos page
             # Based on research: /PedidoAutorizacao/{id} or similar for "Anexos"
@@ -135,7 +497,7 @@ class PlacasScraper:
             # href="/PedidoAutorizacao/7970" seems to be the main one.
             
             url = f"{self.base_url}/PedidoAutorizacao/{item_id}"
-            await self.page.goto(url, timeout=30000)
+            await page.goto(url, timeout=30000)
             
             # Check for generic "Photos" or "Anexos" indicators
             # We are looking for something that denies presence, like "0 arquivos" 
@@ -147,22 +509,10 @@ class PlacasScraper:
             # For now, simplistic check: is there any uploaded file section?
             # Adjust based on real verification
             
-            content = await self.page.content()
-            if "Nenhum arquivo" in content or "Sem anexos" in content:
-                return False
-                
-            # If we see "Foto Traseira" and "Visualizar" or similar
-            if "Visualizar" in content or "Download" in content:
-                return True
-                
-            return False # Default to False if unsure
-        except:
+            content = await page.content()
+            flag_foto = classify_photos_html(content)
+            return bool(flag_foto) # Default to False if unsure
+        except Exception:
             return False
 
-    async def close(self):
-        if self.context:
-            await self.context.close()
-        if self.browser:
-            await self.browser.close()
-            
 scraper_instance = PlacasScraper()
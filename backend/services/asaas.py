@@ -1,20 +1,134 @@
 
+import asyncio
+import importlib.util
+import logging
 import os
+import random
+from typing import Dict
 import httpx
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 
+logger = logging.getLogger("Asaas")
+
 ASAAS_API_URL = os.getenv("ASAAS_API_URL", "https://sandbox.asaas.com/api/v3")
 ASAAS_API_KEY = os.getenv("ASAAS_API_KEY")
 
+# Connection pool shared by every call (keep-alive: no TCP/TLS handshake per checkout)
+ASAAS_MAX_CONNECTIONS = int(os.getenv("ASAAS_MAX_CONNECTIONS", "20"))
+ASAAS_MAX_KEEPALIVE = int(os.getenv("ASAAS_MAX_KEEPALIVE", "10"))
+ASAAS_KEEPALIVE_EXPIRY = float(os.getenv("ASAAS_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+ASAAS_HTTP2 = os.getenv("ASAAS_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+ASAAS_CONNECT_TIMEOUT = float(os.getenv("ASAAS_CONNECT_TIMEOUT", "5"))
+ASAAS_READ_TIMEOUT = float(os.getenv("ASAAS_READ_TIMEOUT", "20"))
+
+# Retries use exponential backoff (base * 2^attempt, with jitter)
+ASAAS_MAX_RETRIES = int(os.getenv("ASAAS_MAX_RETRIES", "3"))
+ASAAS_RETRY_BACKOFF = float(os.getenv("ASAAS_RETRY_BACKOFF", "0.5"))
+ASAAS_RETRY_MAX_DELAY = float(os.getenv("ASAAS_RETRY_MAX_DELAY", "10"))
+# Answers that mean the request was not processed: safe to resend anything
+RETRY_STATUSES = {429, 503}
+# A 500/502/504 or a read timeout may come after Asaas committed the write, so
+# only methods that can be repeated without effect are resent on those
+IDEMPOTENT_METHODS = {"GET", "DELETE"}
+IDEMPOTENT_RETRY_STATUSES = RETRY_STATUSES | {500, 502, 504}
+
 class AsaasService:
-    def __init__(self):
+    def __init__(self, base_url: str = None, api_key: str = None, transport: httpx.AsyncBaseTransport = None):
         self.headers = {
-            "access_token": ASAAS_API_KEY,
+            "access_token": api_key or ASAAS_API_KEY,
             "Content-Type": "application/json"
         }
-        self.base_url = ASAAS_API_URL
+        self.base_url = base_url or ASAAS_API_URL
+        # Tests/benchmarks plug the local stub in here
+        self.transport = transport
+        self._client = None
+        self.max_retries = ASAAS_MAX_RETRIES
+        self.retry_backoff = ASAAS_RETRY_BACKOFF
+        self.retries = 0
+        self.latency: Dict[str, metrics.LatencyStats] = {}
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            http2=ASAAS_HTTP2 and self.transport is None,
+            transport=self.transport,
+            limits=httpx.Limits(
+                max_connections=ASAAS_MAX_CONNECTIONS,
+                max_keepalive_connections=ASAAS_MAX_KEEPALIVE,
+                keepalive_expiry=ASAAS_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(ASAAS_READ_TIMEOUT, connect=ASAAS_CONNECT_TIMEOUT),
+        )
+
+    async def start(self):
+        # Called at app startup, the first request would open it otherwise
+        if self._client is None:
+            self._client = self._new_client()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._new_client()
+        return self._client
+
+    def retry_delay(self, attempt: int, response: httpx.Response = None) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), ASAAS_RETRY_MAX_DELAY)
+        delay = self.retry_backoff * (2 ** attempt)
+        return min(delay * random.uniform(0.5, 1.0), ASAAS_RETRY_MAX_DELAY)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        One Asaas call on the pooled client. Every method is retried on failed
+        connections and 429/503 (the request was never processed); GET and DELETE
+        also on 500/502/504 and read timeouts. A POST is not resent after those:
+        Asaas may already have created the charge or customer.
+        Raises httpx.HTTPStatusError when it gives up.
+        """
+        stats = self.latency.setdefault(f"{method} {path.split('?')[0]}", metrics.LatencyStats())
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_statuses = IDEMPOTENT_RETRY_STATUSES if idempotent else RETRY_STATUSES
+        retry_errors = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+        if idempotent:
+            retry_errors += (httpx.ReadTimeout,)
+        attempt = 0
+        while True:
+            with stats.time():
+                try:
+                    response = await self.client.request(method, path, **kwargs)
+                except retry_errors as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.warning(f"Asaas {method} {path} failed ({e!r}), retrying")
+                    response = None
+            if response is not None:
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning(f"Asaas {method} {path} answered {response.status_code}, retrying")
+            await asyncio.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+            self.retries += 1
+
+    def stats(self) -> Dict:
+        return {
+            "http2": ASAAS_HTTP2,
+            "retries": self.retries,
+            "calls": {name: stats.as_dict() for name, stats in self.latency.items()},
+        }
 
     async def create_customer(self, name: str, cpf_cnpj: str, email: str = None, phone: str = None):
         """Creates a new customer in Asaas"""
@@ -25,14 +139,8 @@ class AsaasService:
             "mobilePhone": phone
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/customers",
-                json=payload,
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.request("POST", "/customers", json=payload)
+        return response.json()
 
     async def create_payment(self, customer_id: str, billing_type: str, value: float, due_date: str, description: str, split: list = None):
         """
@@ -58,14 +166,13 @@ class AsaasService:
         if split:
             payload["split"] = split
             
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/payments",
-                json=payload,
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.request("POST", "/payments", json=payload)
+        return response.json()
+
+    async def delete_payment(self, payment_id: str):
+        """Cancels a charge that was never shown to anyone (Asaas answers {"deleted": true})."""
+        response = await self.request("DELETE", f"/payments/{payment_id}")
+        return response.json()
 
     async def create_subaccount(self, name: str, email: str, cpf_cnpj: str, mobile_phone: str, postal_code: str, address: str, address_number: str, birth_date: str = None):
         """Creates a subaccount for the Dispatcher (white-label equivalent or simply connected account)"""
@@ -83,13 +190,8 @@ class AsaasService:
             # "companyType": "LIMITED" etc if PJ
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/accounts",
-                json=payload,
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.request("POST", "/accounts", json=payload)
+        return response.json()
 
 asaas_service = AsaasService()
+metrics.register("asaas", asaas_service.stats)
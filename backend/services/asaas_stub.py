@@ -0,0 +1,104 @@
+"""
+Local stand-in for the Asaas API (the /customers, /payments and /accounts calls
+AsaasService makes), so the client can be tested and benchmarked offline.
+
+    python services/asaas_stub.py --port 8089 --latency-ms 20 --error-rate 0.05
+    ASAAS_API_URL=http://127.0.0.1:8089 uvicorn api:app
+
+In tests, mount it without a socket: AsaasService(transport=httpx.ASGITransport(app=stub)).
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import uuid
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_stub_app(latency_ms: float = 0, error_rate: float = 0) -> FastAPI:
+    """
+    latency_ms delays every answer, error_rate answers that share of calls with a 503.
+    app.state.fail_next is a list of status codes served (and consumed) before anything
+    else, e.g. [429, 503] to exercise the client's retries deterministically.
+    """
+    app = FastAPI(title="Asaas stub")
+    app.state.latency_ms = latency_ms
+    app.state.error_rate = error_rate
+    app.state.fail_next = []
+    app.state.calls = {}
+    app.state.customers = {}
+    app.state.payments = {}
+    counter = itertools.count(1)
+
+    @app.middleware("http")
+    async def faults(request: Request, call_next):
+        key = f"{request.method} {request.url.path}"
+        app.state.calls[key] = app.state.calls.get(key, 0) + 1
+        if app.state.latency_ms:
+            await asyncio.sleep(app.state.latency_ms / 1000)
+        if app.state.fail_next:
+            status = app.state.fail_next.pop(0)
+            headers = {"Retry-After": "0"} if status == 429 else {}
+            return JSONResponse({"errors": [{"code": "stub", "description": f"injected {status}"}]}, status_code=status, headers=headers)
+        if app.state.error_rate and random.random() < app.state.error_rate:
+            return JSONResponse({"errors": [{"code": "stub", "description": "random 503"}]}, status_code=503)
+        if not request.headers.get("access_token"):
+            return JSONResponse({"errors": [{"code": "invalid_access_token"}]}, status_code=401)
+        return await call_next(request)
+
+    @app.post("/customers")
+    async def create_customer(body: Dict):
+        customer = {"object": "customer", "id": f"cus_{next(counter):012d}", **body}
+        app.state.customers[customer["id"]] = customer
+        return customer
+
+    @app.post("/payments")
+    async def create_payment(body: Dict):
+        if not str(body.get("customer", "")).startswith("cus_"):
+            return JSONResponse({"errors": [{"code": "invalid_customer"}]}, status_code=400)
+        payment_id = f"pay_{next(counter):012d}"
+        payment = {
+            "object": "payment",
+            "id": payment_id,
+            "status": "PENDING",
+            "invoiceUrl": f"https://sandbox.asaas.com/i/{payment_id}",
+            **body,
+        }
+        app.state.payments[payment_id] = payment
+        return payment
+
+    @app.get("/payments/{payment_id}")
+    async def get_payment(payment_id: str):
+        if payment_id not in app.state.payments:
+            return JSONResponse({"errors": [{"code": "not_found"}]}, status_code=404)
+        return app.state.payments[payment_id]
+
+    @app.delete("/payments/{payment_id}")
+    async def delete_payment(payment_id: str):
+        if app.state.payments.pop(payment_id, None) is None:
+            return JSONResponse({"errors": [{"code": "not_found"}]}, status_code=404)
+        return {"deleted": True, "id": payment_id}
+
+    @app.post("/accounts")
+    async def create_account(body: Dict):
+        return {"object": "account", "id": str(uuid.uuid4()), "walletId": str(uuid.uuid4()), **body}
+
+    return app
+
+
+app = create_stub_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(args.latency_ms, args.error_rate), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,95 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+import metrics
+import models
+from services.asaas import AsaasService, asaas_service
+from singleflight import SingleFlight
+
+logger = logging.getLogger("AsaasCustomers")
+
+# user id -> Asaas customer id, most recently used last
+CUSTOMER_CACHE_SIZE = int(os.getenv("ASAAS_CUSTOMER_CACHE_SIZE", "10000"))
+
+
+class MissingCustomerData(Exception):
+    """The client has no CPF/CNPJ on file, Asaas will not create a customer without it."""
+
+
+class CustomerCache:
+    """
+    Asaas customer ids, read through an in-memory LRU in front of users.asaas_customer_id.
+    A client without one gets it created once: concurrent checkouts for the same user
+    share a single create_customer call (SingleFlight, per process), and the id is
+    committed right away so a failed payment further on does not lose it.
+    """
+
+    def __init__(self, asaas: AsaasService = asaas_service, capacity: int = CUSTOMER_CACHE_SIZE):
+        self.asaas = asaas
+        self.capacity = capacity
+        self._ids: "OrderedDict[int, str]" = OrderedDict()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def get(self, user_id: int) -> Optional[str]:
+        customer_id = self._ids.get(user_id)
+        if customer_id is not None:
+            self._ids.move_to_end(user_id)
+        return customer_id
+
+    def put(self, user_id: int, customer_id: str):
+        self._ids[user_id] = customer_id
+        self._ids.move_to_end(user_id)
+        while len(self._ids) > self.capacity:
+            self._ids.popitem(last=False)
+
+    def clear(self):
+        self._ids.clear()
+
+    async def customer_id(self, db: AsyncSession, user: models.User) -> str:
+        customer_id = self.get(user.id)
+        if customer_id is not None:
+            self.hits += 1
+            return customer_id
+        self.misses += 1
+
+        customer_id = user.asaas_customer_id
+        if customer_id is None:
+            if not user.cpf_cnpj:
+                raise MissingCustomerData(f"User {user.id} has no CPF/CNPJ")
+            customer_id = await self._flight.do(user.id, self._create, user)
+            # Every coalesced caller writes the same id, only the first one matches
+            await db.execute(
+                update(models.User)
+                .where(models.User.id == user.id, models.User.asaas_customer_id.is_(None))
+                .values(asaas_customer_id=customer_id)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            set_committed_value(user, "asaas_customer_id", customer_id)
+        self.put(user.id, customer_id)
+        return customer_id
+
+    async def _create(self, user: models.User) -> str:
+        customer = await self.asaas.create_customer(user.full_name, user.cpf_cnpj, user.email, user.phone_number)
+        self.created += 1
+        logger.info(f"Created Asaas customer {customer['id']} for user {user.id}")
+        # Cached before the flight ends: a checkout starting between the end of the
+        # flight and the UPDATE finds it here instead of creating a second customer
+        self.put(user.id, customer["id"])
+        return customer["id"]
+
+    def stats(self) -> Dict:
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses, "created": self.created}
+
+
+customer_cache = CustomerCache()
+metrics.register("asaas_customers", customer_cache.stats)
@@ -1,16 +1,18 @@
-
 import os
-import shutil
 from fastapi import UploadFile, HTTPException
 import uuid
 
+from upload import StoredUpload, stream_upload
+
 UPLOAD_DIR = "uploads"
 ALLOWED_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png"}
+# What the content has to sniff as, a renamed .exe is not a PDF
+ALLOWED_TYPES = {"application/pdf", "image/jpeg", "image/png"}
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-async def save_order_document(file: UploadFile, order_id: int) -> str:
+async def save_order_document(file: UploadFile, order_id: int) -> StoredUpload:
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="File type not allowed")
@@ -22,10 +24,4 @@ async def save_order_document(file: UploadFile, order_id: int) -> str:
     filename = f"{uuid.uuid4()}{ext}"
     file_path = os.path.join(order_dir, filename)
     
-    try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    finally:
-        file.file.close()
-        
-    return file_path
+    return await stream_upload(file, file_path, allowed_types=ALLOWED_TYPES)
@@ -0,0 +1,122 @@
+import asyncio
+import codecs
+import csv
+import datetime
+import itertools
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from order_index import open_orders_index
+
+# Rows per INSERT batch / transaction, and per import request
+IMPORT_CHUNK_SIZE = int(os.getenv("ORDER_IMPORT_CHUNK_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("ORDER_IMPORT_MAX_ROWS", "10000"))
+
+
+def csv_rows(binary_file) -> Iterator[Tuple[int, Dict]]:
+    """(line number, row) from a CSV upload with a header line, decoded as it is read."""
+    reader = csv.DictReader(codecs.iterdecode(binary_file, "utf-8-sig"))
+    for row in reader:
+        # Blank cells are missing values, so optional fields validate as None
+        yield reader.line_num, {key: value.strip() or None for key, value in row.items() if key and value is not None}
+
+
+def json_rows(items: List) -> Iterator[Tuple[int, Dict]]:
+    for number, item in enumerate(items, start=1):
+        yield number, item
+
+
+def validation_errors(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()]
+
+
+async def next_chunk(rows: Iterator, size: int) -> List:
+    # Reading an upload touches its spooled temp file: keep that off the event loop
+    return await asyncio.to_thread(lambda: list(itertools.islice(rows, size)))
+
+
+async def import_orders(db: AsyncSession, rows: Iterable[Tuple[int, Dict]], order_model, default_owner_id: Optional[int] = None) -> Dict:
+    """
+    Validates rows as they stream in and inserts the valid ones IMPORT_CHUNK_SIZE at a
+    time, one transaction per chunk: a bad chunk never undoes the chunks before it.
+    order_model is the pydantic model of a single POST /orders/ body.
+    """
+    report = []
+    created = 0
+    truncated = False
+    rows = iter(rows)
+    seen = 0
+
+    while True:
+        chunk = await next_chunk(rows, min(IMPORT_CHUNK_SIZE, IMPORT_MAX_ROWS - seen + 1))
+        if not chunk:
+            break
+        if seen + len(chunk) > IMPORT_MAX_ROWS:
+            chunk = chunk[:IMPORT_MAX_ROWS - seen]
+            truncated = True
+        seen += len(chunk)
+
+        valid = []
+        for number, raw in chunk:
+            if not isinstance(raw, dict):
+                report.append({"row": number, "status": "invalid", "errors": ["row: must be an object"]})
+                continue
+            if default_owner_id is not None and raw.get("owner_id") is None:
+                raw = {**raw, "owner_id": default_owner_id}
+            try:
+                valid.append((number, order_model.model_validate(raw)))
+            except ValidationError as e:
+                report.append({"row": number, "status": "invalid", "errors": validation_errors(e)})
+
+        # One lookup per chunk for every owner referenced in it
+        owner_ids = {order.owner_id for _, order in valid}
+        known = set()
+        if owner_ids:
+            result = await db.execute(select(models.User.id).filter(models.User.id.in_(owner_ids)))
+            known = set(result.scalars())
+
+        values, numbers = [], []
+        now = datetime.datetime.utcnow()
+        for number, order in valid:
+            if order.owner_id not in known:
+                report.append({"row": number, "status": "invalid", "errors": [f"owner_id: user {order.owner_id} not found"]})
+                continue
+            values.append({**order.model_dump(), "status": "OPEN", "created_at": now})
+            numbers.append(number)
+
+        if values:
+            try:
+                # executemany: a single multi-row INSERT where the driver allows
+                # (asyncpg), ids returned in row order either way
+                result = await db.execute(
+                    insert(models.Order).returning(models.Order.id, sort_by_parameter_order=True), values
+                )
+                ids = result.scalars().all()
+                await db.commit()
+            except SQLAlchemyError as e:
+                await db.rollback()
+                report += [{"row": number, "status": "failed", "errors": [f"chunk not inserted: {e.__class__.__name__}"]} for number in numbers]
+            else:
+                created += len(ids)
+                for number, id, row in zip(numbers, ids, values):
+                    report.append({"row": number, "status": "created", "id": id})
+                    open_orders_index.track(models.Order(id=id, **row))
+
+        if truncated:
+            break
+
+    report.sort(key=lambda entry: entry["row"])
+    return {
+        "total": seen,
+        "created": created,
+        "invalid": sum(entry["status"] == "invalid" for entry in report),
+        "failed": sum(entry["status"] == "failed" for entry in report),
+        "truncated": truncated,
+        "rows": report,
+    }
@@ -0,0 +1,67 @@
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+# Both support INSERT ... ON CONFLICT DO UPDATE
+UPSERTS = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+RATING_COLUMNS = ["rating_1", "rating_2", "rating_3", "rating_4", "rating_5"]
+
+
+def rating_scopes(state: Optional[str], city: Optional[str]):
+    """(state, city) keys of the aggregate rows a review in this place counts towards."""
+    scopes = [("", "")]
+    if state:
+        scopes.append((state, ""))
+        if city:
+            scopes.append((state, city))
+    return scopes
+
+
+async def record_review(db: AsyncSession, dispatcher_id: int, rating: int, state: Optional[str], city: Optional[str]):
+    """
+    Adds one review to the dispatcher's aggregates, in the caller's transaction.
+    A single upsert for all scopes: increments happen in the database, so
+    concurrent reviews of the same dispatcher never lose an update.
+    """
+    rating_model = models.DispatcherRating
+    rows = [
+        {
+            "dispatcher_id": dispatcher_id, "state": scope_state, "city": scope_city,
+            "review_count": 1, "rating_sum": rating, "average": float(rating),
+            **{column: int(column == f"rating_{rating}") for column in RATING_COLUMNS},
+        }
+        for scope_state, scope_city in rating_scopes(state, city)
+    ]
+    insert = UPSERTS[db.get_bind().dialect.name]
+    statement = insert(rating_model).values(rows)
+    new = statement.excluded
+    # SET expressions see the row as it was before this update
+    statement = statement.on_conflict_do_update(
+        index_elements=["dispatcher_id", "state", "city"],
+        set_={
+            "review_count": rating_model.review_count + new.review_count,
+            "rating_sum": rating_model.rating_sum + new.rating_sum,
+            "average": (rating_model.rating_sum + new.rating_sum) * 1.0 / (rating_model.review_count + new.review_count),
+            **{column: getattr(rating_model, column) + getattr(new, column) for column in RATING_COLUMNS},
+        },
+    )
+    await db.execute(statement)
+
+
+def leaderboard_query(state: Optional[str] = None, city: Optional[str] = None, min_reviews: int = 1, limit: int = 20):
+    # Reads the scope's aggregate rows straight off ix_dispatcher_ratings_leaderboard
+    rating_model = models.DispatcherRating
+    return (
+        select(rating_model, models.User.full_name)
+        .join(models.User, models.User.id == rating_model.dispatcher_id)
+        .filter(rating_model.state == (state or ""), rating_model.city == (city or ""))
+        .filter(rating_model.review_count >= min_reviews)
+        .order_by(rating_model.average.desc(), rating_model.review_count.desc(), rating_model.dispatcher_id.desc())
+        .limit(limit)
+    )
@@ -0,0 +1,209 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+from typing import Dict, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import joinedload
+
+import metrics
+import models
+from order_index import open_orders_index
+from services.ratings import UPSERTS
+
+logger = logging.getLogger("Webhooks")
+
+# Events applied per transaction, and how often the worker looks for events nobody woke it for
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+
+PAID_EVENTS = {"PAYMENT_CONFIRMED", "PAYMENT_RECEIVED"}
+# Charges that can no longer be paid. Once out of PENDING they stop being the proposal's
+# open charge (uq_payments_pending_proposal_id), so the next checkout creates a new one
+CLOSED_EVENTS = {"PAYMENT_OVERDUE": "OVERDUE", "PAYMENT_DELETED": "DELETED"}
+REFUNDED_EVENTS = {"PAYMENT_REFUNDED"}
+APPLIED_EVENTS = PAID_EVENTS | set(CLOSED_EVENTS) | REFUNDED_EVENTS
+
+
+def event_key(data: Dict) -> str:
+    # Asaas sends an event id (evt_...); payloads without one dedupe on event + payment
+    if data.get("id"):
+        return str(data["id"])
+    payment = data.get("payment") or {}
+    return f"{data.get('event')}:{payment.get('id')}"
+
+
+async def record_event(db: AsyncSession, data: Dict) -> bool:
+    """Stores one delivery as received. False if that event was already recorded."""
+    payment = data.get("payment") or {}
+    insert = UPSERTS[db.get_bind().dialect.name]
+    statement = insert(models.WebhookEvent).values(
+        event_id=event_key(data),
+        event=data.get("event"),
+        asaas_payment_id=payment.get("id"),
+        payload=json.dumps(data),
+        received_at=datetime.datetime.utcnow(),
+    ).on_conflict_do_nothing(index_elements=["event_id"])
+    result = await db.execute(statement)
+    await db.commit()
+    return result.rowcount == 1
+
+
+def pending_events_query(limit: int):
+    # Oldest first, off the partial ix_webhook_events_pending (processed rows are not in it)
+    event = models.WebhookEvent
+    return select(event).filter(event.processed_at.is_(None)).order_by(event.id).limit(limit)
+
+
+def event_payments_query(asaas_payment_ids: Iterable[str]):
+    # Every payment a batch touches, with its proposal and order, in one SELECT
+    return select(models.Payment).options(
+        joinedload(models.Payment.proposal).joinedload(models.Proposal.order),
+    ).filter(models.Payment.asaas_payment_id.in_(asaas_payment_ids))
+
+
+class WebhookWorker:
+    """
+    Applies recorded webhook events in the background, WEBHOOK_BATCH_SIZE per
+    transaction: one SELECT for the batch's payments, the payment/proposal/order
+    updates, the events marked processed, one commit. A burst of PIX confirmations
+    costs a few transactions instead of one per delivery.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker = None, batch_size: int = WEBHOOK_BATCH_SIZE,
+                 poll_interval: float = WEBHOOK_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._task = None
+        self.batches = 0
+        self.processed = 0
+        self.failed = 0
+        self.batch_latency = metrics.LatencyStats()
+
+    def start(self):
+        if self.session_factory is None:
+            from database import AsyncSessionLocal
+            self.session_factory = AsyncSessionLocal
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Called after an event is recorded, so it is applied without waiting for the poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("Webhook drain failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain(self) -> int:
+        """Applies pending events until none are left, returns how many."""
+        total = 0
+        async with self.session_factory() as db:
+            while True:
+                events = (await db.execute(pending_events_query(self.batch_size))).scalars().all()
+                if not events:
+                    return total
+                await self._process(db, events)
+                total += len(events)
+
+    async def _process(self, db: AsyncSession, events: List[models.WebhookEvent]):
+        event_ids = [event.id for event in events]
+        with self.batch_latency.time():
+            try:
+                orders = await self._apply(db, events)
+                await db.commit()
+            except Exception as e:
+                # Not only DB errors: a payment without its proposal/order, or a bad payload,
+                # must get parked too rather than block every later event
+                await db.rollback()
+                if len(event_ids) == 1:
+                    # Poison event: park it with the error instead of retrying it forever
+                    logger.error(f"Webhook event {event_ids[0]} failed: {e!r}")
+                    event = await db.get(models.WebhookEvent, event_ids[0])
+                    event.processed_at = datetime.datetime.utcnow()
+                    event.error = f"{e.__class__.__name__}: {e}"[:500]
+                    await db.commit()
+                    self.failed += 1
+                    return
+                # Find the bad one: retry the batch one event per transaction
+                for event_id in event_ids:
+                    await self._process(db, [await db.get(models.WebhookEvent, event_id)])
+                return
+        self.batches += 1
+        self.processed += len(events)
+        for order in orders:
+            open_orders_index.track(order)
+
+    async def _apply(self, db: AsyncSession, events: List[models.WebhookEvent]) -> List[models.Order]:
+        now = datetime.datetime.utcnow()
+        payment_ids = {event.asaas_payment_id for event in events if event.event in APPLIED_EVENTS and event.asaas_payment_id}
+        payments = {}
+        if payment_ids:
+            result = await db.execute(event_payments_query(payment_ids))
+            payments = {payment.asaas_payment_id: payment for payment in result.scalars().unique()}
+
+        orders = {}
+        for event in events:
+            event.processed_at = now
+            if event.event not in APPLIED_EVENTS:
+                continue
+            payment = payments.get(event.asaas_payment_id)
+            if payment is None:
+                event.error = "unknown payment"
+                continue
+            order = payment.proposal.order
+            if event.event in CLOSED_EVENTS:
+                # A late OVERDUE/DELETED never undoes a payment
+                if payment.status == "PENDING":
+                    payment.status = CLOSED_EVENTS[event.event]
+                continue
+            if event.event in REFUNDED_EVENTS:
+                if payment.status == "PAID":
+                    payment.status = "REFUNDED"
+                    order.status = "CANCELLED"
+                    orders[order.id] = order
+                continue
+            # PIX sends CONFIRMED and RECEIVED for the same payment, apply it once
+            if payment.status == "PAID":
+                continue
+            payment.status = "PAID"
+            payment.proposal.is_accepted = True
+            order.status = "PAID"  # or IN_PROGRESS
+            orders[order.id] = order
+        return list(orders.values())
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "batches": self.batches,
+            "processed": self.processed,
+            "failed": self.failed,
+            "batch": self.batch_latency.as_dict(),
+        }
+
+
+webhook_worker = WebhookWorker()
+metrics.register("webhooks", webhook_worker.stats)
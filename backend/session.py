@@ -1,5 +1,5 @@
 import uuid
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import time
 
 class SessionManager:
@@ -33,7 +33,8 @@ class SessionManager:
             del self._sessions[session_id]
             del self._last_access[session_id]
 
-    def cleanup_old_sessions(self):
+    def cleanup_old_sessions(self) -> List[str]:
+        """Removes expired sessions and returns their ids so callers can free related resources."""
         now = time.time()
         to_remove = [
             sid for sid, last_time in self._last_access.items()
@@ -41,5 +42,6 @@ class SessionManager:
         ]
         for sid in to_remove:
             self.clear_session(sid)
+        return to_remove
 
 session_manager = SessionManager()
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import run_migrations, tune_engine
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # Same schema (and indexes) as production: built by the alembic migrations
+    path = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    run_migrations(engine)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def session_factory(db_path):
+    # NullPool: every session opens its connection on the loop that uses it.
+    # Same pragmas (WAL, busy_timeout...) as the app engine.
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    tune_engine(engine.sync_engine)
+    return async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def app(session_factory):
+    from fastapi import FastAPI
+    from database import get_db
+    from routers import orders, proposals, payments, chat, documents, reviews
+
+    app = FastAPI()
+    for module in (orders, proposals, payments, chat, documents, reviews):
+        app.include_router(module.router)
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    # Module-level index, reloaded lazily from this test's database
+    from order_index import open_orders_index
+    open_orders_index.clear()
+    # User ids repeat across test databases
+    from services.customers import customer_cache
+    customer_cache.clear()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+    return TestClient(app)
+
+
+@pytest.fixture
+def seed(session_factory):
+    """Inserts rows (ORM objects) and returns them with ids populated."""
+    import asyncio
+
+    def insert(*objects):
+        async def run():
+            async with session_factory() as db:
+                db.add_all(objects)
+                await db.commit()
+        asyncio.run(run())
+        return objects
+
+    return insert
+
+
+class QueryCounter:
+    """SQL statements sent by the app, reset it with `with queries: ...`."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def queries(session_factory):
+    counter = QueryCounter()
+    engine = session_factory.kw["bind"].sync_engine
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
@@ -0,0 +1,138 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+import models
+from services.asaas import AsaasService
+from services.asaas_stub import create_stub_app
+from services.customers import CustomerCache, MissingCustomerData
+
+
+def stub_service(stub, max_retries=3):
+    service = AsaasService(base_url="http://asaas-stub", api_key="test-key", transport=httpx.ASGITransport(app=stub))
+    service.max_retries = max_retries
+    service.retry_backoff = 0
+    return service
+
+
+def create_payment(service):
+    return service.create_payment(customer_id="cus_000000000001", billing_type="PIX", value=150.0,
+                                  due_date="2026-01-10", description="Emplacamento")
+
+
+def test_pooled_client_is_reused_until_closed():
+    async def scenario():
+        service = stub_service(create_stub_app())
+        await service.start()
+        client = service.client
+        customer = await service.create_customer("Cliente", "c@x.com", "12345678909")
+        payment = await create_payment(service)
+        assert service.client is client
+        await service.close()
+        assert service._client is None
+        return customer, payment
+
+    customer, payment = asyncio.run(scenario())
+    assert customer["id"].startswith("cus_")
+    assert payment["status"] == "PENDING" and payment["invoiceUrl"]
+
+
+def test_retries_unprocessed_requests_with_backoff():
+    stub = create_stub_app()
+    stub.state.fail_next = [429, 503, 429]
+    service = stub_service(stub)
+
+    payment = asyncio.run(create_payment(service))
+    assert payment["id"].startswith("pay_")
+    assert stub.state.calls["POST /payments"] == 4
+    assert service.retries == 3
+    stats = service.stats()["calls"]["POST /payments"]
+    assert stats["count"] == 4
+
+
+def test_post_is_not_resent_after_a_5xx_that_may_have_committed():
+    stub = create_stub_app()
+    stub.state.fail_next = [502]
+    service = stub_service(stub)
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(create_payment(service))
+    assert error.value.response.status_code == 502
+    assert stub.state.calls["POST /payments"] == 1 and service.retries == 0
+
+
+def test_get_is_retried_on_5xx():
+    stub = create_stub_app()
+    service = stub_service(stub)
+
+    async def scenario():
+        payment = await create_payment(service)
+        stub.state.fail_next = [500, 502, 504]
+        return payment, (await service.request("GET", f"/payments/{payment['id']}")).json()
+
+    created, fetched = asyncio.run(scenario())
+    assert fetched["id"] == created["id"]
+    assert service.retries == 3
+
+
+def test_gives_up_after_max_retries():
+    stub = create_stub_app()
+    stub.state.fail_next = [503] * 5
+    service = stub_service(stub, max_retries=2)
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(create_payment(service))
+    assert error.value.response.status_code == 503
+    assert stub.state.calls["POST /payments"] == 3
+
+
+def test_client_errors_are_not_retried():
+    stub = create_stub_app()
+    service = stub_service(stub)
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(service.create_payment(customer_id="nobody", billing_type="PIX", value=1.0,
+                                           due_date="2026-01-10", description="x"))
+    assert error.value.response.status_code == 400
+    assert stub.state.calls["POST /payments"] == 1 and service.retries == 0
+
+
+def test_backoff_grows_and_honours_retry_after():
+    service = AsaasService(base_url="http://asaas-stub")
+    service.retry_backoff = 0.5
+    delays = [service.retry_delay(attempt) for attempt in range(4)]
+    assert all(0.25 * 2 ** attempt <= delay <= 0.5 * 2 ** attempt for attempt, delay in enumerate(delays))
+    response = httpx.Response(429, headers={"Retry-After": "2"})
+    assert service.retry_delay(0, response) == 2
+
+
+def test_customer_created_once_under_parallel_checkouts(session_factory, seed):
+    client_user, no_document = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT", cpf_cnpj="12345678909"),
+        models.User(full_name="Sem CPF", email="s@x.com", user_type="CLIENT"),
+    )
+    stub = create_stub_app(latency_ms=20)
+    cache = CustomerCache(stub_service(stub), capacity=2)
+
+    async def checkout(user_id):
+        # One session per request, like get_db
+        async with session_factory() as db:
+            user = await db.get(models.User, user_id)
+            return await cache.customer_id(db, user)
+
+    async def scenario():
+        first = await asyncio.gather(*(checkout(client_user.id) for _ in range(10)))
+        cache.clear()
+        again = await checkout(client_user.id)  # from the users table, no remote call
+        async with session_factory() as db:
+            stored = (await db.execute(select(models.User.asaas_customer_id).filter(models.User.id == client_user.id))).scalar()
+        with pytest.raises(MissingCustomerData):
+            await checkout(no_document.id)
+        return first, again, stored
+
+    first, again, stored = asyncio.run(scenario())
+    assert len(set(first)) == 1 and first[0] == again == stored
+    assert stub.state.calls["POST /customers"] == 1
+    assert cache.stats()["created"] == 1
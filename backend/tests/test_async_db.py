@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import httpx
+
+import models
+from database import engine_options, get_db, pool_stats, to_async_url, tune_engine
+from metrics import LatencyStats
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+def test_async_url_mapping():
+    assert to_async_url("sqlite:///./descomplaca.db") == "sqlite+aiosqlite:///./descomplaca.db"
+    assert to_async_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert to_async_url("postgres://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+
+def test_engine_profiles():
+    pg = engine_options("postgresql+asyncpg://u:p@db/app", LatencyStats(), is_async=True)
+    assert pg["pool_pre_ping"] is True
+    assert {"pool_size", "max_overflow", "pool_recycle", "pool_timeout"} <= set(pg)
+    assert "poolclass" in engine_options("sqlite:///./app.db", LatencyStats())
+    # In-memory SQLite keeps its single-connection pool
+    assert "poolclass" not in engine_options("sqlite:///:memory:", LatencyStats())
+
+
+def test_sqlite_engine_runs_in_wal_mode(db_path):
+    from sqlalchemy import create_engine
+
+    engine = tune_engine(create_engine(f"sqlite:///{db_path}", **engine_options(f"sqlite:///{db_path}", LatencyStats())))
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    engine.dispose()
+
+
+def test_marketplace_flow_on_async_session(client, seed, session_factory, monkeypatch):
+    from services.asaas import asaas_service
+    from services.webhooks import WebhookWorker
+
+    client_user, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT", cpf_cnpj="12345678909"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER"),
+    )
+
+    order = client.post("/orders/", json={
+        "vehicle_plate": "ABC1D23", "service_type": "transferencia",
+        "city": "Vila Velha", "state": "ES", "owner_id": client_user.id,
+    }).json()
+    assert [o["id"] for o in client.get("/orders/", params={"state": "ES"}).json()["data"]] == [order["id"]]
+
+    proposal = client.post("/proposals/", json={
+        "order_id": order["id"], "dispatcher_id": dispatcher.id, "fee_value": 100.0,
+        "tax_value": 50.0, "estimated_days": 3, "description": "Resolvo em 3 dias",
+    }).json()
+    assert client.get(f"/orders/{order['id']}").json()["status"] == "PROPOSAL_RECEIVED"
+
+    async def fake_create_customer(name, cpf_cnpj, email=None, phone=None):
+        return {"id": "cus_1"}
+
+    async def fake_create_payment(**kwargs):
+        assert kwargs["customer_id"] == "cus_1"
+        return {"id": "pay_1", "status": "PENDING", "value": kwargs["value"], "invoiceUrl": "https://pay/1"}
+    monkeypatch.setattr(asaas_service, "create_customer", fake_create_customer)
+    monkeypatch.setattr(asaas_service, "create_payment", fake_create_payment)
+
+    assert client.post(f"/payments/checkout/{proposal['id']}").json()["payment_url"] == "https://pay/1"
+    client.post("/payments/webhook/asaas", json={"event": "PAYMENT_RECEIVED", "payment": {"id": "pay_1"}})
+    asyncio.run(WebhookWorker(session_factory).drain())
+    assert client.get(f"/orders/{order['id']}").json()["status"] == "PAID"
+
+    client.post("/chat/", json={"order_id": order["id"], "content": "Olá", "is_from_dispatcher": True})
+    assert [m["content"] for m in client.get(f"/chat/{order['id']}").json()["data"]] == ["Olá"]
+
+
+def test_concurrent_writes_do_not_stall_the_event_loop(app, seed, db_path):
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    checkout = LatencyStats()
+
+    async def scenario():
+        # The app's own engine profile: bounded pool + WAL/busy_timeout pragmas
+        url = f"sqlite+aiosqlite:///{db_path}"
+        options = engine_options(url, checkout, is_async=True)
+        engine = create_async_engine(url, **options)
+        tune_engine(engine.sync_engine)
+        sessions = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+        async def pooled_get_db():
+            async with sessions() as db:
+                yield db
+        app.dependency_overrides[get_db] = pooled_get_db
+
+        lags = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            # Stands in for the bot/scraper coroutines sharing the loop
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - start - 0.005)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            # Warm up (route/schema setup on the first request is not what we measure)
+            await http.get("/orders/")
+            tick = asyncio.create_task(ticker())
+            responses = await asyncio.gather(*(
+                http.post("/orders/", json={
+                    "vehicle_plate": f"PLK{i:04d}", "service_type": "emplacamento",
+                    "city": "Vitória", "state": "ES", "owner_id": owner.id,
+                })
+                for i in range(100)
+            ))
+        stop.set()
+        await tick
+        stats = pool_stats(engine, checkout, options["max_overflow"])
+        await engine.dispose()
+        return responses, lags, stats
+
+    responses, lags, stats = asyncio.run(scenario())
+    assert all(r.status_code == 200 for r in responses)
+    # Requests queued for a pooled connection instead of piling up writers
+    assert stats["checkout_wait"]["count"] >= 101
+    assert stats["checked_out"] == 0
+    assert (stats["size"], stats["max_overflow"]) == (5, 10)
+    # Every commit happens off the loop, the ticker keeps running throughout
+    # (a blocking session stalls it for the whole batch, seconds; the first tick
+    # also pays for fanning out 100 requests, so it gets a looser bound)
+    assert len(lags) > 10
+    lags.sort()
+    assert lags[int(len(lags) * 0.95)] < 0.1
+    assert lags[-1] < 0.5
+
+
+def test_upgrades_a_database_from_the_create_all_startup(tmp_path, monkeypatch):
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import create_engine, inspect
+    from sqlalchemy.pool import NullPool
+    import pipeline
+    from database import MIGRATIONS_CONFIG, run_migrations
+
+    # Baseline shape: the original tables, no alembic_version, no pipeline_items
+    path = tmp_path / "legacy.db"
+    engine = create_engine(f"sqlite:///{path}")
+    config = Config(MIGRATIONS_CONFIG)
+    config.attributes["configure_logger"] = False
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "0001")
+        connection.exec_driver_sql("DROP TABLE alembic_version")
+    assert "pipeline_items" not in inspect(engine).get_table_names()
+
+    run_migrations(engine)
+    assert "pipeline_items" in inspect(engine).get_table_names()
+    engine.dispose()
+
+    # What startup does next
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(pipeline, "AsyncSessionLocal", async_sessionmaker(async_engine, expire_on_commit=False))
+    asyncio.run(pipeline.load_cache())
+    assert pipeline.pipeline_cache["data"] == []
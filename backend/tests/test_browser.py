@@ -0,0 +1,219 @@
+import asyncio
+import pytest
+from browser import BrowserPool, profile_for_url
+
+
+def test_profiles_are_picked_by_most_specific_host():
+    assert profile_for_url("https://placaswebmercosul.com.br/PedidoAutorizacao/1").name == "placas"
+    assert profile_for_url("https://sso.acesso.gov.br/").name == "govbr"
+    assert profile_for_url("https://fibromialgia.vilavelha.es.gov.br/").name == "vilavelha"
+    assert profile_for_url("https://cdn.example.com/lib.js").name == "default"
+
+
+def test_govbr_keeps_what_the_qr_step_needs():
+    govbr = profile_for_url("https://sso.acesso.gov.br/")
+    assert not govbr.should_block("image", "https://sso.acesso.gov.br/qrcode.png")
+    assert not govbr.should_block("stylesheet", "https://sso.acesso.gov.br/app.css")
+    assert govbr.should_block("font", "https://sso.acesso.gov.br/font.woff2")
+    assert govbr.should_block("script", "https://www.googletagmanager.com/gtm.js")
+
+
+def test_placas_blocks_heavy_resources_but_not_documents():
+    placas = profile_for_url("https://placaswebmercosul.com.br/")
+    for resource_type in ("image", "font", "media", "stylesheet"):
+        assert placas.should_block(resource_type, "https://placaswebmercosul.com.br/x")
+    assert not placas.should_block("document", "https://placaswebmercosul.com.br/PedidoAutorizacao/Index")
+    assert not placas.should_block("xhr", "https://placaswebmercosul.com.br/PedidoAutorizacao/Listar")
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+        self.cookies = []
+        self.closed = False
+
+    async def route(self, pattern, handler):
+        pass
+
+    async def add_cookies(self, cookies):
+        self.cookies.extend(cookies)
+
+    async def clear_cookies(self):
+        self.cookies = []
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.contexts = []
+
+    def is_connected(self):
+        return True
+
+    async def new_context(self, **kwargs):
+        context = FakeContext()
+        self.contexts.append(context)
+        return context
+
+
+def make_pool(**kwargs):
+    pool = BrowserPool(**kwargs)
+    pool.playwright = object()
+    pool.browser = FakeBrowser()
+    return pool
+
+
+def test_pool_leases_isolated_contexts_up_to_max_size():
+    async def scenario():
+        pool = make_pool(max_size=2, warm_size=1)
+        await pool.start()
+        assert pool.stats()["idle"] == 1
+
+        a = await pool.acquire(cookies=[{"name": "session", "value": "1"}])
+        b = await pool.acquire()
+        assert a is not b
+        assert pool.stats()["in_use"] == 2
+
+        # Pool is full, a third caller waits
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire(timeout=0.05)
+
+        await pool.release(a)
+        c = await pool.acquire(timeout=0.05)
+        # A fresh context, the previous caller's storage went away with the old one
+        assert a.closed and c is not a
+        assert c.cookies == []
+
+    asyncio.run(scenario())
+
+
+def test_pool_replaces_released_contexts_and_times_out_when_full():
+    async def scenario():
+        pool = make_pool(max_size=1, warm_size=1, acquire_timeout=0.05)
+        await pool.start()
+
+        async with pool.lease() as first:
+            # Nobody waits forever behind a stuck lease
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.acquire()
+        # Closed on release and replaced by a warm one
+        assert first.closed
+        assert pool.stats() == {"max_size": 1, "open": 1, "idle": 1, "in_use": 0, "sessions": 0}
+
+        with pytest.raises(RuntimeError):
+            async with pool.lease() as broken:
+                raise RuntimeError("page crashed")
+        assert broken.closed and pool.stats()["in_use"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_logins_leave_contexts_for_the_scraper():
+    async def scenario():
+        pool = make_pool(max_size=3, warm_size=0, acquire_timeout=0.05)
+        assert pool.max_sessions == 2
+        logins = [await pool.acquire(session=True) for _ in range(2)]
+        # A third login waits, a scraper lease still gets the reserved context
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire(session=True)
+        async with pool.lease() as scraping:
+            assert scraping not in logins
+        assert pool.stats()["sessions"] == 2
+
+        await pool.release(logins[0])
+        await pool.release(await pool.acquire(session=True))
+        assert pool.stats()["sessions"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_govbr_login_is_resumed_by_secret_token_not_cpf(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+    from bot import bot_instance
+    from session import session_manager
+
+    saved, resumed = {}, []
+
+    async def fake_resume(account, session_id=None):
+        resumed.append(account)
+        return account in saved
+
+    async def fake_save(account, session_id=None):
+        saved[account] = session_id
+
+    async def fake_navigate(session_id=None):
+        return True
+
+    async def fake_release(session_id=None):
+        pass
+
+    async def fake_fill(data, session_id=None):
+        return True
+
+    logged_in = []
+
+    async def fake_check_login(session_id=None):
+        return bool(logged_in)
+
+    monkeypatch.setattr(bot_instance, "resume_login", fake_resume)
+    monkeypatch.setattr(bot_instance, "save_login_state", fake_save)
+    monkeypatch.setattr(bot_instance, "navigate_to_gov_br", fake_navigate)
+    monkeypatch.setattr(bot_instance, "release", fake_release)
+    monkeypatch.setattr(bot_instance, "fill_vila_velha_form", fake_fill)
+    monkeypatch.setattr(bot_instance, "check_login_success", fake_check_login)
+    client = TestClient(api.app)
+
+    # Made up session ids lease no browser context, and the id is required
+    assert client.post("/login/govbr/start").status_code == 422
+    assert client.post("/login/govbr/start", params={"session_id": "made-up"}).status_code == 404
+
+    # A CPF in the query string restores nothing
+    session_id = session_manager.create_session()
+    response = client.post("/login/govbr/start", params={"session_id": session_id, "cpf": "123.456.789-00"})
+    assert response.json()["status"] == "navigated" and resumed == []
+
+    # QR never scanned, nothing saved
+    assert client.post(f"/process/start/{session_id}").json()["resume_token"] is None
+    assert saved == {}
+
+    logged_in.append(True)
+    session_id = session_manager.create_session()
+    token = client.post(f"/process/start/{session_id}").json()["resume_token"]
+    assert token and list(saved) == [token]
+
+    # A resumed login is saved again (fresh tokens) under the same resume token
+    logged_in.clear()
+    session_id = session_manager.create_session()
+    response = client.post("/login/govbr/start", params={"session_id": session_id}, headers={"X-Resume-Token": token})
+    assert response.json()["status"] == "resumed"
+    assert client.post(f"/process/start/{session_id}").json()["resume_token"] == token
+    assert saved == {token: session_id}
+
+
+def test_govbr_qr_code_is_served_as_a_screenshot(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+    from bot import bot_instance
+    from session import session_manager
+
+    class QrPage:
+        async def query_selector(self, selector):
+            return self
+
+        async def screenshot(self, type=None):
+            return b"\x89PNG\r\n\x1a\nqr"
+
+    session_id = session_manager.create_session()
+    monkeypatch.setitem(bot_instance.sessions, session_id, (FakeContext(), QrPage()))
+    client = TestClient(api.app)
+
+    response = client.get(f"/login/govbr/qr/{session_id}")
+    assert response.status_code == 200 and response.headers["content-type"] == "image/png"
+    assert response.content.startswith(b"\x89PNG") and response.headers["cache-control"] == "no-store"
+
+    # Session without a login page yet, and made up sessions
+    assert client.get(f"/login/govbr/qr/{session_manager.create_session()}").status_code == 404
+    assert client.get("/login/govbr/qr/made-up").status_code == 404
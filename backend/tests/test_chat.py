@@ -0,0 +1,95 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import models
+
+
+@pytest.fixture
+def order(seed):
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    (order,) = seed(models.Order(vehicle_plate="ABC1D23", service_type="transferencia", city="Vila Velha",
+                                 state="ES", owner_id=owner.id, status="OPEN"))
+    return order
+
+
+def send(client, order, content, from_dispatcher=False):
+    return client.post("/chat/", json={"order_id": order.id, "content": content, "is_from_dispatcher": from_dispatcher}).json()
+
+
+def test_sent_messages_reach_both_sockets(app, order):
+    # One portal (event loop) for HTTP and WebSocket, like a single uvicorn worker
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/{order.id}/ws") as owner_ws, \
+                client.websocket_connect(f"/chat/{order.id}/ws") as dispatcher_ws:
+            sent = send(client, order, "Olá, já comecei", from_dispatcher=True)
+            for ws in (owner_ws, dispatcher_ws):
+                event = ws.receive_json()
+                assert event["type"] == "message"
+                assert (event["message"]["id"], event["message"]["content"]) == (sent["id"], "Olá, já comecei")
+
+
+def test_reconnect_resumes_after_last_seen_id(app, order):
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/{order.id}/ws") as ws:
+            first = send(client, order, "1")
+            assert ws.receive_json()["message"]["id"] == first["id"]
+
+        # Offline: these are only in the database
+        missed = [send(client, order, str(i)) for i in (2, 3)]
+
+        with client.websocket_connect(f"/chat/{order.id}/ws?last_id={first['id']}") as ws:
+            replayed = [ws.receive_json()["message"]["id"] for _ in missed]
+            live = send(client, order, "4")
+            assert replayed + [ws.receive_json()["message"]["id"]] == [m["id"] for m in missed] + [live["id"]]
+
+
+def test_unknown_order_is_refused(app):
+    with TestClient(app) as client:
+        with pytest.raises(WebSocketDisconnect) as refused:
+            with client.websocket_connect("/chat/999/ws") as ws:
+                ws.receive_json()
+        assert refused.value.code == 1008
+
+
+def test_since_id_returns_only_newer_messages(client, order):
+    sent = [send(client, order, str(i)) for i in range(5)]
+
+    delta = client.get(f"/chat/{order.id}", params={"since_id": sent[1]["id"], "limit": 2}).json()
+    assert [m["content"] for m in delta["data"]] == ["2", "3"] and delta["has_more"]
+    delta = client.get(f"/chat/{order.id}", params={"since_id": delta["data"][-1]["id"], "limit": 2}).json()
+    assert [m["content"] for m in delta["data"]] == ["4"] and not delta["has_more"]
+
+    assert client.get(f"/chat/{order.id}", params={"since_id": 0, "cursor": "x"}).status_code == 400
+
+
+def test_batch_send_is_idempotent_per_client_key(client, order, seed):
+    outbox = [{"order_id": order.id, "content": f"offline {i}", "is_from_dispatcher": False, "client_key": f"outbox-{i}"}
+              for i in range(3)]
+    first = client.post("/chat/batch", json={"messages": outbox}).json()
+    assert first["created"] == 3
+
+    # Connection dropped before the client saw the response: it retries, plus one new entry
+    outbox.append({"order_id": order.id, "content": "offline 3", "is_from_dispatcher": False, "client_key": "outbox-3"})
+    retry = client.post("/chat/batch", json={"messages": outbox}).json()
+    assert retry["created"] == 1
+    assert [m["id"] for m in retry["data"][:3]] == [m["id"] for m in first["data"]]
+
+    # The same key on another order is another message
+    (other,) = seed(models.Order(vehicle_plate="XYZ9Z99", service_type="transferencia", city="Vitória",
+                                 state="ES", owner_id=order.owner_id, status="OPEN"))
+    single = client.post("/chat/", json={"order_id": other.id, "content": "oi", "is_from_dispatcher": True,
+                                         "client_key": "outbox-0"}).json()
+    assert single["order_id"] == other.id
+
+    history = client.get(f"/chat/{order.id}").json()["data"]
+    assert [m["content"] for m in history] == [f"offline {i}" for i in range(4)]
+
+
+def test_batch_rejects_unknown_orders_atomically(client, order):
+    response = client.post("/chat/batch", json={"messages": [
+        {"order_id": order.id, "content": "ok", "is_from_dispatcher": False},
+        {"order_id": 999, "content": "lost", "is_from_dispatcher": False},
+    ]})
+    assert response.status_code == 404
+    assert client.get(f"/chat/{order.id}").json()["data"] == []
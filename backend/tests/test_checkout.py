@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import func, select
+
+import models
+
+
+@pytest.fixture
+def proposals(seed):
+    client_user, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT", asaas_customer_id="cus_1"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER", asaas_account_id="wal_1"),
+    )
+    orders = seed(*[models.Order(vehicle_plate=f"ABC1D2{i}", service_type="transferencia", city="Vila Velha", state="ES",
+                                 owner_id=client_user.id, status="PROPOSAL_RECEIVED") for i in range(2)])
+    return seed(*[models.Proposal(order_id=order.id, dispatcher_id=dispatcher.id, fee_value=100.0, tax_value=50.0,
+                                  total_value=150.0, estimated_days=3, description="Resolvo") for order in orders])
+
+
+@pytest.fixture
+def charges(monkeypatch):
+    """Asaas create_payment calls made, answered after a short delay like the real API."""
+    from services.asaas import asaas_service
+    made = []
+
+    async def fake_create_payment(**kwargs):
+        made.append(kwargs)
+        await asyncio.sleep(0.05)
+        return {"id": f"pay_{len(made)}", "status": "PENDING", "value": kwargs["value"],
+                "invoiceUrl": f"https://pay/{len(made)}", "bankSlipUrl": None}
+    monkeypatch.setattr(asaas_service, "create_payment", fake_create_payment)
+    return made
+
+
+def payment_count(session_factory):
+    async def run():
+        async with session_factory() as db:
+            return (await db.execute(select(func.count(models.Payment.id)))).scalar()
+    return asyncio.run(run())
+
+
+def test_repeat_checkout_reuses_the_open_charge(client, proposals, charges, session_factory, queries):
+    url = f"/payments/checkout/{proposals[0].id}"
+    first = client.post(url).json()
+    with queries:
+        again = client.post(url).json()
+
+    # Answered from the stored payment alone
+    assert queries.count == 1, "\n".join(queries.statements)
+    assert again == first == {"payment_url": "https://pay/1", "qr_code": None}
+    assert len(charges) == 1 and payment_count(session_factory) == 1
+
+
+def test_concurrent_checkouts_share_one_charge(app, proposals, charges, session_factory):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.post(f"/payments/checkout/{proposals[0].id}") for _ in range(8)))
+
+    responses = asyncio.run(scenario())
+    assert {r.status_code for r in responses} == {200}
+    assert {r.json()["payment_url"] for r in responses} == {"https://pay/1"}
+    assert len(charges) == 1 and payment_count(session_factory) == 1
+
+
+def test_idempotency_key(client, proposals, charges):
+    headers = {"Idempotency-Key": "click-1"}
+    first = client.post(f"/payments/checkout/{proposals[0].id}", headers=headers)
+    again = client.post(f"/payments/checkout/{proposals[0].id}", headers=headers)
+    assert first.json() == again.json() and len(charges) == 1
+
+    other = client.post(f"/payments/checkout/{proposals[1].id}", headers=headers)
+    assert other.status_code == 422 and len(charges) == 1
+
+
+def test_paid_proposal_is_not_charged_again(client, proposals, charges, session_factory):
+    client.post(f"/payments/checkout/{proposals[0].id}")
+    client.post("/payments/webhook/asaas", json={"event": "PAYMENT_RECEIVED", "payment": {"id": "pay_1"}})
+    from services.webhooks import WebhookWorker
+    asyncio.run(WebhookWorker(session_factory).drain())
+
+    assert client.post(f"/payments/checkout/{proposals[0].id}").status_code == 409
+    assert len(charges) == 1
+
+
+def test_overdue_charge_is_replaced_on_the_next_checkout(client, proposals, charges, session_factory):
+    from services.webhooks import WebhookWorker
+    url = f"/payments/checkout/{proposals[0].id}"
+    client.post(url)
+    client.post("/payments/webhook/asaas", json={"event": "PAYMENT_OVERDUE", "payment": {"id": "pay_1"}})
+    asyncio.run(WebhookWorker(session_factory).drain())
+
+    assert client.post(url).json()["payment_url"] == "https://pay/2"
+    assert len(charges) == 2 and payment_count(session_factory) == 2
+
+
+def test_charge_that_lost_the_race_is_deleted_at_asaas(client, proposals, session_factory, monkeypatch):
+    from services.asaas import asaas_service
+    deleted = []
+
+    async def fake_create_payment(**kwargs):
+        # Another worker process stores its charge for the proposal meanwhile
+        async with session_factory() as db:
+            db.add(models.Payment(asaas_payment_id="pay_other", status="PENDING", amount=150.0,
+                                  invoice_url="https://pay/other", proposal_id=proposals[0].id))
+            await db.commit()
+        return {"id": "pay_ours", "status": "PENDING", "value": kwargs["value"], "invoiceUrl": "https://pay/ours"}
+
+    async def fake_delete_payment(payment_id):
+        deleted.append(payment_id)
+        return {"deleted": True, "id": payment_id}
+
+    monkeypatch.setattr(asaas_service, "create_payment", fake_create_payment)
+    monkeypatch.setattr(asaas_service, "delete_payment", fake_delete_payment)
+
+    assert client.post(f"/payments/checkout/{proposals[0].id}").json()["payment_url"] == "https://pay/other"
+    assert deleted == ["pay_ours"] and payment_count(session_factory) == 1
+
+
+def test_first_checkout_takes_the_clients_cpf(client, seed, charges, session_factory, monkeypatch):
+    from services.asaas import asaas_service
+    client_user, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER"),
+    )
+    (order,) = seed(models.Order(vehicle_plate="ABC1D23", service_type="transferencia", city="Vila Velha", state="ES",
+                                 owner_id=client_user.id, status="PROPOSAL_RECEIVED"))
+    (proposal,) = seed(models.Proposal(order_id=order.id, dispatcher_id=dispatcher.id, fee_value=100.0, tax_value=50.0,
+                                       total_value=150.0, estimated_days=3, description="Resolvo"))
+    customers = []
+
+    async def fake_create_customer(name, cpf_cnpj, email=None, phone=None):
+        customers.append(cpf_cnpj)
+        return {"id": "cus_new"}
+    monkeypatch.setattr(asaas_service, "create_customer", fake_create_customer)
+
+    url = f"/payments/checkout/{proposal.id}"
+    assert client.post(url).status_code == 400
+    assert client.post(url, json={"cpf_cnpj": "123"}).status_code == 422
+    assert client.post(url, json={"cpf_cnpj": "123.456.789-09"}).status_code == 200
+    assert customers == ["12345678909"] and len(charges) == 1
+
+    async def stored():
+        async with session_factory() as db:
+            return await db.get(models.User, client_user.id)
+    user = asyncio.run(stored())
+    assert (user.cpf_cnpj, user.asaas_customer_id) == ("12345678909", "cus_new")
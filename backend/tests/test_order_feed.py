@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+
+import pytest
+
+import models
+from order_index import OpenOrderIndex
+from pubsub import Broker, SlowConsumer
+
+
+def make_order(id, state, city, minutes, status="OPEN"):
+    return models.Order(id=id, status=status, vehicle_plate=f"ABC{id:04d}", service_type="transferencia",
+                        state=state, city=city, created_at=datetime.datetime(2026, 1, 1) + datetime.timedelta(minutes=minutes))
+
+
+def test_index_pages_regions_newest_first():
+    broker = Broker()
+    index = OpenOrderIndex(broker)
+    for i in range(1, 31):
+        index.track(make_order(i, "ES" if i % 3 else "RJ", "Vitória" if i % 2 else "Vila Velha", minutes=i // 2))
+
+    seen, cursor = [], None
+    while True:
+        page = index.query(state="ES", cursor=cursor, limit=7)
+        seen += page["data"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    keys = [(o["created_at"], o["id"]) for o in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert {o["id"] for o in seen} == {i for i in range(1, 31) if i % 3}
+
+    assert [o["id"] for o in index.query("ES", "Vitória", limit=3)["data"]] == [29, 25, 23]
+    # Leaving OPEN drops it from the index
+    index.track(make_order(29, "ES", "Vitória", minutes=14, status="PROPOSAL_RECEIVED"))
+    assert [o["id"] for o in index.query("ES", "Vitória", limit=3)["data"]] == [25, 23, 19]
+
+
+def test_index_publishes_to_region_topics():
+    async def scenario():
+        broker = Broker()
+        index = OpenOrderIndex(broker)
+        city = broker.subscribe("orders/ES/Vitória")
+        state = broker.subscribe("orders/ES")
+        other = broker.subscribe("orders/RJ")
+
+        index.track(make_order(1, "ES", "Vitória", 0))
+        index.track(make_order(1, "ES", "Vitória", 0, status="CANCELLED"))
+        return [city.queue.qsize(), state.queue.qsize(), other.queue.qsize()], await city.get()
+
+    sizes, first = asyncio.run(scenario())
+    assert sizes == [2, 2, 0]
+    assert first["type"] == "order_opened" and first["order"]["id"] == 1
+
+
+def test_slow_subscriber_is_dropped_after_draining():
+    async def scenario():
+        broker = Broker(queue_size=2)
+        subscription = broker.subscribe("t")
+        for i in range(3):
+            broker.publish("t", i)
+        received = [await subscription.get(), await subscription.get()]
+        with pytest.raises(SlowConsumer):
+            await subscription.get()
+        return received, broker.stats()
+
+    received, stats = asyncio.run(scenario())
+    assert received == [0, 1]
+    assert stats["dropped_subscribers"] == 1 and stats["subscriptions"] == 0
+
+
+def test_feed_matches_database_listing(client, seed):
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    for i in range(12):
+        client.post("/orders/", json={"vehicle_plate": f"PLK{i:04d}", "service_type": "emplacamento",
+                                      "city": "Vitória", "state": "ES", "owner_id": owner.id})
+
+    params = {"state": "ES", "limit": 5}
+    for _ in range(3):
+        from_db = client.get("/orders/", params=params).json()
+        from_memory = client.get("/orders/feed", params=params).json()
+        assert from_memory == from_db
+        params["cursor"] = from_db["next_cursor"]
+
+
+def test_feed_websocket_pushes_region_changes(app, seed):
+    from fastapi.testclient import TestClient
+
+    owner, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER"),
+    )
+
+    def new_order(state, city, plate):
+        return client.post("/orders/", json={"vehicle_plate": plate, "service_type": "emplacamento",
+                                             "city": city, "state": state, "owner_id": owner.id}).json()
+
+    # One portal (event loop) for HTTP and WebSocket, like a single uvicorn worker
+    with TestClient(app) as client:
+        existing = new_order("ES", "Vitória", "OLD0001")
+        with client.websocket_connect("/orders/feed/ws?state=ES&city=Vitória") as ws:
+            snapshot = ws.receive_json()
+            assert snapshot["type"] == "snapshot"
+            assert [o["id"] for o in snapshot["data"]] == [existing["id"]]
+
+            new_order("RJ", "Niterói", "RJX0001")  # other region, not pushed
+            created = new_order("ES", "Vitória", "NEW0001")
+            event = ws.receive_json()
+            assert (event["type"], event["order"]["id"]) == ("order_opened", created["id"])
+
+            client.post("/proposals/", json={"order_id": created["id"], "dispatcher_id": dispatcher.id, "fee_value": 100.0,
+                                             "tax_value": 50.0, "estimated_days": 3, "description": "Resolvo"})
+            event = ws.receive_json()
+            assert (event["type"], event["order"]["id"], event["order"]["status"]) == ("order_closed", created["id"], "PROPOSAL_RECEIVED")
+
+
+def test_feed_websocket_rejects_a_city_without_its_state(app):
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+
+    with TestClient(app) as client:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            with client.websocket_connect("/orders/feed/ws?city=Vitória") as ws:
+                ws.receive_json()
+        assert closed.value.code == 1008
@@ -0,0 +1,62 @@
+import models
+import services.order_import as order_import
+
+
+def orders(n, owner_id, **overrides):
+    return [{"vehicle_plate": f"IMP{i:04d}", "service_type": "emplacamento", "city": "Vitória", "state": "ES",
+             "owner_id": owner_id, **overrides} for i in range(n)]
+
+
+def test_json_import_reports_every_row(client, seed, monkeypatch):
+    monkeypatch.setattr(order_import, "IMPORT_CHUNK_SIZE", 4)
+    (owner,) = seed(models.User(full_name="Despachante", email="d@x.com", user_type="CLIENT"))
+
+    rows = orders(10, owner.id)
+    rows[2].pop("service_type")
+    rows[5]["owner_id"] = 999
+    rows[7] = "not an order"
+
+    report = client.post("/orders/import", json=rows).json()
+    assert (report["total"], report["created"], report["invalid"], report["failed"]) == (10, 7, 3, 0)
+    assert [entry["row"] for entry in report["rows"]] == list(range(1, 11))
+    assert report["rows"][2]["errors"] == ["service_type: Field required"]
+    assert report["rows"][5]["errors"] == ["owner_id: user 999 not found"]
+
+    created = [entry["id"] for entry in report["rows"] if entry["status"] == "created"]
+    listed = client.get("/orders/", params={"state": "ES", "limit": 50}).json()["data"]
+    assert sorted(o["id"] for o in listed) == sorted(created)
+    # New orders are in the dispatcher feed too
+    assert sorted(o["id"] for o in client.get("/orders/feed", params={"state": "ES"}).json()["data"]) == sorted(created)
+
+
+def test_csv_import_with_default_owner(client, seed):
+    (owner,) = seed(models.User(full_name="Despachante", email="d@x.com", user_type="CLIENT"))
+    csv_body = (
+        "vehicle_plate,vehicle_renavam,service_type,description,city,state\n"
+        "ABC1D23,,transferencia,,Vila Velha,ES\n"
+        'XYZ9Z99,12345678901,emplacamento,"placa nova, Mercosul",Vitória,ES\n'
+        "SEMSERV,,,,Vitória,ES\n"
+    ).encode("utf-8-sig")
+
+    report = client.post("/orders/import", params={"owner_id": owner.id},
+                         files={"file": ("placas.csv", csv_body, "text/csv")}).json()
+    assert report["created"] == 2
+    # Line numbers of the CSV, header is line 1
+    assert [(e["row"], e["status"]) for e in report["rows"]] == [(2, "created"), (3, "created"), (4, "invalid")]
+
+    order = client.get(f"/orders/{report['rows'][1]['id']}").json()
+    assert (order["vehicle_plate"], order["status"]) == ("XYZ9Z99", "OPEN")
+
+
+def test_import_limits(client, seed, monkeypatch):
+    (owner,) = seed(models.User(full_name="Despachante", email="d@x.com", user_type="CLIENT"))
+    monkeypatch.setattr(order_import, "IMPORT_MAX_ROWS", 5)
+    monkeypatch.setattr("routers.orders.IMPORT_MAX_ROWS", 5)
+
+    assert client.post("/orders/import", json=orders(6, owner.id)).status_code == 413
+    assert client.post("/orders/import", json={"not": "a list"}).status_code == 400
+
+    csv_body = "vehicle_plate,service_type,city,state,owner_id\n" + "".join(
+        f"CSV{i:04d},emplacamento,Vitória,ES,{owner.id}\n" for i in range(7))
+    report = client.post("/orders/import", files={"file": ("p.csv", csv_body.encode(), "text/csv")}).json()
+    assert (report["total"], report["created"], report["truncated"]) == (5, 5, True)
@@ -0,0 +1,63 @@
+import datetime
+
+import models
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    ts = datetime.datetime(2026, 3, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
+
+
+def test_orders_pages_newest_first_without_gaps(client, seed):
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    # Same created_at for several rows: the id breaks the tie
+    base = datetime.datetime(2026, 1, 1)
+    seed(*[
+        models.Order(vehicle_plate=f"PLK{i:04d}", service_type="emplacamento", city="Vitória", state="ES",
+                     owner_id=owner.id, status="OPEN", created_at=base + datetime.timedelta(minutes=i // 3))
+        for i in range(25)
+    ])
+    seed(models.Order(vehicle_plate="PAID0001", service_type="emplacamento", city="Vitória", state="ES",
+                      owner_id=owner.id, status="PAID", created_at=base))
+
+    seen, cursor = [], None
+    while True:
+        params = {"state": "ES", "limit": 10}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/orders/", params=params).json()
+        assert len(page["data"]) <= 10
+        seen += page["data"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(seen) == 25
+    assert len({o["id"] for o in seen}) == 25
+    keys = [(o["created_at"], o["id"]) for o in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_chat_history_pages_oldest_first(client, seed):
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    (order,) = seed(models.Order(vehicle_plate="ABC1D23", service_type="transferencia", city="Vila Velha",
+                                 state="ES", owner_id=owner.id, status="OPEN"))
+    base = datetime.datetime(2026, 1, 1)
+    seed(*[
+        models.Message(order_id=order.id, content=f"msg {i}", is_from_dispatcher=bool(i % 2),
+                       timestamp=base + datetime.timedelta(seconds=i // 2))
+        for i in range(7)
+    ])
+
+    first = client.get(f"/chat/{order.id}", params={"limit": 4}).json()
+    second = client.get(f"/chat/{order.id}", params={"limit": 4, "cursor": first["next_cursor"]}).json()
+
+    assert [m["content"] for m in first["data"] + second["data"]] == [f"msg {i}" for i in range(7)]
+    assert second["next_cursor"] is None
+
+
+def test_invalid_cursor_and_limit_are_rejected(client):
+    assert client.get("/orders/", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/chat/1", params={"cursor": "%%%"}).status_code == 400
+    assert client.get("/orders/", params={"limit": 0}).status_code == 422
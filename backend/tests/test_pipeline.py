@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+
+import models
+import pipeline
+from scraper import IncompletePagination
+
+
+def row(item_id, situacao="Em Análise", pago=True):
+    return {
+        "id": item_id,
+        "placa": f"PLK{item_id}",
+        "proprietario": "Fulano",
+        "situacao": situacao,
+        "flag_pago": pago,
+        "flag_foto": situacao == "Finalizada",
+    }
+
+
+async def refresh(session_factory, rows, photos, now):
+    async with session_factory() as db:
+        stored = await pipeline.load_snapshot(db)
+        plan = pipeline.plan_refresh(stored, rows, now)
+        checked = {item_id: photos.get(item_id, False) for item_id in plan.to_check}
+        data = await pipeline.save_snapshot(db, stored, rows, plan, checked, now)
+    return plan, data
+
+
+def test_first_refresh_checks_only_paid_unfinished_rows(session_factory):
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+
+    plan, data = asyncio.run(refresh(session_factory, [row("1"), row("2", pago=False), row("3", "Finalizada")], {"1": True}, now))
+
+    assert plan.added == ["1", "2", "3"]
+    assert plan.to_check == ["1"]
+    assert {d["id"]: d["flag_foto"] for d in data} == {"1": True, "2": False, "3": True}
+
+
+def test_incremental_refresh_diff(session_factory):
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+    later = now + datetime.timedelta(minutes=1)
+
+    async def scenario():
+        await refresh(session_factory, [row("1"), row("2", pago=False), row("3")], {"1": True, "3": True}, now)
+        plan, data = await refresh(session_factory, [row("1"), row("2", pago=True), row("4")], {"2": True}, later)
+        async with session_factory() as db:
+            removed = await db.get(models.PipelineItem, "3")
+        return plan, data, removed
+
+    plan, data, removed = asyncio.run(scenario())
+
+    assert plan.added == ["4"]
+    assert plan.changed == ["2"]
+    assert plan.removed == ["3"]
+    # Row 1 is unchanged and already had photos, so no detail navigation
+    assert plan.to_check == ["2", "4"]
+    assert {d["id"] for d in data} == {"1", "2", "4"}
+    assert removed is None
+
+
+def test_unchanged_row_missing_photos_is_rechecked_when_stale(session_factory):
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+    stale = now + datetime.timedelta(seconds=pipeline.PHOTO_RECHECK_SECONDS + 1)
+
+    async def scenario():
+        await refresh(session_factory, [row("1")], {"1": False}, now)
+        recent, _ = await refresh(session_factory, [row("1")], {}, now + datetime.timedelta(seconds=10))
+        later, data = await refresh(session_factory, [row("1")], {"1": True}, stale)
+        return recent, later, data
+
+    recent, later, data = asyncio.run(scenario())
+    assert recent.to_check == []
+    assert later.to_check == ["1"]
+    assert data[0]["flag_foto"] is True
+
+
+class FakeScraper:
+    def __init__(self, rows, photos):
+        self.rows = rows
+        self.photos = photos
+
+    async def iter_pipeline_rows(self):
+        for r in self.rows:
+            yield dict(r)
+
+    async def check_photos_many(self, item_ids, on_result=None):
+        results = {}
+        for item_id in item_ids:
+            results[item_id] = self.photos.get(item_id, False)
+            if on_result:
+                await on_result(item_id, results[item_id])
+        return results
+
+
+def test_run_refresh_streams_rows_then_photos(monkeypatch, session_factory):
+    monkeypatch.setattr(pipeline, "AsyncSessionLocal", session_factory)
+    scraper = FakeScraper([row("1"), row("2", pago=False)], {"1": True})
+    events = []
+
+    async def emit(event):
+        events.append(event)
+
+    result = asyncio.run(pipeline.run_refresh(scraper, emit=emit))
+
+    assert [e["event"] for e in events] == ["row", "row", "checking", "photo"]
+    assert events[3] == {"event": "photo", "id": "1", "flag_foto": True}
+    assert result["added"] == ["1", "2"]
+    assert pipeline.pipeline_cache["data"][0]["flag_foto"] is True
+
+
+def test_concurrent_refreshes_share_one_scrape(monkeypatch, session_factory):
+    monkeypatch.setattr(pipeline, "AsyncSessionLocal", session_factory)
+    scrapes = []
+
+    class SlowScraper(FakeScraper):
+        async def iter_pipeline_rows(self):
+            scrapes.append(1)
+            for r in self.rows:
+                await asyncio.sleep(0.01)
+                yield dict(r)
+
+    scraper = SlowScraper([row("1"), row("2")], {"1": True, "2": False})
+    late_events = []
+
+    async def late_emit(event):
+        late_events.append(event)
+
+    async def scenario():
+        first = asyncio.create_task(pipeline.refresh(scraper))
+        await asyncio.sleep(0.015)  # first row already scraped
+        return await asyncio.gather(first, pipeline.refresh(scraper), pipeline.refresh(scraper, emit=late_emit))
+
+    results = asyncio.run(scenario())
+
+    assert len(scrapes) == 1
+    assert results[0] == results[1] == results[2]
+    # The late streaming caller still got every row, replayed from the start
+    assert [e["data"]["id"] for e in late_events if e["event"] == "row"] == ["1", "2"]
+    assert not pipeline.is_refreshing()
+    assert pipeline.cache_age() < 5
+
+
+def test_pipeline_data_filters_pages_and_revalidates():
+    from fastapi.testclient import TestClient
+    import api
+
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+    items = [dict(row(str(i), pago=i % 2 == 0), flag_foto=False) for i in range(1, 8)]
+    items[0]["placa"] = "ABC1D23"
+    pipeline._set_snapshot(items, now)
+    client = TestClient(api.app)
+
+    first = client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2})
+    body = first.json()
+    assert [i["id"] for i in body["data"]] == ["2", "4"]
+    assert body["total"] == 3
+    assert body["next_cursor"] == "4"
+
+    second = client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2, "cursor": body["next_cursor"]})
+    assert [i["id"] for i in second.json()["data"]] == ["6"]
+    assert second.json()["next_cursor"] is None
+
+    assert [i["id"] for i in client.get("/pipeline/data", params={"placa": "abc"}).json()["data"]] == ["1"]
+
+    # Unchanged snapshot: 304 by ETag or Last-Modified
+    etag = first.headers["etag"]
+    again = client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    since = client.get("/pipeline/data", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert since.status_code == 304
+
+    # Same rows re-scraped later keep the validators, a real change invalidates them
+    pipeline._set_snapshot(list(items), now + datetime.timedelta(minutes=5))
+    revalidated = client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    # The 304 still tells when the portal was last scraped, the body it stands for doesn't change
+    assert first.headers["x-pipeline-refreshed-at"] == "2026-01-01T12:00:00+00:00"
+    assert revalidated.headers["x-pipeline-refreshed-at"] == "2026-01-01T12:05:00+00:00"
+    assert client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2}).json() == body
+    assert body["last_changed"] == "2026-01-01T12:00:00+00:00"
+
+    # Age counts from the latest scrape, on 304s too
+    pipeline._set_snapshot(list(items), datetime.datetime.utcnow() - datetime.timedelta(seconds=90))
+    revalidated = client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and 90 <= int(revalidated.headers["age"]) < 95
+    items[1]["flag_foto"] = True
+    pipeline._set_snapshot(items, now + datetime.timedelta(minutes=10))
+    assert client.get("/pipeline/data", params={"flag_pago": "true", "limit": 2}, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_partial_scrape_keeps_rows_it_did_not_reach(monkeypatch, session_factory):
+    monkeypatch.setattr(pipeline, "AsyncSessionLocal", session_factory)
+    now = datetime.datetime(2026, 1, 1, 12, 0)
+    asyncio.run(refresh(session_factory, [row("1"), row("2"), row("3")], {"1": True, "2": True, "3": True}, now))
+
+    class BrokenPagination(FakeScraper):
+        async def iter_pipeline_rows(self):
+            yield dict(self.rows[0])
+            raise IncompletePagination("page 2 never loaded")
+
+    result = asyncio.run(pipeline.run_refresh(BrokenPagination([row("1", "Finalizada")], {})))
+
+    assert result["complete"] is False and result["removed"] == [] and result["changed"] == ["1"]
+    assert {d["id"] for d in pipeline.pipeline_cache["data"]} == {"1", "2", "3"}
+    _, data = asyncio.run(refresh(session_factory, [row("1", "Finalizada"), row("2")], {}, now))
+    # A full walk still removes what is really gone
+    assert {d["id"] for d in data} == {"1", "2"}
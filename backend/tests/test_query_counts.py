@@ -0,0 +1,106 @@
+import pytest
+
+import models
+
+# Upper bound of SQL statements per request (keyed by route name), a lazy
+# load (N+1) pushes it over. Writes are lookups + flush + refresh.
+QUERY_BUDGET = {
+    "create_order": 2,
+    # Per chunk: 1 owner lookup + the insert (one statement per row on SQLite, see send_messages_batch)
+    "import_orders_bulk": 1 + 20,
+    "list_orders": 1,
+    "order_feed": 1,
+    "get_order": 1,
+    "update_order_status": 3,
+    "create_proposal": 4,
+    "list_proposals_for_order": 1,
+    "create_checkout": 3,  # open charge lookup, proposal graph, INSERT
+    "asaas_webhook": 1,
+    "send_message": 2,
+    # 2 SELECTs + the inserts: one per row on SQLite, which can't return the ids of a
+    # multi-row INSERT in order (the ORM sends a single INSERT on Postgres)
+    "send_messages_batch": 2 + 20,
+    "get_messages": 1,
+    "create_review": 5,
+    "dispatcher_leaderboard": 1,
+    "upload_document_for_order": 1,
+}
+
+
+@pytest.fixture
+def graph(seed):
+    client_user, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT", asaas_customer_id="cus_1"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER", asaas_account_id="wal_1"),
+    )
+    open_order, paid_order, finished_order = seed(*[
+        models.Order(vehicle_plate=f"ABC1D2{i}", service_type="transferencia", city="Vila Velha", state="ES",
+                     owner_id=client_user.id, status=status)
+        for i, status in enumerate(["OPEN", "OPEN", "FINISHED"])
+    ])
+    proposals = seed(*[
+        models.Proposal(order_id=order.id, dispatcher_id=dispatcher.id, fee_value=100.0, tax_value=50.0,
+                        total_value=150.0, estimated_days=3, description="Resolvo", is_accepted=order is finished_order)
+        for order in (paid_order, paid_order, finished_order)
+    ])
+    seed(models.Payment(asaas_payment_id="pay_1", status="PENDING", amount=150.0, proposal_id=proposals[0].id))
+    seed(*[models.Message(order_id=open_order.id, content=f"msg {i}", is_from_dispatcher=bool(i % 2)) for i in range(5)])
+    return {"client": client_user, "dispatcher": dispatcher, "open": open_order, "paid": paid_order,
+            "finished": finished_order, "proposal": proposals[0], "unpaid_proposal": proposals[1]}
+
+
+def requests_for(graph):
+    open_id = graph["open"].id
+    return {
+        "create_order": ("post", "/orders/", {"json": {
+            "vehicle_plate": "XYZ9Z99", "service_type": "emplacamento", "city": "Vitória", "state": "ES",
+            "owner_id": graph["client"].id}}),
+        "import_orders_bulk": ("post", "/orders/import", {"json": [
+            {"vehicle_plate": f"IMP{i:04d}", "service_type": "emplacamento", "city": "Vitória", "state": "ES",
+             "owner_id": graph["client"].id} for i in range(20)]}),
+        "list_orders": ("get", "/orders/", {"params": {"state": "ES", "city": "Vila Velha"}}),
+        "order_feed": ("get", "/orders/feed", {"params": {"state": "ES"}}),
+        "get_order": ("get", f"/orders/{open_id}", {}),
+        "update_order_status": ("put", f"/orders/{graph['paid'].id}/status", {"params": {"status": "IN_PROGRESS"}}),
+        "create_proposal": ("post", "/proposals/", {"json": {
+            "order_id": open_id, "dispatcher_id": graph["dispatcher"].id, "fee_value": 100.0, "tax_value": 50.0,
+            "estimated_days": 3, "description": "Resolvo em 3 dias"}}),
+        "list_proposals_for_order": ("get", f"/proposals/order/{graph['paid'].id}", {}),
+        "create_checkout": ("post", f"/payments/checkout/{graph['unpaid_proposal'].id}", {}),
+        "asaas_webhook": ("post", "/payments/webhook/asaas", {"json": {"event": "PAYMENT_RECEIVED", "payment": {"id": "pay_1"}}}),
+        "send_message": ("post", "/chat/", {"json": {"order_id": open_id, "content": "Olá", "is_from_dispatcher": True}}),
+        "send_messages_batch": ("post", "/chat/batch", {"json": {"messages": [
+            {"order_id": open_id, "content": f"offline {i}", "is_from_dispatcher": False, "client_key": f"k{i}"}
+            for i in range(20)]}}),
+        "get_messages": ("get", f"/chat/{open_id}", {}),
+        "create_review": ("post", "/reviews/", {"json": {"order_id": graph["finished"].id, "rating": 5}}),
+        "dispatcher_leaderboard": ("get", "/reviews/leaderboard", {"params": {"state": "ES", "city": "Vila Velha"}}),
+        "upload_document_for_order": ("post", f"/documents/upload/{open_id}", {"files": {"file": ("crlv.pdf", b"%PDF-1.4", "application/pdf")}}),
+    }
+
+
+def test_every_router_endpoint_has_a_budget():
+    # New endpoints must get an entry in QUERY_BUDGET (WebSockets aside)
+    from fastapi.routing import APIRoute
+    from routers import chat, documents, orders, payments, proposals, reviews
+
+    routes = {route.name for module in (orders, proposals, payments, chat, reviews, documents)
+              for route in module.router.routes if isinstance(route, APIRoute)}
+    assert routes == set(QUERY_BUDGET)
+
+
+@pytest.mark.parametrize("endpoint", sorted(QUERY_BUDGET))
+def test_query_budget(endpoint, client, graph, queries, monkeypatch, tmp_path):
+    from services import asaas, documents
+
+    async def fake_create_payment(**kwargs):
+        return {"id": "pay_new", "status": "PENDING", "value": kwargs["value"], "invoiceUrl": "https://pay/new"}
+    monkeypatch.setattr(asaas.asaas_service, "create_payment", fake_create_payment)
+    monkeypatch.setattr(documents, "UPLOAD_DIR", str(tmp_path))
+
+    method, url, kwargs = requests_for(graph)[endpoint]
+    with queries:
+        response = getattr(client, method)(url, **kwargs)
+
+    assert response.status_code == 200, response.text
+    assert queries.count <= QUERY_BUDGET[endpoint], "\n".join(queries.statements)
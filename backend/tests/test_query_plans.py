@@ -0,0 +1,122 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import models
+from routers.chat import messages_after_query, messages_by_client_key_query, order_messages_query
+from routers.orders import open_orders_query
+from routers.payments import checkout_query, existing_checkout_query
+from routers.proposals import order_proposals_query
+from routers.reviews import accepted_proposal_query
+from services.ratings import leaderboard_query
+from services.webhooks import event_payments_query, pending_events_query
+from pagination import encode_cursor
+
+# A page deep into a listing, must seek in the index rather than skip rows
+CURSOR = encode_cursor(datetime.datetime(2026, 1, 1, 0, 30), 1800)
+
+# Hot queries of the marketplace routers, each must be answered through an index
+HOT_QUERIES = {
+    "list_orders": open_orders_query(),
+    "list_orders_state": open_orders_query(state="ES"),
+    "list_orders_state_city": open_orders_query(city="Vitoria", state="ES"),
+    "list_orders_city": open_orders_query(city="Vitoria"),
+    "list_orders_next_page": open_orders_query(cursor=CURSOR),
+    "list_orders_state_city_next_page": open_orders_query(city="Vitoria", state="ES", cursor=CURSOR),
+    "get_messages": order_messages_query(7),
+    "get_messages_next_page": order_messages_query(7, cursor=CURSOR),
+    "chat_resume_after_id": messages_after_query(7, 4000),
+    "chat_client_keys": messages_by_client_key_query({(7, "k1"), (8, "k2")}),
+    "list_proposals_for_order": order_proposals_query(7),
+    "create_review_accepted_proposal": accepted_proposal_query(7),
+    "dispatcher_leaderboard": leaderboard_query(),
+    "dispatcher_leaderboard_state_city": leaderboard_query(state="ES", city="Vitoria", min_reviews=3),
+    "create_checkout": checkout_query(7),
+    "checkout_reuse": existing_checkout_query(7),
+    "checkout_reuse_idempotency_key": existing_checkout_query(7, "key-7"),
+    "webhook_pending_events": pending_events_query(200),
+    "webhook_event_payments": event_payments_query(["pay_7", "pay_8"]),
+}
+
+
+@pytest.fixture(scope="module")
+def seeded_engine(tmp_path_factory):
+    from database import run_migrations
+
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    run_migrations(engine)
+
+    now = datetime.datetime(2026, 1, 1)
+    cities = [("ES", "Vitoria"), ("ES", "Vila Velha"), ("RJ", "Niteroi"), ("SP", "Campinas")]
+    statuses = ["OPEN", "PAID", "FINISHED", "CANCELLED"]
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": i, "full_name": f"user {i}", "email": f"u{i}@example.com", "user_type": "CLIENT" if i % 2 else "DISPATCHER"}
+            for i in range(1, 51)
+        ])
+        conn.execute(models.Order.__table__.insert(), [
+            {"id": i, "created_at": now, "status": statuses[i % 4], "vehicle_plate": f"ABC{i:04d}",
+             "service_type": "Transferencia", "state": cities[i % 4][0], "city": cities[i % 4][1], "owner_id": i % 50 + 1}
+            for i in range(1, 2001)
+        ])
+        conn.execute(models.Proposal.__table__.insert(), [
+            {"id": i, "created_at": now, "fee_value": 100.0, "tax_value": 50.0, "total_value": 150.0, "estimated_days": 3,
+             "description": "ok", "is_accepted": i % 3 == 0, "dispatcher_id": i % 50 + 1, "order_id": i % 2000 + 1}
+            for i in range(1, 4001)
+        ])
+        conn.execute(models.Message.__table__.insert(), [
+            {"id": i, "timestamp": now + datetime.timedelta(seconds=i), "content": "oi", "is_from_dispatcher": bool(i % 2),
+             "order_id": i % 2000 + 1}
+            for i in range(1, 8001)
+        ])
+        conn.execute(models.Payment.__table__.insert(), [
+            {"id": i, "created_at": now, "asaas_payment_id": f"pay_{i}", "status": "PENDING" if i % 4 == 0 else "PAID",
+             "amount": 150.0, "idempotency_key": f"key-{i}", "proposal_id": i}
+            for i in range(1, 1001)
+        ])
+        conn.execute(models.WebhookEvent.__table__.insert(), [
+            {"id": i, "event_id": f"evt_{i}", "event": "PAYMENT_RECEIVED", "asaas_payment_id": f"pay_{i % 1000 + 1}",
+             "payload": "{}", "received_at": now, "processed_at": now if i < 2900 else None}
+            for i in range(1, 3001)
+        ])
+        conn.execute(models.DispatcherRating.__table__.insert(), [
+            {"dispatcher_id": i, "state": state, "city": city, "review_count": i % 7 + 1, "rating_sum": (i % 7 + 1) * 4,
+             "average": 4.0 - (i % 5) / 10, "rating_1": 0, "rating_2": 0, "rating_3": 0, "rating_4": i % 7 + 1, "rating_5": 0}
+            for i in range(1, 51)
+            for state, city in [("", ""), ("ES", ""), ("ES", "Vitoria"), ("RJ", ""), ("RJ", "Niteroi")]
+        ])
+        # Planner statistics, like a production database that has been ANALYZEd
+        conn.execute(text("ANALYZE"))
+
+    yield engine
+    engine.dispose()
+
+
+def explain(engine, query):
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_index(seeded_engine, name):
+    plan = explain(seeded_engine, HOT_QUERIES[name])
+
+    # "SCAN orders" is a full table scan, "SCAN orders USING INDEX ..." is not
+    full_scans = [step for step in plan if step.startswith("SCAN") and "USING" not in step]
+    assert not full_scans, f"{name} does a full table scan: {plan}"
+    # Ordering must come from the index too, not a temp b-tree sort
+    assert not any("TEMP B-TREE" in step for step in plan), f"{name} sorts in memory: {plan}"
+    assert any("INDEX" in step or "PRIMARY KEY" in step for step in plan), plan
+
+
+def test_model_indexes_match_migrations(seeded_engine):
+    # Models and migrations must not drift apart
+    from sqlalchemy import inspect
+
+    inspector = inspect(seeded_engine)
+    for table in models.Base.metadata.sorted_tables:
+        declared = {index.name for index in table.indexes}
+        migrated = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert declared <= migrated, f"{table.name}: missing {declared - migrated}"
@@ -0,0 +1,67 @@
+import asyncio
+
+import models
+from services.ratings import record_review
+
+
+def finished_order(seed, owner, dispatcher, state="ES", city="Vitória"):
+    (order,) = seed(models.Order(vehicle_plate="ABC1D23", service_type="transferencia", city=city, state=state,
+                                 owner_id=owner.id, status="FINISHED"))
+    seed(models.Proposal(order_id=order.id, dispatcher_id=dispatcher.id, fee_value=100.0, tax_value=50.0,
+                         total_value=150.0, estimated_days=3, description="ok", is_accepted=True))
+    return order
+
+
+def test_reviews_update_aggregates_and_leaderboard(client, seed):
+    owner, ana, bia = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"),
+        models.User(full_name="Ana", email="a@x.com", user_type="DISPATCHER"),
+        models.User(full_name="Bia", email="b@x.com", user_type="DISPATCHER"),
+    )
+    for dispatcher, rating, state, city in [
+        (ana, 5, "ES", "Vitória"), (ana, 3, "ES", "Vila Velha"),
+        (bia, 4, "ES", "Vitória"), (bia, 5, "RJ", "Niterói"),
+    ]:
+        order = finished_order(seed, owner, dispatcher, state, city)
+        assert client.post("/reviews/", json={"order_id": order.id, "rating": rating}).status_code == 200
+
+    overall = client.get("/reviews/leaderboard").json()
+    assert [(e["full_name"], e["review_count"], e["average"]) for e in overall] == [("Bia", 2, 4.5), ("Ana", 2, 4.0)]
+    assert overall[1]["histogram"] == {"1": 0, "2": 0, "3": 1, "4": 0, "5": 1}
+
+    es = client.get("/reviews/leaderboard", params={"state": "ES"}).json()
+    # Same average: more reviews ranks higher
+    assert [(e["rank"], e["full_name"], e["review_count"]) for e in es] == [(1, "Ana", 2), (2, "Bia", 1)]
+    vitoria = client.get("/reviews/leaderboard", params={"state": "ES", "city": "Vitória"}).json()
+    assert [(e["full_name"], e["average"]) for e in vitoria] == [("Ana", 5.0), ("Bia", 4.0)]
+
+    assert client.get("/reviews/leaderboard", params={"min_reviews": 3}).json() == []
+    assert client.get("/reviews/leaderboard", params={"city": "Vitória"}).status_code == 400
+
+
+def test_rating_out_of_range_is_rejected(client, seed):
+    owner, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"),
+        models.User(full_name="Ana", email="a@x.com", user_type="DISPATCHER"),
+    )
+    order = finished_order(seed, owner, dispatcher)
+    assert client.post("/reviews/", json={"order_id": order.id, "rating": 6}).status_code == 422
+
+
+def test_concurrent_reviews_do_not_lose_updates(session_factory, seed):
+    (dispatcher,) = seed(models.User(full_name="Ana", email="a@x.com", user_type="DISPATCHER"))
+
+    async def review(rating):
+        async with session_factory() as db:
+            await record_review(db, dispatcher.id, rating, "ES", "Vitória")
+            await db.commit()
+
+    async def scenario():
+        await asyncio.gather(*(review(i % 5 + 1) for i in range(20)))
+        async with session_factory() as db:
+            return await db.get(models.DispatcherRating, 1)
+
+    rating = asyncio.run(scenario())
+    assert (rating.state, rating.review_count, rating.rating_sum) == ("", 20, 60)
+    assert rating.average == 3.0
+    assert [rating.rating_1, rating.rating_2, rating.rating_3, rating.rating_4, rating.rating_5] == [4] * 5
@@ -0,0 +1,291 @@
+import asyncio
+import httpx
+import pytest
+from contextlib import asynccontextmanager
+from auth_state import StorageStateStore
+from scraper import IncompletePagination, PlacasScraper, parse_pipeline_row
+
+
+class FakePage:
+    def __init__(self, delays):
+        self.delays = delays
+        self.url = None
+        self.closed = False
+
+    async def goto(self, url, timeout=None):
+        self.url = url
+        item_id = url.rsplit("/", 1)[-1]
+        await asyncio.sleep(self.delays.get(item_id, 0))
+
+    async def content(self):
+        return "Foto Traseira <a>Visualizar</a>"
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self, delays):
+        self.delays = delays
+        self.pages = []
+
+    async def new_page(self):
+        page = FakePage(self.delays)
+        self.pages.append(page)
+        return page
+
+
+class FakePool:
+    def __init__(self, context):
+        self.context = context
+
+    @asynccontextmanager
+    async def lease(self, **kwargs):
+        yield self.context
+
+
+def make_scraper(delays, concurrency=3, timeout=0.5):
+    scraper = PlacasScraper(pool=FakePool(FakeContext(delays)))
+    scraper.photo_check_concurrency = concurrency
+    scraper.photo_check_timeout = timeout
+    return scraper
+
+
+def test_check_photos_many_runs_concurrently():
+    ids = [str(i) for i in range(9)]
+    scraper = make_scraper({i: 0.1 for i in ids})
+
+    loop = asyncio.new_event_loop()
+    start = loop.time()
+    results = loop.run_until_complete(scraper.check_photos_many(ids))
+    elapsed = loop.time() - start
+    loop.close()
+
+    assert results == {i: True for i in ids}
+    # 9 items / 3 workers * 0.1s, far from the 0.9s a sequential run takes
+    assert elapsed < 0.6
+    assert len(scraper.pool.context.pages) == 3
+    assert all(p.closed for p in scraper.pool.context.pages)
+
+
+def test_check_photos_many_isolates_timeouts():
+    scraper = make_scraper({"slow": 5, "ok1": 0, "ok2": 0}, concurrency=2, timeout=0.2)
+
+    results = asyncio.run(scraper.check_photos_many(["slow", "ok1", "ok2"]))
+
+    assert results == {"slow": False, "ok1": True, "ok2": True}
+    # The stuck page is replaced instead of being reused
+    assert len(scraper.pool.context.pages) == 3
+
+
+def test_check_photos_many_keeps_results_when_pages_cannot_be_replaced():
+    class FailingContext(FakeContext):
+        async def new_page(self):
+            if len(self.pages) == 2:
+                raise RuntimeError("browser crashed")
+            return await super().new_page()
+
+    scraper = make_scraper({"slow": 5, "ok1": 0, "ok2": 0, "ok3": 0}, concurrency=2, timeout=0.2)
+    scraper.pool.context = FailingContext({"slow": 5})
+    checked = []
+
+    async def on_result(item_id, flag_foto):
+        checked.append(item_id)
+
+    results = asyncio.run(scraper.check_photos_many(["ok1", "slow", "ok2", "ok3"], on_result=on_result))
+
+    # One page is lost with the stuck row, the other finishes the batch
+    assert results == {"ok1": True, "slow": False, "ok2": True, "ok3": True}
+    assert sorted(checked) == sorted(results)
+
+    class DeadContext(FakeContext):
+        async def new_page(self):
+            raise RuntimeError("browser crashed")
+
+    # No page at all: nothing checked, nothing aborted
+    scraper.pool.context = DeadContext({})
+    assert asyncio.run(scraper.check_photos_many(["ok1", "ok2"])) == {}
+
+
+def test_check_photos_many_leaves_rows_unchecked_once_every_page_is_lost():
+    class FailingContext(FakeContext):
+        async def new_page(self):
+            if len(self.pages) == 1:
+                raise RuntimeError("browser crashed")
+            return await super().new_page()
+
+    scraper = make_scraper({}, concurrency=1, timeout=0.2)
+    scraper.pool.context = FailingContext({"slow": 5})
+
+    results = asyncio.run(scraper.check_photos_many(["ok1", "slow", "ok2", "ok3"]))
+    assert results == {"ok1": True, "slow": False}
+
+
+def order_row(item_id, situacao="Em Análise", pago=True):
+    cells = ["", item_id, f"PLK{item_id}", "", "", "", "", " Fulano ", "", "", f" {situacao} ", ""]
+    return {"cells": cells, "pago": pago}
+
+
+class FakeTablePage:
+    """Serves one table page per evaluate() call, clicking 'next' moves to the following one."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.current = 0
+
+    async def evaluate(self, script, arg=None):
+        return self.pages[self.current]
+
+    async def query_selector(self, selector):
+        if self.current + 1 < len(self.pages):
+            return self
+        return None
+
+    async def click(self):
+        self.current += 1
+
+    async def wait_for_load_state(self):
+        pass
+
+    async def wait_for_function(self, *args, **kwargs):
+        pass
+
+
+def test_parse_pipeline_row():
+    assert parse_pipeline_row({"cells": ["x"] * 5, "pago": True}) is None
+    assert parse_pipeline_row(order_row("7970")) == {
+        "id": "7970",
+        "placa": "PLK7970",
+        "proprietario": "Fulano",
+        "situacao": "Em Análise",
+        "flag_pago": True,
+        "flag_foto": False,
+    }
+
+
+def test_read_all_pages_follows_pagination():
+    page = FakeTablePage([
+        [order_row("1"), order_row("2")],
+        [order_row("3")],
+    ])
+    rows = asyncio.run(PlacasScraper().read_all_pages(page))
+    assert [r["cells"][1] for r in rows] == ["1", "2", "3"]
+
+
+def test_http_fast_path_falls_back_to_browser_only_when_ambiguous():
+    pages = {
+        "1": (200, "<div>Foto Traseira <a>Visualizar</a></div>"),
+        "2": (200, "<p>Nenhum arquivo enviado</p>"),
+        "3": (200, "<div id='anexos'></div>"),  # filled by JS, unclear over HTTP
+        "4": (302, ""),  # session expired, redirected to /Login
+    }
+    seen_cookies = []
+
+    def handler(request):
+        seen_cookies.append(request.headers.get("cookie"))
+        status, body = pages[request.url.path.rsplit("/", 1)[-1]]
+        return httpx.Response(status, text=body)
+
+    scraper = make_scraper({})
+    scraper.cookies = [{"name": "ASP.NET_SessionId", "value": "abc", "domain": "placaswebmercosul.com.br", "path": "/"}]
+    scraper._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=scraper.base_url)
+
+    results = asyncio.run(scraper.check_photos_many(["1", "2", "3", "4"]))
+
+    assert results == {"1": True, "2": False, "3": True, "4": True}
+    assert seen_cookies == ["ASP.NET_SessionId=abc"] * 4
+    # Only the two ambiguous items were navigated in the browser
+    visited = sorted(p.url.rsplit("/", 1)[-1] for p in scraper.pool.context.pages if p.url)
+    assert visited == ["3", "4"]
+
+
+def make_probe_client(scraper, status):
+    probes = []
+
+    def handler(request):
+        probes.append(request.url.path)
+        if status == 302:
+            return httpx.Response(302, headers={"Location": "/Login"})
+        return httpx.Response(200, text="<table class='table-scrollable'></table>")
+
+    scraper._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=scraper.base_url)
+    return probes
+
+
+def test_saved_session_is_reused_without_login(tmp_path):
+    store = StorageStateStore(str(tmp_path))
+    state = {"cookies": [{"name": "ASP.NET_SessionId", "value": "saved", "domain": "placaswebmercosul.com.br", "path": "/"}], "origins": []}
+    store.save("placas", "12345678000199", state)
+
+    scraper = PlacasScraper(pool=FakePool(FakeContext({})), state_store=store)
+    scraper.username = "12345678000199"
+    scraper.password = "secret"
+    probes = make_probe_client(scraper, 200)
+
+    async def no_login(*args):
+        raise AssertionError("should not log in")
+    scraper.login = no_login
+
+    assert asyncio.run(scraper.ensure_session()) is True
+    assert scraper.storage_state == state
+    # Second call within SCRAPER_SESSION_PROBE_SECONDS doesn't probe again
+    assert asyncio.run(scraper.ensure_session()) is True
+    assert probes == ["/PedidoAutorizacao/Index"]
+
+
+def test_expired_session_triggers_login(tmp_path):
+    store = StorageStateStore(str(tmp_path))
+    store.save("placas", "user", {"cookies": [{"name": "s", "value": "old", "domain": "x", "path": "/"}], "origins": []})
+
+    scraper = PlacasScraper(pool=FakePool(FakeContext({})), state_store=store)
+    scraper.username = "user"
+    scraper.password = "secret"
+    make_probe_client(scraper, 302)
+    logins = []
+
+    async def fake_login(username, password):
+        logins.append(username)
+        return True
+    scraper.login = fake_login
+
+    assert asyncio.run(scraper.ensure_session()) is True
+    assert logins == ["user"]
+
+
+def test_pagination_failure_is_reported_after_the_rows_read():
+    class BrokenNextPage(FakeTablePage):
+        async def wait_for_function(self, *args, **kwargs):
+            if self.current == 2:
+                raise TimeoutError("page 3 never loaded")
+
+    page = BrokenNextPage([[order_row("1")], [order_row("2")], [order_row("3")]])
+    read = []
+
+    async def walk(scraper):
+        async for page_rows in scraper.iter_table_pages(page):
+            read.extend(r["cells"][1] for r in page_rows)
+
+    with pytest.raises(IncompletePagination):
+        asyncio.run(walk(PlacasScraper()))
+    assert read == ["1", "2"]
+
+    # Running out of max_pages is just as incomplete
+    scraper = PlacasScraper()
+    scraper.max_pages = 1
+    page, read = FakeTablePage([[order_row("1")], [order_row("2")]]), []
+    with pytest.raises(IncompletePagination):
+        asyncio.run(walk(scraper))
+    assert read == ["1"]
+
+
+def test_fetch_pipeline_data_keeps_rows_read_before_pagination_broke():
+    scraper = make_scraper({})
+
+    async def rows(bulk=True):
+        yield parse_pipeline_row(order_row("1"))
+        yield parse_pipeline_row(order_row("2", pago=False))
+        raise IncompletePagination("page 2 never loaded")
+    scraper.iter_pipeline_rows = rows
+
+    data = asyncio.run(scraper.fetch_pipeline_data())
+    assert [(item["id"], item["flag_foto"]) for item in data] == [("1", True), ("2", False)]
@@ -0,0 +1,57 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import models
+from upload import sniff_content_type, stream_upload
+
+PDF = b"%PDF-1.4\n" + os.urandom(300_000)
+
+
+def upload(data, filename="crlv.pdf"):
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def test_stream_upload_hashes_sniffs_and_renames(tmp_path):
+    target = tmp_path / "crlv.pdf"
+    stored = asyncio.run(stream_upload(upload(PDF), str(target), chunk_size=64 * 1024))
+
+    assert stored.size == len(PDF) and target.read_bytes() == PDF
+    assert stored.sha256 == hashlib.sha256(PDF).hexdigest()
+    assert stored.content_type == "application/pdf"
+    assert os.listdir(tmp_path) == ["crlv.pdf"]
+
+
+def test_size_limit_stops_mid_stream(tmp_path):
+    target = tmp_path / "big.pdf"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(stream_upload(upload(PDF), str(target), max_size=100_000, chunk_size=16 * 1024))
+    assert error.value.status_code == 413
+    # Neither the file nor its temp copy is left behind
+    assert os.listdir(tmp_path) == []
+
+
+def test_sniffing_ignores_the_claimed_type():
+    assert sniff_content_type(b"\x89PNG\r\n\x1a\n\x00\x00") == "image/png"
+    assert sniff_content_type(b"\xff\xd8\xff\xe0\x00\x10JFIF") == "image/jpeg"
+    assert sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(b"MZ\x90\x00") == "application/octet-stream"
+
+
+def test_order_document_rejects_disguised_files(client, seed, tmp_path, monkeypatch):
+    from services import documents
+    monkeypatch.setattr(documents, "UPLOAD_DIR", str(tmp_path))
+    (owner,) = seed(models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"))
+    (order,) = seed(models.Order(vehicle_plate="ABC1D23", service_type="transferencia", city="Vitória", state="ES", owner_id=owner.id))
+
+    response = client.post(f"/documents/upload/{order.id}", files={"file": ("crlv.pdf", PDF, "application/pdf")})
+    assert response.status_code == 200
+    assert response.json()["sha256"] == hashlib.sha256(PDF).hexdigest()
+
+    response = client.post(f"/documents/upload/{order.id}", files={"file": ("crlv.pdf", b"MZ\x90\x00" * 100, "application/pdf")})
+    assert response.status_code == 415
+    assert len(os.listdir(tmp_path / str(order.id))) == 1
@@ -0,0 +1,93 @@
+import asyncio
+
+from sqlalchemy import select
+
+import models
+from services.webhooks import WebhookWorker
+
+
+def paid_graph(seed, payments):
+    client_user, dispatcher = seed(
+        models.User(full_name="Cliente", email="c@x.com", user_type="CLIENT"),
+        models.User(full_name="Despachante", email="d@x.com", user_type="DISPATCHER"),
+    )
+    orders = seed(*[models.Order(vehicle_plate=f"PIX{i:04d}", service_type="transferencia", city="Vitória", state="ES",
+                                 owner_id=client_user.id, status="PROPOSAL_RECEIVED") for i in range(payments)])
+    proposals = seed(*[models.Proposal(order_id=order.id, dispatcher_id=dispatcher.id, fee_value=100.0, tax_value=50.0,
+                                       total_value=150.0, estimated_days=3, description="Resolvo") for order in orders])
+    seed(*[models.Payment(asaas_payment_id=f"pay_{i}", status="PENDING", amount=150.0, proposal_id=proposal.id)
+           for i, proposal in enumerate(proposals)])
+
+
+def statuses(session_factory, model, column):
+    async def run():
+        async with session_factory() as db:
+            return list((await db.execute(select(column).order_by(model.id))).scalars())
+    return asyncio.run(run())
+
+
+def test_redeliveries_are_recorded_once(client, session_factory):
+    event = {"id": "evt_1", "event": "PAYMENT_RECEIVED", "payment": {"id": "pay_0"}}
+    for _ in range(3):
+        assert client.post("/payments/webhook/asaas", json=event).json() == {"status": "received"}
+    # Without an event id, event + payment is the key
+    for _ in range(2):
+        client.post("/payments/webhook/asaas", json={"event": "PAYMENT_CONFIRMED", "payment": {"id": "pay_0"}})
+
+    assert statuses(session_factory, models.WebhookEvent, models.WebhookEvent.event_id) == ["evt_1", "PAYMENT_CONFIRMED:pay_0"]
+    assert client.post("/payments/webhook/asaas", content=b"not json").status_code == 400
+
+
+def test_burst_is_applied_in_grouped_transactions(client, seed, session_factory, queries):
+    paid_graph(seed, 30)
+    for i in range(30):
+        # PIX: CONFIRMED then RECEIVED for every payment, plus an event the worker ignores
+        for event in ("PAYMENT_CONFIRMED", "PAYMENT_RECEIVED", "PAYMENT_UPDATED"):
+            client.post("/payments/webhook/asaas", json={"id": f"evt_{event}_{i}", "event": event, "payment": {"id": f"pay_{i}"}})
+    client.post("/payments/webhook/asaas", json={"id": "evt_unknown", "event": "PAYMENT_RECEIVED", "payment": {"id": "pay_x"}})
+
+    worker = WebhookWorker(session_factory, batch_size=50)
+    with queries:
+        assert asyncio.run(worker.drain()) == 91
+
+    # 2 batches of 50 and a final empty read. Per batch: the events, their payments,
+    # then one executemany UPDATE per table (two for events, with and without error)
+    assert worker.batches == 2
+    assert queries.count <= 1 + 2 * 7, "\n".join(queries.statements)
+    assert set(statuses(session_factory, models.Order, models.Order.status)) == {"PAID"}
+    assert set(statuses(session_factory, models.Payment, models.Payment.status)) == {"PAID"}
+    assert statuses(session_factory, models.WebhookEvent, models.WebhookEvent.error).count("unknown payment") == 1
+
+    # Nothing left, redeliveries do not come back
+    client.post("/payments/webhook/asaas", json={"id": "evt_PAYMENT_RECEIVED_0", "event": "PAYMENT_RECEIVED", "payment": {"id": "pay_0"}})
+    assert asyncio.run(worker.drain()) == 0
+
+
+def test_closing_events_end_pending_charges_but_never_undo_a_payment(client, seed, session_factory):
+    paid_graph(seed, 3)
+    for event, payment in [("PAYMENT_RECEIVED", "pay_0"), ("PAYMENT_OVERDUE", "pay_0"), ("PAYMENT_OVERDUE", "pay_1"),
+                           ("PAYMENT_DELETED", "pay_2")]:
+        client.post("/payments/webhook/asaas", json={"event": event, "payment": {"id": payment}})
+    asyncio.run(WebhookWorker(session_factory).drain())
+    assert statuses(session_factory, models.Payment, models.Payment.status) == ["PAID", "OVERDUE", "DELETED"]
+
+    client.post("/payments/webhook/asaas", json={"event": "PAYMENT_REFUNDED", "payment": {"id": "pay_0"}})
+    asyncio.run(WebhookWorker(session_factory).drain())
+    assert statuses(session_factory, models.Payment, models.Payment.status)[0] == "REFUNDED"
+    assert statuses(session_factory, models.Order, models.Order.status) == ["CANCELLED", "PROPOSAL_RECEIVED", "PROPOSAL_RECEIVED"]
+
+
+def test_poison_event_is_parked_without_blocking_the_rest(client, seed, session_factory):
+    paid_graph(seed, 1)
+    # A charge that lost its proposal: applying it fails outside the database
+    seed(models.Payment(asaas_payment_id="pay_orphan", status="PENDING", amount=150.0))
+    for payment in ("pay_orphan", "pay_0"):
+        client.post("/payments/webhook/asaas", json={"event": "PAYMENT_RECEIVED", "payment": {"id": payment}})
+
+    worker = WebhookWorker(session_factory)
+    assert asyncio.run(worker.drain()) == 2
+    assert worker.failed == 1 and asyncio.run(worker.drain()) == 0
+    assert statuses(session_factory, models.Payment, models.Payment.status) == ["PAID", "PENDING"]
+    assert statuses(session_factory, models.WebhookEvent, models.WebhookEvent.error)[0].startswith("AttributeError")
+
+    assert client.post("/payments/webhook/asaas", json={"event": "PAYMENT_RECEIVED", "payment": "pay_0"}).status_code == 400
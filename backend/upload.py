@@ -1,24 +1,128 @@
+import asyncio
+import hashlib
 import shutil
 import os
-from fastapi import UploadFile
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from fastapi import HTTPException, UploadFile
 
 UPLOAD_DIR = "uploads"
 
+# Bytes copied per step, and the largest upload accepted (checked while streaming)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(20 * 1024 * 1024)))
+
+# Leading bytes of the file types users send (CRLV/CNH scans and photos)
+MAGIC_NUMBERS = [
+    (b"%PDF-", "application/pdf"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"PK\x03\x04", "application/zip"),
+]
+SNIFF_BYTES = 16
+
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
-async def save_upload_file(upload_file: UploadFile, session_id: str) -> str:
+
+@dataclass
+class StoredUpload:
+    path: str
+    size: int
+    sha256: str
+    content_type: str
+
+
+def sniff_content_type(head: bytes) -> str:
+    """MIME type from the file's first bytes, whatever the client claimed."""
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def _checked_type(head: bytes, allowed_types: Optional[Iterable[str]]) -> str:
+    content_type = sniff_content_type(head)
+    if allowed_types is not None and content_type not in allowed_types:
+        raise HTTPException(status_code=415, detail=f"File content is {content_type}")
+    return content_type
+
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    # hashlib and file writes release the GIL, one thread hop does both
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _commit(buffer, temp_path: str, file_path: str):
+    buffer.flush()
+    os.fsync(buffer.fileno())
+    buffer.close()
+    # Atomic on the same filesystem: readers see the old file or the whole new one
+    os.replace(temp_path, file_path)
+
+
+def _discard(buffer, temp_path: str):
+    buffer.close()
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+async def stream_upload(upload_file: UploadFile, file_path: str, max_size: int = None,
+                        allowed_types: Optional[Iterable[str]] = None, chunk_size: int = None) -> StoredUpload:
+    """
+    Copies an upload to file_path chunk by chunk, disk work in threads so the event
+    loop keeps serving other requests. Size limit (413), content sniffing (415) and
+    SHA-256 happen on the way; the file appears at file_path only once complete.
+    """
+    max_size = max_size or UPLOAD_MAX_SIZE
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    content_type = None
+
+    buffer = await asyncio.to_thread(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await upload_file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=413, detail=f"File larger than {max_size} bytes")
+            if content_type is None:
+                head += chunk[:SNIFF_BYTES]
+                if len(head) >= SNIFF_BYTES:
+                    content_type = _checked_type(head, allowed_types)
+            await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+
+        if content_type is None:
+            content_type = _checked_type(head, allowed_types)
+        await asyncio.to_thread(_commit, buffer, temp_path, file_path)
+    except BaseException:
+        await asyncio.to_thread(_discard, buffer, temp_path)
+        raise
+    finally:
+        await upload_file.close()
+
+    return StoredUpload(path=file_path, size=size, sha256=digest.hexdigest(), content_type=content_type)
+
+
+async def save_upload_file(upload_file: UploadFile, session_id: str) -> StoredUpload:
     # Create a session-specific directory
     session_dir = os.path.join(UPLOAD_DIR, session_id)
-    if not os.path.exists(session_dir):
-        os.makedirs(session_dir)
-        
-    file_path = os.path.join(session_dir, upload_file.filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
-        
-    return file_path
+    os.makedirs(session_dir, exist_ok=True)
+
+    # basename: a filename like "../../x" must not leave the session dir
+    file_path = os.path.join(session_dir, os.path.basename(upload_file.filename or "upload"))
+    return await stream_upload(upload_file, file_path)
 
 def cleanup_uploads(session_id: str):
     session_dir = os.path.join(UPLOAD_DIR, session_id)
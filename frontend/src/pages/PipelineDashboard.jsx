@@ -19,17 +19,41 @@ const PipelineDashboard = () => {
             const data = await res.json();
             if (data.data) {
                 setOrders(data.data);
-                setLastUpdated(data.last_updated);
+                // Last scrape, also sent on 304s (the body only changes with the data)
+                setLastUpdated(res.headers.get('X-Pipeline-Refreshed-At'));
             }
         } catch (error) {
             console.error("Failed to fetch pipeline data", error);
         }
     };
 
+    const applyEvent = (event) => {
+        if (event.event === 'row') {
+            setOrders(prev => {
+                const rest = prev.filter(o => o.id !== event.data.id);
+                return [...rest, event.data];
+            });
+        } else if (event.event === 'photo') {
+            setOrders(prev => prev.map(o => o.id === event.id ? { ...o, flag_foto: event.flag_foto } : o));
+        }
+    };
+
     const triggerRefresh = async () => {
         setLoading(true);
         try {
-            await fetch('http://127.0.0.1:8000/pipeline/refresh', { method: 'POST' });
+            // Rows and photo checks arrive as NDJSON while the scraper runs
+            const res = await fetch('http://127.0.0.1:8000/pipeline/refresh/stream', { method: 'POST' });
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.filter(Boolean).forEach(line => applyEvent(JSON.parse(line)));
+            }
             await fetchPipeline();
         } catch (error) {
             console.error("Failed to refresh", error);